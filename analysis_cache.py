@@ -0,0 +1,168 @@
+"""
+Content-addressed cache of Gemini analysis results.
+
+Entries are keyed by (SHA-256 of the image bytes, model name, SHA-256 of the prompt,
+temperature), so renaming a file, editing the CSV or rebuilding the metadata never
+pays for the same analysis twice, while a prompt or model change misses cleanly.
+
+    python analysis_cache.py stats
+    python analysis_cache.py evict [--max-entries N] [--older-than-days D]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = "analysis_cache.db"
+
+
+def sha256_hex(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(image_bytes, model, prompt, temperature):
+    """Builds the (image_sha256, model, prompt_sha256, temperature) key for one request."""
+    return (sha256_hex(image_bytes), model, sha256_hex(prompt), float(temperature))
+
+
+class AnalysisCache:
+    """SQLite-backed analysis cache with LRU/age eviction and hit-rate counters."""
+
+    def __init__(self, db_path=CACHE_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.session_hits = 0
+        self.session_misses = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " image_sha256 TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " prompt_sha256 TEXT NOT NULL,"
+            " temperature REAL NOT NULL,"
+            " analysis TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (image_sha256, model, prompt_sha256, temperature))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _bump(self, name):
+        self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key):
+        """Returns the cached analysis for `key`, or None. Counts the lookup as a hit or miss."""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT analysis FROM analyses "
+                "WHERE image_sha256 = ? AND model = ? AND prompt_sha256 = ? AND temperature = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.session_misses += 1
+                self._bump("misses")
+                return None
+            self.session_hits += 1
+            self._bump("hits")
+            self.conn.execute(
+                "UPDATE analyses SET last_used = ?, hits = hits + 1 "
+                "WHERE image_sha256 = ? AND model = ? AND prompt_sha256 = ? AND temperature = ?",
+                (time.time(), *key),
+            )
+        return json.loads(row[0])
+
+    def put(self, key, analysis):
+        """Stores a successful analysis for `key`."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses "
+                "(image_sha256, model, prompt_sha256, temperature, analysis, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (*key, json.dumps(analysis), now, now),
+            )
+
+    def stats(self):
+        """Returns entry count, on-disk size and lifetime/session hit rates."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            counters = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+        size_bytes = sum(
+            os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal") if os.path.exists(path)
+        )
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        session_total = self.session_hits + self.session_misses
+        return {
+            "entries": entries,
+            "size_bytes": size_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "session_hits": self.session_hits,
+            "session_misses": self.session_misses,
+            "session_hit_rate": self.session_hits / session_total if session_total else 0.0,
+        }
+
+    def evict(self, max_entries=None, older_than_days=None):
+        """Drops entries unused for `older_than_days`, then least recently used ones beyond `max_entries`."""
+        removed = 0
+        with self.lock, self.conn:
+            if older_than_days is not None:
+                cutoff = time.time() - older_than_days * 86400
+                removed += self.conn.execute("DELETE FROM analyses WHERE last_used < ?", (cutoff,)).rowcount
+            if max_entries is not None:
+                removed += self.conn.execute(
+                    "DELETE FROM analyses WHERE rowid IN ("
+                    " SELECT rowid FROM analyses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,),
+                ).rowcount
+        if removed:
+            with self.lock:
+                self.conn.execute("VACUUM")
+        return removed
+
+
+def print_stats(stats):
+    print(f"Entries:   {stats['entries']}")
+    print(f"Size:      {stats['size_bytes'] / 1024:.1f} KiB")
+    print(f"Lookups:   {stats['hits']} hits / {stats['misses']} misses (hit rate {stats['hit_rate']:.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the Gemini analysis cache.")
+    parser.add_argument("command", choices=["stats", "evict"])
+    parser.add_argument("--db", default=CACHE_FILE, help="Cache database path.")
+    parser.add_argument("--max-entries", type=int, help="Keep at most this many most recently used entries.")
+    parser.add_argument("--older-than-days", type=float, help="Drop entries not used for this many days.")
+    args = parser.parse_args()
+
+    with AnalysisCache(args.db) as cache:
+        if args.command == "evict":
+            if args.max_entries is None and args.older_than_days is None:
+                parser.error("evict needs --max-entries and/or --older-than-days")
+            print(f"Evicted {cache.evict(args.max_entries, args.older_than_days)} entries.")
+        print_stats(cache.stats())
@@ -0,0 +1,116 @@
+"""
+Recall/latency benchmark for the embedding index (embeddings.py).
+
+Embeds records with the offline hashing embedder (or uses an existing index), then
+compares IVF search at several probe counts with exact brute-force search: recall@k
+against the brute-force top-k, and median/p95 query latency. --scale grows the
+matrix with noisy copies of the real rows to see how both behave on a larger archive.
+
+    python benchmarks/bench_embeddings.py --synthetic 8700
+    python benchmarks/bench_embeddings.py --synthetic 8700 --scale 100000 --dtype float32
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embeddings
+from bench_search_index import synthetic_records
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def grow_matrix(index, target, seed=0):
+    """Replaces the index matrix with `target` rows: the originals plus noisy, renormalized copies."""
+    np = embeddings.np
+    rng = np.random.default_rng(seed)
+    base = np.asarray(index.matrix, dtype=np.float32)
+    copies = base[rng.integers(0, len(base), size=max(0, target - len(base)))]
+    copies = embeddings.normalize_rows(copies + rng.normal(0, 0.3 / np.sqrt(base.shape[1]), copies.shape))
+    path = os.path.join(index.directory, "scaled.npy")
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=index.matrix.dtype, shape=(target, base.shape[1]))
+    matrix[:len(base)] = base[:target]
+    matrix[len(base):] = copies
+    matrix.flush()
+    index.matrix = np.load(path, mmap_mode="r")
+    index.meta["ids"] = index.meta["ids"] + [f"copy-{i}" for i in range(len(copies))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="Embed this many synthetic records instead.")
+    parser.add_argument("--dir", default=None, help="Existing index directory (default: build a temporary one).")
+    parser.add_argument("--scale", type=int, default=0, help="Grow the matrix to this many rows.")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default=embeddings.EMBEDDING_DTYPE)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    if not embeddings.is_available():
+        print("numpy is required: pip install numpy")
+        return 1
+    np = embeddings.np
+
+    embedder = embeddings.HashingEmbedder()
+    if args.dir:
+        index = embeddings.VectorIndex(args.dir)
+        embedder = embeddings.index_embedder(index)
+    else:
+        if args.synthetic:
+            records = synthetic_records(args.synthetic)
+        else:
+            with open_store(STORE_FILE, METADATA_FILE) as store:
+                records = store.all_records()
+        index = embeddings.VectorIndex(tempfile.mkdtemp(prefix="bench_embeddings_"))
+        start = time.perf_counter()
+        embedded, total = index.update(records, embedder, args.dtype)
+        print(f"Embedded {embedded} texts for {total} records in {time.perf_counter() - start:.1f} s")
+    if not index.count():
+        print("No analysed records to embed. Use --synthetic N.")
+        return 1
+
+    if args.scale > index.count():
+        grow_matrix(index, args.scale)
+    start = time.perf_counter()
+    index.build_ivf()
+    print(f"Matrix: {index.matrix.shape[0]} x {index.matrix.shape[1]} {index.matrix.dtype}, "
+          f"{len(index.ivf['centroids'])} IVF lists (built in {time.perf_counter() - start:.1f} s)")
+
+    # Queries: short keyword strings, embedded once so only search time is measured
+    rng = np.random.default_rng(1)
+    vocabulary = sorted({word for record in synthetic_records(200) for word in record["ai_analysis"]["keywords"]})
+    texts = [" ".join(rng.choice(vocabulary, size=rng.integers(1, 4), replace=False)) for _ in range(args.queries)]
+    queries = embedder.embed(texts)
+
+    def run(use_ivf, probes=0):
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            rows, _ = index.search_vector(query, args.k, use_ivf, probes)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(set(rows.tolist()))
+        return latencies, results
+
+    exact_latencies, exact = run(False)
+    print(f"{'search':<14} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'brute force':<14} {1.0:>10.3f} {statistics.median(exact_latencies):>8.2f} {percentile(exact_latencies, 95):>8.2f}")
+    for probes in (int(p) for p in args.probes.split(",")):
+        if probes > len(index.ivf["centroids"]):
+            break
+        latencies, approx = run(True, probes)
+        recall = statistics.mean(len(a & e) / max(len(e), 1) for a, e in zip(approx, exact))
+        print(f"{'IVF probes=' + str(probes):<14} {recall:>10.3f} {statistics.median(latencies):>8.2f} {percentile(latencies, 95):>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
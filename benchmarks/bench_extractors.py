@@ -0,0 +1,78 @@
+"""
+Microbenchmark for the year-page extraction backends in extractors.py.
+
+Reports items per second for every installed backend on the saved fixture pages
+(tests/fixtures) and on a synthetic large year page. That the backends agree with
+the BeautifulSoup reference is checked by tests/test_extractors.py.
+
+    python benchmarks/bench_extractors.py [--repeat 20] [--large-items 800]
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from extractors import EXTRACTORS
+
+FIXTURES_DIR = os.path.join(ROOT, "tests", "fixtures")
+CONTAINER_RE = re.compile(r'<div class="imageItemContainer">.*?\n    </div>', re.S)
+
+
+def load_fixtures():
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "polaroids_*.html"))):
+        with open(path, "rb") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+def make_large_page(template, item_count):
+    """Repeats the containers of a fixture page until it holds `item_count` items."""
+    text = template.decode("utf-8")
+    containers = CONTAINER_RE.findall(text)
+    repeated = [containers[i % len(containers)] for i in range(item_count)]
+    start = text.index(containers[0])
+    end = text.index(containers[-1]) + len(containers[-1])
+    return (text[:start] + "\n".join(repeated) + text[end:]).encode("utf-8")
+
+
+def bench(extract, content, repeat):
+    item_count = len(extract(content)) # Warm up and count
+    start = time.perf_counter()
+    for _ in range(repeat):
+        extract(content)
+    elapsed = time.perf_counter() - start
+    return item_count * repeat / elapsed if elapsed else float("inf"), elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="Extractions per backend and page.")
+    parser.add_argument("--large-items", type=int, default=800, help="Items in the synthetic large page.")
+    args = parser.parse_args()
+
+    pages = load_fixtures()
+    if not pages:
+        print(f"No fixture pages found in {FIXTURES_DIR}.")
+        return 1
+
+    largest = max(pages.values(), key=len)
+    pages[f"synthetic_{args.large_items}_items"] = make_large_page(largest, args.large_items)
+
+    print(f"{'page':<28}{'backend':<12}{'items/s':>12}{'ms/page':>10}{'speedup':>9}")
+    for name, content in pages.items():
+        baseline = None
+        for backend, extract in EXTRACTORS.items():
+            rate, per_page = bench(extract, content, args.repeat)
+            baseline = baseline or rate
+            print(f"{name:<28}{backend:<12}{rate:>12,.0f}{per_page * 1000:>10.2f}{rate / baseline:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+End-to-end offline benchmark for scrape_polaroids and populate_ai_data.
+
+Starts a fake egonzippel.com (fake_site.py) and a fake Gemini endpoint
+(fake_gemini.py), then, for every scale, runs in a fresh working directory:
+
+    scrape         first scrape of every year page into polaroids_data.csv (run with
+                   --incremental, which fetches everything and records the validators)
+    rescrape       second --incremental scrape; every page should answer 304
+    populate       sync, download every image, analyse every image
+    populate again picks up what the first run could not finish (failed downloads,
+                   images still throttled after MAX_ATTEMPTS)
+    rerun failed   --rerun failed: analyses that ended in an error (malformed replies)
+
+Each stage runs in its own process and is measured there: wall time, throughput
+and peak RSS. The stage's metrics report (metrics.py) adds the API latency
+percentiles. Error recovery compares the faults that were injected with what ended
+up in the metadata store.
+
+The request budget is lifted (--rpm) so the pipeline itself is measured, not the
+quota; pass --rpm 600 to see how long a backfill takes under the real budget.
+
+    python benchmarks/bench_pipeline.py                                   # 1k items
+    python benchmarks/bench_pipeline.py --scales 1000 10000 100000 --output results.json
+    python benchmarks/bench_pipeline.py --latency 0.5 --jitter 0.5 --rate-429 0.05 --rate-503 0.01 \\
+        --rate-malformed 0.01 --image-error-rate 0.01
+    python benchmarks/bench_pipeline.py --baseline results.json          # exits 1 on a regression
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_gemini import FakeGeminiServer
+from fake_site import FakeSite
+
+STAGES = ("scrape", "rescrape", "populate", "populate_again", "rerun_failed")
+REPORTED_TIMINGS = ("api_request_seconds", "download_seconds", "rate_limit_wait_seconds", "store_write_seconds")
+
+
+def run_stage(args):
+    """Child process: runs one pipeline stage in the current directory and writes its metrics report."""
+    from metrics import METRICS
+
+    if args.stage in ("scrape", "rescrape"):
+        import scrape_polaroids
+        scrape_polaroids.BASE_URL = args.site_url
+        METRICS.set_info(stage=args.stage)
+        scrape_polaroids.scrape_polaroids(workers=args.scrape_workers, requests_per_second=args.scrape_rate,
+                                          burst=args.scrape_workers, incremental=True)
+        METRICS.write_report(args.stage)
+    else:
+        import populate_ai_data
+        populate_ai_data.API_KEY = "dummy"
+        populate_ai_data.BASE_URL = args.gemini_url
+        populate_ai_data.REQUESTS_PER_MINUTE = args.rpm
+        populate_ai_data.MAX_WORKERS = args.workers
+        populate_ai_data.main(mode=args.mode, pack_size=args.pack_size,
+                              rerun=["failed"] if args.stage == "rerun_failed" else [])
+        METRICS.write_report(args.stage)
+
+
+def measure_stage(stage, work_dir, child_args):
+    """Runs `stage` in a child process. Returns its wall time, peak RSS and metrics report."""
+    log_path = os.path.join(work_dir, f"{stage}.log")
+    command = [sys.executable, os.path.abspath(__file__), "--stage", stage, *child_args]
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code:
+        print(f"  {stage} exited with {exit_code}; see {log_path}")
+
+    reports = sorted(glob.glob(os.path.join(work_dir, "metrics", f"{stage}-*.json")), key=os.path.getmtime)
+    report = {}
+    if reports:
+        with open(reports[-1]) as f:
+            report = json.load(f)
+    return {
+        "wall_seconds": wall,
+        "peak_rss_mb": usage.ru_maxrss / 1024, # ru_maxrss is in KiB on Linux
+        "exit_code": exit_code,
+        "metrics": report,
+    }
+
+
+def store_outcome(work_dir):
+    """Counts records in the run's metadata store by analysis outcome."""
+    from metadata_store import MetadataStore
+
+    outcome = {"records": 0, "analysed": 0, "pending": 0, "errors": {}}
+    db_path = os.path.join(work_dir, "image_metadata.db")
+    if not os.path.exists(db_path):
+        return outcome
+    store = MetadataStore(db_path)
+    for record in store.iter_records():
+        outcome["records"] += 1
+        analysis = record.get("ai_analysis")
+        if analysis is None:
+            outcome["pending"] += 1
+        elif isinstance(analysis, dict) and analysis.get("error"):
+            outcome["errors"][analysis["error"]] = outcome["errors"].get(analysis["error"], 0) + 1
+        else:
+            outcome["analysed"] += 1
+    store.close()
+    return outcome
+
+
+def run_scale(items, args):
+    """Runs every stage for `items` polaroids. Returns the result dict for this scale."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench_pipeline_{items}_")
+    site = FakeSite(items, latency=args.site_latency, image_error_rate=args.image_error_rate).start()
+    gemini = FakeGeminiServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                              rate_503=args.rate_503, rate_malformed=args.rate_malformed,
+                              retry_after=args.retry_after).start()
+    child_args = [
+        "--site-url", site.base_url, "--gemini-url", gemini.base_url,
+        "--scrape-workers", str(args.scrape_workers), "--scrape-rate", str(args.scrape_rate),
+        "--rpm", str(args.rpm), "--workers", str(args.workers), "--mode", args.mode,
+        "--pack-size", str(args.pack_size),
+    ]
+    result = {"items": site.item_count, "work_dir": work_dir, "stages": {}, "outcomes": {}}
+    try:
+        for stage in STAGES:
+            print(f"[{items}] {stage} ...")
+            result["stages"][stage] = measure_stage(stage, work_dir, child_args)
+            if stage not in ("scrape", "rescrape"):
+                result["outcomes"][stage] = store_outcome(work_dir)
+    finally:
+        site.stop()
+        gemini.stop()
+    result["site"] = dict(site.stats)
+    result["gemini"] = dict(gemini.stats)
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def stage_throughput(stage, result):
+    """Items per second a stage handled: every catalogued item for scrapes, analyses for populate runs."""
+    wall = result["stages"][stage]["wall_seconds"]
+    counters = result["stages"][stage]["metrics"].get("counters", {})
+    done = result["items"] if stage in ("scrape", "rescrape") else counters.get("images_analysed", 0)
+    return done / wall if wall else 0.0
+
+
+def print_result(result):
+    print(f"\n=== {result['items']} items ===")
+    print(f"{'stage':16} {'wall s':>9} {'items/s':>10} {'peak RSS MB':>12}   p50/p95/p99 ms")
+    for stage, measured in result["stages"].items():
+        histograms = measured["metrics"].get("histograms", {})
+        latencies = "  ".join(
+            f"{name.replace('_seconds', '')} {h['p50'] * 1000:.0f}/{h['p95'] * 1000:.0f}/{h['p99'] * 1000:.0f}"
+            for name, h in histograms.items() if name in REPORTED_TIMINGS and h["count"]
+        )
+        print(f"{stage:16} {measured['wall_seconds']:9.1f} {stage_throughput(stage, result):10.1f} "
+              f"{measured['peak_rss_mb']:12.0f}   {latencies}")
+
+    site, gemini = result["site"], result["gemini"]
+    print(f"Injected faults: {site['image_errors']} image 503s, {gemini['injected_429']} API 429s, "
+          f"{gemini['injected_503']} API 503s, {gemini['injected_malformed']} malformed replies "
+          f"({gemini['completions']} completions)")
+    for stage, outcome in result["outcomes"].items():
+        errors = ", ".join(f"{count} {error}" for error, count in sorted(outcome["errors"].items())) or "no errors"
+        print(f"After {stage:15} {outcome['records']}/{result['items']} records, {outcome['analysed']} analysed, "
+              f"{outcome['pending']} pending, {errors}")
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """Prints wall-time changes against an earlier --output file. Returns False if any stage regressed."""
+    with open(baseline_path) as f:
+        baseline = {entry["items"]: entry for entry in json.load(f)["results"]}
+    ok = True
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for result in results:
+        before = baseline.get(result["items"])
+        if not before:
+            print(f"  {result['items']} items: not in the baseline")
+            continue
+        for stage, measured in result["stages"].items():
+            if stage not in before["stages"]:
+                continue
+            old, new = before["stages"][stage]["wall_seconds"], measured["wall_seconds"]
+            change = (new - old) / old if old else 0.0
+            regressed = change > tolerance
+            ok = ok and not regressed
+            print(f"  {result['items']:>7} {stage:16} {old:8.1f} s -> {new:8.1f} s  {change:+6.0%}"
+                  + ("  REGRESSION" if regressed else ""))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000], help="Item counts to benchmark.")
+    parser.add_argument("--mode", choices=["threads", "async"], default="threads", help="populate_ai_data mode.")
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=10, help="Starting API concurrency (MAX_WORKERS).")
+    parser.add_argument("--rpm", type=int, default=60000, help="Request budget per minute for the run.")
+    parser.add_argument("--scrape-workers", type=int, default=4)
+    parser.add_argument("--scrape-rate", type=float, default=100.0, help="Scraper requests per second.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake chat completion.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra random seconds per completion.")
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--rate-503", type=float, default=0.01)
+    parser.add_argument("--rate-malformed", type=float, default=0.005)
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429.")
+    parser.add_argument("--site-latency", type=float, default=0.0, help="Seconds per fake site response.")
+    parser.add_argument("--image-error-rate", type=float, default=0.005, help="Share of image downloads failing.")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directories (logs, stores, reports).")
+    parser.add_argument("--output", help="Write the results as JSON, e.g. as a later --baseline.")
+    parser.add_argument("--baseline", help="Earlier --output file to compare wall times with.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a stage counts as regressed.")
+    # Used by the child processes
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--site-url", help=argparse.SUPPRESS)
+    parser.add_argument("--gemini-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args)
+        return 0
+
+    results = []
+    for items in args.scales:
+        result = run_scale(items, args)
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+                       "results": results}, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if args.baseline and not compare_with_baseline(results, args.baseline, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Before/after benchmark for the image preprocessing stage.
+
+For a sample of images, reports the bytes that would be uploaded (base64 payload)
+with the original files and with the preprocessed copies, and optionally times
+real analysis requests for both variants.
+
+    python benchmarks/bench_preprocess.py --sample 20
+    python benchmarks/bench_preprocess.py --synthetic 10 --skip-api
+    GEMINI_BASE_URL=http://127.0.0.1:8081/v1/ GEMINI_API_KEY=dummy python benchmarks/bench_preprocess.py
+"""
+import argparse
+import base64
+import glob
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_preprocess
+import populate_ai_data
+from openai import OpenAI
+
+
+def make_synthetic_images(directory, count, size=(3000, 2400)):
+    """Writes `count` large, sketch-like JPEGs (white card, dark strokes, sensor noise)."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(42)
+    paths = []
+    for i in range(count):
+        img = Image.effect_noise(size, 12).convert("RGB").point(lambda v: 200 + v // 5)
+        draw = ImageDraw.Draw(img)
+        for _ in range(120):
+            points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(4)]
+            draw.line(points, fill=(rng.randrange(60), rng.randrange(60), rng.randrange(120)), width=rng.randrange(2, 9))
+        img = img.filter(ImageFilter.SMOOTH)
+        path = os.path.join(directory, f"2020-01-{i + 1:02d}.jpg")
+        img.save(path, quality=95)
+        paths.append(path)
+    return paths
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def time_requests(client, variants):
+    latencies = []
+    for path, mime_type in variants:
+        with open(path, "rb") as f:
+            payload = base64.b64encode(f.read()).decode("utf-8")
+        start = time.perf_counter()
+        populate_ai_data.get_gemini_analysis(client, payload, mime_type, path)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-dir", default=populate_ai_data.SCRAPED_IMAGES_DIR)
+    parser.add_argument("--sample", type=int, default=20, help="Images to sample from --images-dir.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate this many synthetic images instead.")
+    parser.add_argument("--max-side", type=int, default=image_preprocess.MAX_SIDE)
+    parser.add_argument("--format", default=image_preprocess.OUTPUT_FORMAT, choices=list(image_preprocess.FORMAT_EXTENSIONS))
+    parser.add_argument("--quality", type=int, default=image_preprocess.QUALITY)
+    parser.add_argument("--skip-api", action="store_true", help="Only report payload sizes.")
+    args = parser.parse_args()
+
+    if not image_preprocess.is_available():
+        print("Pillow is required: pip install Pillow")
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix="bench_preprocess_")
+    if args.synthetic:
+        paths = make_synthetic_images(workdir, args.synthetic)
+    else:
+        paths = sorted(glob.glob(os.path.join(args.images_dir, "*.jp*g")))
+        paths = random.Random(0).sample(paths, min(args.sample, len(paths)))
+    if not paths:
+        print(f"No images found in {args.images_dir}. Use --synthetic N.")
+        return 1
+
+    cache_dir = os.path.join(workdir, "preprocessed")
+    originals, processed = [], []
+    start = time.perf_counter()
+    for path in paths:
+        result = image_preprocess.preprocess_image(path, cache_dir, args.max_side, args.format, args.quality)
+        if result:
+            originals.append((path, populate_ai_data.get_image_mime_type(path)))
+            processed.append(result)
+    prep_time = time.perf_counter() - start
+
+    def payload_bytes(variants):
+        return [4 * ((os.path.getsize(path) + 2) // 3) for path, _ in variants] # base64 length
+
+    before, after = payload_bytes(originals), payload_bytes(processed)
+    print(f"Images: {len(originals)}  settings: {args.max_side}px {args.format} q{args.quality}")
+    print(f"Preprocessing: {prep_time / len(originals) * 1000:.1f} ms/image (first run, uncached)")
+    print(f"Upload bytes (base64)  before: {sum(before) / 1e6:8.2f} MB  mean {statistics.mean(before) / 1e3:8.1f} KB")
+    print(f"                       after:  {sum(after) / 1e6:8.2f} MB  mean {statistics.mean(after) / 1e3:8.1f} KB"
+          f"  ({sum(after) / sum(before):.1%} of original)")
+
+    if args.skip_api:
+        return 0
+    if not populate_ai_data.API_KEY:
+        print("GEMINI_API_KEY not set; skipping the latency comparison (use --skip-api to silence).")
+        return 0
+
+    client = OpenAI(api_key=populate_ai_data.API_KEY, base_url=populate_ai_data.BASE_URL, max_retries=0)
+    for label, variants in (("before", originals), ("after", processed)):
+        latencies = time_requests(client, variants)
+        print(f"Request latency {label:<6} p50 {percentile(latencies, 50) * 1000:8.0f} ms"
+              f"  p95 {percentile(latencies, 95) * 1000:8.0f} ms  mean {statistics.mean(latencies) * 1000:8.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
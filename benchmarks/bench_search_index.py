@@ -0,0 +1,146 @@
+"""
+Size and load-time benchmark for the prebuilt search shards (export_search_index.py).
+
+Compares the page's fallback (download every record, build the Lunr index) with
+the exported shards (download manifest + one year, load the prebuilt index) and
+reports bytes on the wire and time to first search. Times are measured with the
+Python lunr port, so they are a proxy; bench_search_page.py measures the page
+itself in a browser.
+
+    python benchmarks/bench_search_index.py                  # uses image_metadata.db / .json
+    python benchmarks/bench_search_index.py --synthetic 8700
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_search_index
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+WORDS = ("train subway platform coffee morning rain umbrella dog portrait street bench skyline window hat "
+         "waiting tired brooklyn manhattan bridge pigeon taxi bagel newspaper crowd shadow light night "
+         "winter summer friend stranger conversation music guitar smile sleep dream city sky").split()
+
+
+def synthetic_records(count, seed=7):
+    """Catalogue-shaped records spread over 1989-2025, with OCR text, descriptions and keywords."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        year = 1989 + i * 37 // count
+        month, day = rng.randint(1, 12), rng.randint(1, 28)
+        filename = f"{year}-{month:02d}-{day:02d}{rng.choice(['', '', 'B', '2'])}.jpg"
+        records.append({
+            "local_path": f"scraped_images/{filename}",
+            "filename": filename,
+            "image_url": f"https://egonzippel.com/images/{filename}",
+            "thumbnail_url": f"https://egonzippel.com/thumbs/{filename}",
+            "source_page": f"https://egonzippel.com/polaroids/{year}/1/{i}",
+            "year": str(year), "month": f"{month:02d}", "day": f"{day:02d}",
+            "suffix_original": "", "sortable_suffix": "0", "extension": "jpg",
+            "ai_analysis": {
+                "ocr_text": " ".join(rng.choices(WORDS, k=rng.randint(3, 25))) + " Egon NYC",
+                "visual_description": "A sketch of " + " ".join(rng.choices(WORDS, k=rng.randint(8, 20))) + ".",
+                "keywords": rng.sample(WORDS, rng.randint(3, 7)),
+            },
+        })
+    records.sort(key=lambda r: (r["year"], r["month"], r["day"], r["filename"]))
+    return records
+
+
+def timed(fn, repeat):
+    """Median wall time of `fn()` over `repeat` runs, and its last result."""
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark this many synthetic records instead.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--query", default="subway morning")
+    args = parser.parse_args()
+
+    if not export_search_index.is_available():
+        print("The lunr package is required: pip install lunr")
+        return 1
+    from lunr import lunr
+    from lunr.index import Index
+
+    if args.synthetic:
+        records = synthetic_records(args.synthetic)
+    else:
+        with open_store(STORE_FILE, METADATA_FILE) as store:
+            records = store.all_records()
+    if not records:
+        print("No records found. Use --synthetic N.")
+        return 1
+
+    output_dir = tempfile.mkdtemp(prefix="bench_search_index_")
+    export_time, manifest = timed(lambda: export_search_index.export_search_index(records, output_dir), 1)
+    shards = manifest["shards"]
+
+    # Today: one JSON with every record, index built on page load
+    full_gz = gzip.compress(json.dumps(records).encode("utf-8"), 9)
+
+    def build_from_full():
+        data = json.loads(gzip.decompress(full_gz))
+        documents = [export_search_index.index_document(str(i), record) for i, record in enumerate(data)]
+        index = lunr(ref="id", fields=export_search_index.INDEX_FIELDS, documents=documents)
+        return index.search(args.query)
+
+    # Prebuilt: manifest + the newest year's shard, index deserialized instead of built
+    def read_gz(name):
+        with open(os.path.join(output_dir, name + ".gz"), "rb") as f:
+            return json.loads(gzip.decompress(f.read()))
+
+    def load_shard(shard):
+        display_records = read_gz(shard["records"])
+        return Index.load(read_gz(shard["index"])).search(args.query), display_records
+
+    def first_search():
+        newest = read_gz("manifest.json")["shards"][-1]
+        return load_shard(newest)
+
+    def all_years():
+        # A query without a year: the index over all years plus every year's records
+        manifest = read_gz("manifest.json")
+        display_records = [record for shard in manifest["shards"] for record in read_gz(shard["records"])]
+        return Index.load(read_gz(manifest["all"]["index"])).search(args.query), display_records
+
+    full_time, _ = timed(build_from_full, args.repeat)
+    first_time, _ = timed(first_search, args.repeat)
+    all_time, _ = timed(all_years, args.repeat)
+
+    def total(kind, encoding):
+        return sum(shard["bytes"][kind].get(encoding, 0) for shard in shards)
+
+    newest = shards[-1]
+    manifest_gz = os.path.getsize(os.path.join(output_dir, "manifest.json.gz"))
+    print(f"Records: {len(records)} in {len(shards)} year shards (export took {export_time:.1f} s)")
+    print(f"Full records JSON (today):   {len(full_gz) / 1e3:9.0f} KB gzip")
+    all_index = manifest["all"]["bytes"]
+    print(f"All years, index + records:  {(all_index['gzip'] + total('records', 'gzip')) / 1e3:9.0f} KB gzip"
+          + (f"  {(all_index['br'] + total('records', 'br')) / 1e3:.0f} KB brotli" if "br" in manifest["encodings"] else ""))
+    print(f"First search (manifest + {newest['year']}): "
+          f"{(manifest_gz + newest['bytes']['index']['gzip'] + newest['bytes']['records']['gzip']) / 1e3:.0f} KB gzip")
+    print(f"Time to first search  today (load all + build index): {full_time * 1000:8.0f} ms")
+    print(f"                      prebuilt, newest year only:      {first_time * 1000:8.0f} ms")
+    print(f"                      prebuilt, query without a year:  {all_time * 1000:8.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
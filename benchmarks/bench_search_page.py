@@ -0,0 +1,249 @@
+"""
+Time-to-first-search for the web page in a real browser, prebuilt shards vs full JSON.
+
+Builds a local copy of the site (index.html, style.css, search_logic.js pointed at
+this server) with both data layouts the page understands:
+
+    shards   search_index/manifest.json + per-year shards (export_search_index.py),
+             loaded lazily: a query with a year fetches only that year, one
+             without a year the index over all years and every year's records
+    full     search_index/ answers 404, so the page falls back to downloading
+             image_metadata_search.json and building the Lunr index itself
+
+JSON is served gzipped with Content-Encoding, like the R2 bucket. For each layout
+and query a fresh headless Chromium context (cold cache) opens the page, waits for
+the page's `search-ready` mark, submits the query and waits for `search-done`.
+Reported: time until the page is ready, the search itself, navigation start to
+first results, and bytes sent by the server. --download-kbps/--latency-ms emulate
+a slower network through the DevTools protocol.
+
+Needs Playwright (pip install playwright && playwright install chromium).
+index.html loads lunr.js from unpkg; pass --lunr-js to serve a local copy instead.
+Without Playwright, --serve keeps the server running for measuring by hand.
+
+    python benchmarks/bench_search_page.py --synthetic 8700
+    python benchmarks/bench_search_page.py --synthetic 8700 --download-kbps 1600 --latency-ms 150
+    python benchmarks/bench_search_page.py --synthetic 8700 --serve --port 8090
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from playwright.sync_api import sync_playwright
+except ImportError:
+    sync_playwright = None
+
+import export_search_index
+from bench_search_index import synthetic_records
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+R2_URL = "https://pub-2bf02060093645f29ead1fe093065db8.r2.dev/"
+UNPKG_LUNR = "https://unpkg.com/lunr/lunr.min.js"
+# Fields worker/src/exporter.js keeps in image_metadata_search.json
+SEARCH_FIELDS = ("filename", "year", "month", "day", "image_url", "thumbnail_url", "source_page", "ai_analysis",
+                 "derivatives")
+LAYOUTS = ("shards", "full")
+PAGE_TIMEOUT_MS = 120000
+
+
+def search_json_records(records):
+    """What the worker exports to image_metadata_search.json: analysed records, page fields only."""
+    return [{field: record[field] for field in SEARCH_FIELDS if field in record}
+            for record in records if record.get("ai_analysis") and not record["ai_analysis"].get("error")]
+
+
+def build_site(records, site_dir, base_url, lunr_js=None):
+    """Writes the page, the full search JSON and the shards into `site_dir`, pointed at `base_url`."""
+    for name in ("index.html", "style.css", "search_logic.js"):
+        with open(os.path.join(ROOT, name)) as f:
+            text = f.read().replace(R2_URL, base_url)
+        if name == "index.html" and lunr_js:
+            text = text.replace(UNPKG_LUNR, "lunr.js")
+        with open(os.path.join(site_dir, name), "w") as f:
+            f.write(text)
+    if lunr_js:
+        shutil.copyfile(lunr_js, os.path.join(site_dir, "lunr.js"))
+
+    payload = json.dumps(search_json_records(records)).encode("utf-8")
+    export_search_index.write_compressed(os.path.join(site_dir, "image_metadata_search.json"), payload)
+    return export_search_index.export_search_index(records, os.path.join(site_dir, "search_index"))
+
+
+class SiteServer:
+    """Static server for the site copy; serves .gz siblings with Content-Encoding and counts bytes sent."""
+
+    def __init__(self, site_dir, host="127.0.0.1", port=0):
+        self.site_dir = site_dir
+        self.layout = "shards"
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def take_bytes(self):
+        with self.lock:
+            sent, self.bytes_sent = self.bytes_sent, 0
+        return sent
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=server.site_dir, **kwargs)
+
+            def log_message(self, *args):
+                pass
+
+            def end_headers(self):
+                self.send_header("Cache-Control", "no-store")
+                super().end_headers()
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if server.layout == "full" and path.startswith("/search_index/"):
+                    self.send_error(404)
+                    return
+                local = self.translate_path(path)
+                gzipped = "gzip" in self.headers.get("Accept-Encoding", "") and os.path.exists(local + ".gz")
+                served = local + ".gz" if gzipped else local
+                with server.lock:
+                    server.bytes_sent += os.path.getsize(served) if os.path.isfile(served) else 0
+                if not gzipped:
+                    super().do_GET()
+                    return
+                with open(served, "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header("Content-Type", self.guess_type(local))
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def measure(browser, url, query, download_kbps, latency_ms):
+    """One cold page load and search. Returns the page's timings in milliseconds."""
+    context = browser.new_context()
+    page = context.new_page()
+    if download_kbps or latency_ms:
+        cdp = context.new_cdp_session(page)
+        cdp.send("Network.enable")
+        throughput = download_kbps * 1000 / 8 if download_kbps else -1
+        cdp.send("Network.emulateNetworkConditions", {"offline": False, "latency": latency_ms,
+                                                      "downloadThroughput": throughput,
+                                                      "uploadThroughput": throughput})
+    page.goto(url)
+    page.wait_for_function("performance.getEntriesByName('search-ready').length > 0", timeout=PAGE_TIMEOUT_MS)
+    page.fill("#searchInput", query)
+    submitted = page.evaluate("performance.now()")
+    page.press("#searchInput", "Enter")
+    page.wait_for_function("performance.getEntriesByName('search-done').length > 0", timeout=PAGE_TIMEOUT_MS)
+    timings = page.evaluate("""() => ({
+        ready: performance.getEntriesByName('search-ready')[0].startTime,
+        done: performance.getEntriesByName('search-done')[0].startTime,
+        results: document.querySelectorAll('.result-item').length,
+    })""")
+    context.close()
+    return {
+        "ready_ms": timings["ready"],
+        "search_ms": timings["done"] - submitted,
+        "first_results_ms": timings["ready"] + (timings["done"] - submitted), # Without the typing time
+        "results": timings["results"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark this many synthetic records instead.")
+    parser.add_argument("--queries", nargs="+", default=["subway morning", "subway 2011"])
+    parser.add_argument("--repeat", type=int, default=3, help="Cold page loads per layout and query.")
+    parser.add_argument("--download-kbps", type=float, default=0, help="Emulated download speed (0: unthrottled).")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Emulated round-trip latency.")
+    parser.add_argument("--lunr-js", help="Local lunr.js to serve instead of loading it from unpkg.")
+    parser.add_argument("--serve", action="store_true", help="Only serve the site (shards layout) until Ctrl-C.")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    if not export_search_index.is_available():
+        print("The lunr package is required: pip install lunr")
+        return 1
+    if not args.serve and sync_playwright is None:
+        print("Playwright is required: pip install playwright && playwright install chromium (or use --serve).")
+        return 1
+
+    if args.synthetic:
+        records = synthetic_records(args.synthetic)
+    else:
+        with open_store(STORE_FILE, METADATA_FILE) as store:
+            records = store.all_records()
+    if not records:
+        print("No records found. Use --synthetic N.")
+        return 1
+
+    site_dir = tempfile.mkdtemp(prefix="bench_search_page_")
+    server = SiteServer(site_dir, port=args.port)
+    manifest = build_site(records, site_dir, server.base_url, args.lunr_js)
+    full_gz = os.path.getsize(os.path.join(site_dir, "image_metadata_search.json.gz"))
+    print(f"{manifest['total']} records in {len(manifest['shards'])} year shards; "
+          f"full search JSON {full_gz / 1e3:.0f} KB gzip")
+
+    server.start()
+    try:
+        if args.serve:
+            print(f"Serving {site_dir} at {server.base_url}index.html (Ctrl-C to stop)")
+            threading.Event().wait()
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch()
+            print(f"{'layout':8} {'query':24} {'ready ms':>9} {'search ms':>10} {'first results ms':>17} "
+                  f"{'KB sent':>9} {'results':>8}")
+            for layout in LAYOUTS:
+                server.layout = layout
+                for query in args.queries:
+                    runs, sent = [], []
+                    for _ in range(args.repeat):
+                        server.take_bytes()
+                        runs.append(measure(browser, server.base_url + "index.html", query,
+                                            args.download_kbps, args.latency_ms))
+                        sent.append(server.take_bytes())
+                    median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+                    print(f"{layout:8} {query:24} {median['ready_ms']:9.0f} {median['search_ms']:10.0f} "
+                          f"{median['first_results_ms']:17.0f} {statistics.median(sent) / 1e3:9.0f} "
+                          f"{median['results']:8.0f}")
+            browser.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        shutil.rmtree(site_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
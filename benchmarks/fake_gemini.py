@@ -0,0 +1,338 @@
+"""
+Local stand-in for the OpenAI-compatible Gemini endpoint.
+
+Implements just enough of the API for populate_ai_data: chat completions (single
+and packed multi-image), embeddings, file upload/download and the Batch API (create,
+retrieve, output file). Answers are deterministic synthetic analyses derived from a hash of
+the request.
+
+Chat completions can be slowed down (--latency, --jitter) and made to fail at given
+rates: 429 with Retry-After, 503, or a 200 whose content is not valid JSON, to see
+how the pipeline recovers. Counts of what was injected are kept in `stats`.
+
+    python benchmarks/fake_gemini.py --port 8081
+    python benchmarks/fake_gemini.py --latency 0.8 --jitter 0.4 --rate-429 0.05 --rate-503 0.01 --rate-malformed 0.01
+    GEMINI_API_KEY=dummy GEMINI_BASE_URL=http://127.0.0.1:8081/v1/ python populate_ai_data.py --mode batch
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KEYWORD_POOL = ["subway", "portrait", "street", "coffee", "bench", "skyline", "dog", "rain", "hat", "window"]
+
+
+def synthetic_analysis(seed_text):
+    """Deterministic analysis JSON for a request, so repeated runs give identical output."""
+    digest = hashlib.sha256(seed_text.encode("utf-8")).digest()
+    keywords = [KEYWORD_POOL[b % len(KEYWORD_POOL)] for b in digest[:4]]
+    return {
+        "ocr_text": f"Egon NYC {digest.hex()[:6]}",
+        "visual_description": f"A sketch of a {keywords[0]} near a {keywords[1]}.",
+        "keywords": list(dict.fromkeys(keywords)),
+    }
+
+
+def packed_filenames(body):
+    """Filenames announced before each image in a multi-image (packed) request."""
+    filenames = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                text = part.get("text", "") if part.get("type") == "text" else ""
+                if text.startswith("Image filename: "):
+                    filenames.append(text[len("Image filename: "):].strip())
+    return filenames
+
+
+def chat_completion(body):
+    """Builds a chat.completion object answering `body` (a chat-completions request)."""
+    seed = json.dumps(body.get("messages", []), sort_keys=True)
+    filenames = packed_filenames(body)
+    if filenames:
+        content = json.dumps({"results": [dict(synthetic_analysis(seed + name), filename=name) for name in filenames]})
+    else:
+        content = json.dumps(synthetic_analysis(seed))
+    return {
+        "id": "chatcmpl-" + hashlib.sha1(seed.encode("utf-8")).hexdigest()[:12],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake-gemini"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 300, "completion_tokens": 60, "total_tokens": 360},
+    }
+
+
+def embedding_response(body, dim=64):
+    """Deterministic unit vectors, one per input text."""
+    inputs = body.get("input", [])
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    data = []
+    for index, text in enumerate(inputs):
+        digest = b"".join(hashlib.sha256(f"{text}:{block}".encode("utf-8")).digest() for block in range(dim // 32 + 1))
+        vector = [byte / 127.5 - 1 for byte in digest[:dim]]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        data.append({"object": "embedding", "index": index, "embedding": [v / norm for v in vector]})
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "fake-embedding"),
+        "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+    }
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded server that does not print a traceback when a client drops its keep-alive connection."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def malformed_completion(body):
+    """A chat.completion whose content was cut off mid-JSON, as a reply hitting max_tokens looks."""
+    completion = chat_completion(body)
+    content = completion["choices"][0]["message"]["content"]
+    completion["choices"][0]["message"]["content"] = content[:len(content) // 2]
+    completion["choices"][0]["finish_reason"] = "length"
+    return completion
+
+
+class FakeGeminiServer:
+    """
+    Threaded HTTP server holding uploaded files and batch jobs in memory.
+    Chat completions wait `latency` (+ up to `jitter`) seconds and fail at the given rates.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, batch_delay=0.5, latency=0.0, jitter=0.0,
+                 rate_429=0.0, rate_503=0.0, rate_malformed=0.0, retry_after=1, seed=7):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.rate_malformed = rate_malformed
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.requests_served = 0
+        self.stats = {"completions": 0, "injected_429": 0, "injected_503": 0, "injected_malformed": 0}
+        self.httpd = QuietHTTPServer((host, port), self._make_handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def draw_fault(self):
+        """Picks the outcome of one chat completion: None, "429", "503" or "malformed"."""
+        with self.lock:
+            roll = self.rng.random()
+            delay = self.latency + self.rng.random() * self.jitter
+        fault = None
+        for name, rate in (("429", self.rate_429), ("503", self.rate_503), ("malformed", self.rate_malformed)):
+            if roll < rate:
+                fault = name
+                break
+            roll -= rate
+        with self.lock:
+            self.stats["completions"] += 1
+            if fault:
+                self.stats[f"injected_{fault}"] += 1
+        return fault, delay
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-{next(self.ids)}"
+
+    def add_file(self, filename, purpose, content):
+        file_id = self.new_id("file")
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return self.files[file_id]
+
+    def create_batch(self, body):
+        batch_id = self.new_id("batch")
+        input_file = self.files[body["input_file_id"]]
+        total = sum(1 for line in input_file["content"].splitlines() if line.strip())
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": total, "completed": 0, "failed": 0},
+        }
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return self.batches[batch_id]
+
+    def _run_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["status"] = "in_progress"
+        time.sleep(self.batch_delay)
+        output_lines = []
+        for line in self.files[batch["input_file_id"]]["content"].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                "id": self.new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": "", "body": chat_completion(request["body"])},
+                "error": None,
+            }))
+            batch["request_counts"]["completed"] += 1
+        output = self.add_file(f"{batch_id}_output.jsonl", "batch_output", ("\n".join(output_lines) + "\n").encode())
+        batch["output_file_id"] = output["id"]
+        batch["status"] = "completed"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _send(self, status, payload, content_type="application/json", headers=None):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _not_found(self):
+                self._send(404, {"error": {"message": f"No route for {self.command} {self.path}", "code": 404}})
+
+            def do_POST(self):
+                server.requests_served += 1
+                body = self._read_body()
+                path = self.path.split("?")[0]
+                if path.endswith("/chat/completions"):
+                    self._chat(json.loads(body))
+                elif path.endswith("/embeddings"):
+                    self._send(200, embedding_response(json.loads(body)))
+                elif path.endswith("/files"):
+                    self._upload(body)
+                elif path.endswith("/batches"):
+                    self._send(200, server.create_batch(json.loads(body)))
+                else:
+                    self._not_found()
+
+            def _chat(self, body):
+                fault, delay = server.draw_fault()
+                if delay:
+                    time.sleep(delay)
+                if fault == "429":
+                    self._send(429, {"error": {"message": "Resource has been exhausted (e.g. check quota).",
+                                               "code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                               headers={"Retry-After": str(server.retry_after)})
+                elif fault == "503":
+                    self._send(503, {"error": {"message": "The model is overloaded. Please try again later.",
+                                               "code": 503, "status": "UNAVAILABLE"}})
+                elif fault == "malformed":
+                    self._send(200, malformed_completion(body))
+                else:
+                    self._send(200, chat_completion(body))
+
+            def _upload(self, body):
+                message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                    b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+                )
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                file_part = fields["file"]
+                purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+                record = server.add_file(file_part.get_filename() or "upload.jsonl", purpose,
+                                         file_part.get_payload(decode=True))
+                self._send(200, {k: v for k, v in record.items() if k != "content"})
+
+            def do_GET(self):
+                server.requests_served += 1
+                parts = self.path.split("?")[0].rstrip("/").split("/")
+                if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in server.batches:
+                    self._send(200, server.batches[parts[-1]])
+                elif len(parts) >= 3 and parts[-1] == "content" and parts[-2] in server.files:
+                    self._send(200, server.files[parts[-2]]["content"], "application/octet-stream")
+                elif len(parts) >= 2 and parts[-2] == "files" and parts[-1] in server.files:
+                    self._send(200, {k: v for k, v in server.files[parts[-1]].items() if k != "content"})
+                else:
+                    self._not_found()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake Gemini (OpenAI-compatible) endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--batch-delay", type=float, default=0.5, help="Seconds a batch job stays in progress.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every chat completion takes.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, uniformly random.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of chat completions answered with 429.")
+    parser.add_argument("--rate-503", type=float, default=0.0, help="Share of chat completions answered with 503.")
+    parser.add_argument("--rate-malformed", type=float, default=0.0,
+                        help="Share of chat completions whose content is truncated, invalid JSON.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429.")
+    args = parser.parse_args()
+
+    fake = FakeGeminiServer(args.host, args.port, batch_delay=args.batch_delay, latency=args.latency,
+                            jitter=args.jitter, rate_429=args.rate_429, rate_503=args.rate_503,
+                            rate_malformed=args.rate_malformed, retry_after=args.retry_after)
+    print(f"Fake Gemini endpoint listening on {fake.base_url}")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
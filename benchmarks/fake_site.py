@@ -0,0 +1,213 @@
+"""
+Local stand-in for egonzippel.com.
+
+Serves synthetic polaroid year pages (/polaroids/<year>) with the same
+imageItemContainer markup as the live site, and a small, unique JPEG for every
+image and thumbnail they link to. Year pages carry an ETag and answer
+If-None-Match with 304, so incremental scrapes can be exercised too.
+Image requests can be made to fail at a given rate to test download recovery.
+
+    python benchmarks/fake_site.py --items 1000 --port 8082
+"""
+import argparse
+import hashlib
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+from fake_gemini import QuietHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+START_YEAR = 1989
+END_YEAR = 2026
+DAYS_PER_YEAR = 12 * 28 # Days 1-28 of every month
+SUFFIXES = ["", "B", "2", "3", ".O", " copy", "4", "C"] # Extra suffixes are numbered after these
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Polaroids {year}</title></head>
+<body>
+  <div id="gallery">
+{containers}
+  </div>
+</body>
+</html>
+"""
+
+CONTAINER_TEMPLATE = """    <div class="imageItemContainer">
+      <a href="{base}/images/polaroids/{year}/{name}.jpg" class="thumb" rel="gallery" title="{name}">
+        <img src="{base}/images/polaroids/{year}/thumbs/{name}.jpg" alt="{name}" width="180">
+      </a>
+      <div class="imageInfo"><span class="imageFrDimension">{name}</span></div>
+    </div>"""
+
+
+def base_jpeg():
+    """A small real JPEG: a plain gray square, or only the SOI/EOI markers without Pillow."""
+    if Image is None:
+        return b"\xff\xd8\xff\xd9"
+    buffer = io.BytesIO()
+    Image.new("L", (64, 64), 128).save(buffer, "JPEG", quality=70)
+    return buffer.getvalue()
+
+
+def year_item_names(year, count):
+    """`count` distinct parse_filename-compatible date titles spread over `year`."""
+    names = []
+    per_day = -(-count // DAYS_PER_YEAR) # Ceiling division; suffixes tell same-day items apart
+    for index in range(count):
+        day_of_year, slot = divmod(index, per_day)
+        month, day = day_of_year // 28 + 1, day_of_year % 28 + 1
+        suffix = SUFFIXES[slot] if slot < len(SUFFIXES) else str(slot)
+        names.append(f"{year}-{month:02d}-{day:02d}{suffix}")
+    return names
+
+
+class FakeSite:
+    """Threaded HTTP server for `items` synthetic polaroids spread evenly over the year pages."""
+
+    def __init__(self, items, host="127.0.0.1", port=0, latency=0.0, image_error_rate=0.0, seed=7):
+        self.latency = latency
+        self.image_error_rate = image_error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jpeg = base_jpeg()
+        self.stats = {"pages": 0, "not_modified": 0, "images": 0, "image_bytes": 0, "image_errors": 0}
+        self.httpd = QuietHTTPServer((host, port), self._make_handler())
+        self.thread = None
+
+        years = list(range(START_YEAR, END_YEAR + 1))
+        self.names = {}
+        for position, year in enumerate(years):
+            count = items * (position + 1) // len(years) - items * position // len(years)
+            self.names[year] = year_item_names(year, count)
+        self.pages = {}
+
+    @property
+    def root_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        """The BASE_URL scrape_polaroids should use."""
+        return self.root_url + "/polaroids"
+
+    @property
+    def item_count(self):
+        return sum(len(names) for names in self.names.values())
+
+    def page(self, year):
+        """(html bytes, etag) for a year page, rendered once."""
+        if year not in self.pages:
+            containers = "\n".join(CONTAINER_TEMPLATE.format(base=self.root_url, year=year, name=name)
+                                   for name in self.names[year])
+            html = PAGE_TEMPLATE.format(year=year, containers=containers).encode("utf-8")
+            self.pages[year] = (html, '"' + hashlib.sha1(html).hexdigest()[:16] + '"')
+        return self.pages[year]
+
+    def image(self, path):
+        """A unique, valid JPEG for `path`: the shared image with the path appended after its end marker."""
+        return self.jpeg + path.encode("utf-8")
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def should_fail(self):
+        if not self.image_error_rate:
+            return False
+        with self.lock:
+            return self.rng.random() < self.image_error_rate
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None, head=False):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def _route(self, head=False):
+                if site.latency:
+                    time.sleep(site.latency)
+                path = unquote(self.path.split("?")[0]).rstrip("/")
+                parts = path.split("/")
+                if len(parts) == 3 and parts[1] == "polaroids" and parts[2].isdigit() and int(parts[2]) in site.names:
+                    html, etag = site.page(int(parts[2]))
+                    if self.headers.get("If-None-Match") == etag:
+                        site.count("not_modified")
+                        self._send(304, headers={"ETag": etag}, head=True)
+                        return
+                    site.count("pages")
+                    self._send(200, html, headers={"ETag": etag}, head=head)
+                elif path.startswith("/images/polaroids/") and path.endswith(".jpg"):
+                    if not head and site.should_fail():
+                        site.count("image_errors")
+                        self._send(503, b"Service Unavailable", "text/plain")
+                        return
+                    body = site.image(path)
+                    if not head:
+                        site.count("images")
+                        site.count("image_bytes", len(body))
+                    self._send(200, body, "image/jpeg", head=head)
+                else:
+                    self._send(404, b"Not Found", "text/plain")
+
+            def do_GET(self):
+                self._route()
+
+            def do_HEAD(self):
+                self._route(head=True)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake egonzippel.com with synthetic polaroids.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--items", type=int, default=1000, help="Polaroids spread over the year pages.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--image-error-rate", type=float, default=0.0, help="Share of image requests answered with 503.")
+    args = parser.parse_args()
+
+    site = FakeSite(args.items, args.host, args.port, args.latency, args.image_error_rate)
+    print(f"Fake site with {site.item_count} polaroids on {site.base_url}/<year>")
+    try:
+        site.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
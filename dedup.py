@@ -0,0 +1,257 @@
+"""
+Perceptual-hash duplicate detection for the scraped images.
+
+Every image gets a 64-bit dHash (and a 64-bit pHash when numpy is installed), cached
+in the metadata store by path, size and mtime. Hashes go into a BK-tree, so finding
+all images within a Hamming radius touches only a small part of the archive. Two
+images are near-duplicates when both hashes are within MAX_DISTANCE bits.
+
+populate_ai_data uses this (--dedup) to copy an existing analysis to near-duplicates
+("copy" suffixes, re-uploads, .O/.GA variants) instead of sending them to Gemini,
+and to send only one image of a not-yet-analysed cluster. Copied analyses carry
+"duplicate_of": <filename>. Needs Pillow (pip install Pillow).
+
+    python dedup.py report [--max-distance 4] [--output dedup_report.json]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+HASH_SIZE = 8 # 8x8 bits = 64-bit hashes
+PHASH_SAMPLE = 32 # pHash: DCT over a 32x32 thumbnail, keep the 8x8 low frequencies
+MAX_DISTANCE = 4 # Bits that may differ for two images to count as near-duplicates
+HASH_WORKERS = 8
+
+
+def is_available():
+    return Image is not None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * k * (2 * np.arange(n)[None, :] + 1) / (2 * n))
+
+
+def image_hashes(image_path):
+    """Returns {"dhash": int, "phash": int or None} for the image at `image_path`."""
+    with Image.open(image_path) as img:
+        img.draft("L", (PHASH_SAMPLE * 4, PHASH_SAMPLE * 4)) # JPEG: decode at reduced size
+        gray = img.convert("L")
+    small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    width = HASH_SIZE + 1
+    dhash = _bits_to_int(pixels[row * width + col] > pixels[row * width + col + 1]
+                         for row in range(HASH_SIZE) for col in range(HASH_SIZE))
+    phash = None
+    if np is not None:
+        sample = np.asarray(gray.resize((PHASH_SAMPLE, PHASH_SAMPLE), Image.Resampling.LANCZOS), dtype=np.float64)
+        dct = _dct_matrix(PHASH_SAMPLE)
+        low = (dct @ sample @ dct.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+        phash = _bits_to_int(low > np.median(low[1:]))
+    return {"dhash": dhash, "phash": phash}
+
+
+def is_near_duplicate(a, b, max_distance=MAX_DISTANCE):
+    """Both hashes within `max_distance` (pHash only checked when both images have one)."""
+    if hamming(a["dhash"], b["dhash"]) > max_distance:
+        return False
+    return a.get("phash") is None or b.get("phash") is None or hamming(a["phash"], b["phash"]) <= max_distance
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with Hamming distance."""
+
+    def __init__(self):
+        self.root = None # [hash, items, {distance: child}]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key, radius):
+        """Returns [(distance, item)] for every item whose hash is within `radius` of `key`, nearest first."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_key, items, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            # Triangle inequality: only subtrees at distance - radius .. distance + radius can match
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda pair: pair[0])
+
+
+def compute_hashes(records, store, workers=HASH_WORKERS):
+    """
+    Returns {filename: hashes} for every record whose image exists, computing only
+    hashes that are missing or stale (file size or mtime changed).
+    """
+    def hash_record(record):
+        path = record.get("local_path")
+        if not path or not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = store.get_image_hash(path)
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns and \
+                (cached.get("phash") is not None or np is None):
+            return record["filename"], cached
+        try:
+            info = dict(image_hashes(path), size=stat.st_size, mtime=stat.st_mtime_ns)
+        except Exception as e:
+            tqdm.write(f"Error hashing {path}: {e}")
+            return None
+        store.record_image_hash(path, info)
+        return record["filename"], info
+
+    records = [record for record in records if record.get("filename")]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(tqdm(executor.map(hash_record, records), total=len(records), desc="Hashing images"))
+    return dict(result for result in results if result)
+
+
+def nearest_duplicate(tree, hashes, filename, max_distance=MAX_DISTANCE):
+    """The closest other image in `tree` that is a near-duplicate of `filename`, or None."""
+    for _, other in tree.search(hashes[filename]["dhash"], max_distance):
+        if other != filename and is_near_duplicate(hashes[filename], hashes[other], max_distance):
+            return other
+    return None
+
+
+def has_usable_analysis(record):
+    analysis = record.get("ai_analysis")
+    return bool(analysis) and not analysis.get("error")
+
+
+def reuse_duplicate_analyses(records, hashes, store, max_distance=MAX_DISTANCE):
+    """
+    Copies the analysis of an analysed near-duplicate onto every unanalysed record
+    that has one, and marks its job done with the source job's model and prompt hash. Of each remaining cluster of unanalysed near-duplicates only the
+    first record (in sort order) is left to analyse; the others are returned as
+    deferred, to be filled by the next call once that one is analysed.
+    Returns (reused, deferred filenames).
+    """
+    analysed = BKTree()
+    by_filename = {}
+    for record in records:
+        filename = record.get("filename")
+        by_filename[filename] = record
+        if filename in hashes and has_usable_analysis(record):
+            analysed.add(hashes[filename]["dhash"], filename)
+
+    reused, deferred = 0, set()
+    pending = BKTree()
+    for record in records:
+        filename = record.get("filename")
+        if record.get("ai_analysis") is not None or filename not in hashes:
+            continue
+        source = nearest_duplicate(analysed, hashes, filename, max_distance)
+        if source:
+            source_analysis = by_filename[source]["ai_analysis"]
+            record["ai_analysis"] = dict(source_analysis, duplicate_of=source_analysis.get("duplicate_of", source))
+            store.set_analysis(filename, record["ai_analysis"])
+            # Same model and prompt as the source's analysis, so --rerun stale picks the copy up too
+            store.finish_job(filename, *store.job_version(source))
+            reused += 1
+        elif nearest_duplicate(pending, hashes, filename, max_distance):
+            deferred.add(filename)
+        else:
+            pending.add(hashes[filename]["dhash"], filename)
+    return reused, deferred
+
+
+def find_clusters(hashes, max_distance=MAX_DISTANCE):
+    """Groups near-duplicate images (transitively). Returns clusters of 2+ filenames, largest first."""
+    tree = BKTree()
+    for filename, info in hashes.items():
+        tree.add(info["dhash"], filename)
+
+    parent = {filename: filename for filename in hashes}
+
+    def find(filename):
+        while parent[filename] != filename:
+            parent[filename] = parent[parent[filename]]
+            filename = parent[filename]
+        return filename
+
+    for filename, info in hashes.items():
+        for _, other in tree.search(info["dhash"], max_distance):
+            if other != filename and is_near_duplicate(info, hashes[other], max_distance):
+                parent[find(other)] = find(filename)
+
+    clusters = {}
+    for filename in sorted(hashes):
+        clusters.setdefault(find(filename), []).append(filename)
+    return sorted((members for members in clusters.values() if len(members) > 1), key=lambda m: (-len(m), m[0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report clusters of near-duplicate images.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--db", default=STORE_FILE, help="Metadata store.")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help="Hamming radius in bits.")
+    parser.add_argument("--output", help="Also write the clusters as JSON to this file.")
+    args = parser.parse_args()
+
+    if not is_available():
+        print("Pillow is required: pip install Pillow")
+    else:
+        with open_store(args.db, METADATA_FILE) as store:
+            records = store.all_records()
+            hashes = compute_hashes(records, store)
+        clusters = find_clusters(hashes, args.max_distance)
+        analysed = {record["filename"] for record in records if has_usable_analysis(record)}
+        for members in clusters:
+            print(f"{len(members):3d}  " + ", ".join(f"{name}{'*' if name in analysed else ''}" for name in members))
+        duplicates = sum(len(members) - 1 for members in clusters)
+        print(f"{len(clusters)} clusters, {duplicates} of {len(hashes)} images are near-duplicates "
+              f"(radius {args.max_distance} bits; * = analysed).")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"max_distance": args.max_distance, "clusters": clusters}, f, indent=2)
+            print(f"Clusters written to {args.output}.")
@@ -0,0 +1,197 @@
+"""
+Streaming, resumable image downloader.
+
+Each worker thread keeps its own keep-alive requests.Session. Files are streamed to
+`<path>.part` and renamed into place only once their size matches Content-Length
+(and Content-MD5, when the server sends one), so an interrupted run never leaves
+a truncated image at the final path. Partial files are resumed with Range requests;
+the ETag/Last-Modified of the response that started a `.part` file are kept in
+`<path>.part.json` and sent as If-Range, so a file changed on the server since is
+downloaded again from the start instead of being spliced onto the old bytes.
+When a manifest is given (see MetadataStore.record_download), the size, SHA-256,
+ETag and Last-Modified of every file are recorded and used to verify it later.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+DOWNLOAD_TIMEOUT = 20
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digests(path):
+    """Returns (sha256 hasher, md5 hasher) over the current contents of `path`."""
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256, md5
+
+
+def resume_validator(headers):
+    """The If-Range value for a response: its strong ETag, else its Last-Modified, else None."""
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag # Weak ETags are not allowed in If-Range
+    return headers.get("Last-Modified")
+
+
+def load_validator(part_path):
+    try:
+        with open(part_path + ".json") as f:
+            return json.load(f).get("if_range")
+    except (OSError, ValueError):
+        return None
+
+
+def save_validator(part_path, validator):
+    with open(part_path + ".json", "w") as f:
+        json.dump({"if_range": validator}, f)
+
+
+def discard_part(part_path):
+    for path in (part_path, part_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class Downloader:
+    """Thread-safe downloader; call `download` from any number of worker threads."""
+
+    def __init__(self, manifest=None, verify=False, timeout=DOWNLOAD_TIMEOUT):
+        self.manifest = manifest
+        self.verify = verify
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        """The calling worker's own pooled session, created on first use."""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.local.session = session
+        return session
+
+    def download(self, url, local_path):
+        """Makes sure a complete copy of `url` is at `local_path`. Returns True on success."""
+        try:
+            if os.path.exists(local_path):
+                with METRICS.timer("download_check_seconds"):
+                    if self._existing_file_ok(url, local_path):
+                        return True
+            os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+            with METRICS.timer("download_seconds"):
+                return self._fetch(url, local_path)
+        except Exception as e:
+            print(f"Error downloading {url}: {e}")
+            METRICS.add("download_errors")
+            return False
+
+    def _existing_file_ok(self, url, local_path):
+        size = os.path.getsize(local_path)
+        record = self.manifest.get_download(local_path) if self.manifest else None
+
+        if record and record.get("size") == size:
+            if not self.verify:
+                return True
+            if file_digests(local_path)[0].hexdigest() == record.get("sha256"):
+                return True
+            print(f"Checksum mismatch for {local_path}; downloading it again.")
+            os.remove(local_path)
+            return False
+
+        # No (matching) record: ask the server how big the file should be
+        try:
+            response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+            expected = int(response.headers.get("Content-Length", -1)) if response.ok else -1
+        except requests.exceptions.RequestException:
+            return True # Offline: keep what we have, it is verified on a later run
+        if expected < 0 or expected == size:
+            self._record(url, local_path, file_digests(local_path)[0].hexdigest(), size, response.headers)
+            return True
+        # Wrong size, most likely cut short by an older, non-atomic run. Nothing says which
+        # version of the file those bytes came from, so it is not resumed.
+        os.remove(local_path)
+        return False
+
+    def _fetch(self, url, local_path):
+        part_path = local_path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = load_validator(part_path) if offset else None
+        if offset and not validator:
+            # Without the validators of the response it came from, a part file cannot be resumed safely
+            discard_part(part_path)
+            offset = 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416 and offset:
+                # Range not satisfiable: the part file is complete or stale, start over
+                discard_part(part_path)
+                return self._fetch(url, local_path)
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                sha256, md5 = file_digests(part_path)
+                mode = "ab"
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                expected = int(total) if total.isdigit() else None
+            else:
+                # A full response: either a fresh download, or the file changed and If-Range did not match
+                sha256, md5 = hashlib.sha256(), hashlib.md5()
+                mode, offset = "wb", 0
+                length = response.headers.get("Content-Length")
+                expected = int(length) if length and length.isdigit() else None
+                validator = resume_validator(response.headers)
+                if validator:
+                    save_validator(part_path, validator)
+                elif os.path.exists(part_path + ".json"):
+                    os.remove(part_path + ".json")
+
+            received = 0
+            with open(part_path, mode) as out_file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    out_file.write(chunk)
+                    sha256.update(chunk)
+                    md5.update(chunk)
+                    received += len(chunk)
+            METRICS.add("download_bytes", received)
+
+            size = os.path.getsize(part_path)
+            if expected is not None and size != expected:
+                print(f"Incomplete download of {url} ({size}/{expected} bytes); will resume next time.")
+                return False
+            content_md5 = response.headers.get("Content-MD5")
+            if content_md5 and response.status_code == 200 and base64.b64encode(md5.digest()).decode() != content_md5:
+                discard_part(part_path)
+                print(f"Checksum mismatch downloading {url}; discarded.")
+                return False
+
+            os.replace(part_path, local_path)
+            discard_part(part_path)
+            self._record(url, local_path, sha256.hexdigest(), size, response.headers)
+        return True
+
+    def _record(self, url, local_path, sha256, size, headers):
+        if self.manifest:
+            self.manifest.record_download(local_path, {
+                "url": url,
+                "size": size,
+                "sha256": sha256,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "downloaded_at": time.time(),
+            })
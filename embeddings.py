@@ -0,0 +1,346 @@
+"""
+Text embeddings of the analysed records and a persistent vector index for semantic search.
+
+Each record's OCR text, description and keywords are embedded once per content hash
+(cached in embeddings/cache.db) and stored as rows of a memory-mapped float16/float32
+matrix, embeddings/vectors.npy, with embeddings/index.json mapping rows to filenames.
+Queries are brute-force NumPy top-k over the matrix, or use an optional IVF index
+(k-means lists, embeddings/ivf.npz) that only scores the closest lists.
+
+Two embedders are available: "hashing", a local deterministic stand-in (feature-hashed
+words and word pairs) that runs offline, and "api", the OpenAI-compatible embeddings
+endpoint at GEMINI_BASE_URL. Needs numpy (pip install numpy).
+
+    python embeddings.py build [--embedder hashing|api] [--ivf]
+    python embeddings.py query "empty subway bench at night" [--k 10] [--ivf]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from tqdm import tqdm
+
+from analysis_cache import sha256_hex
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+from metrics import METRICS
+from search_engine import STOP_WORDS, analyze
+
+EMBEDDINGS_DIR = "embeddings"
+EMBEDDER = "hashing" # "hashing" (offline stand-in) or "api"
+EMBEDDING_DIM = 256 # Hashing embedder only; the API model decides its own size
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_DTYPE = "float16" # Matrix storage: "float16" or "float32"
+API_BATCH_SIZE = 100 # Texts per embeddings request
+WRITE_CHUNK = 1024 # Matrix rows filled per cache lookup
+SEARCH_CHUNK = 8192 # Matrix rows converted to float32 and scored at a time
+IVF_ITERATIONS = 10
+IVF_PROBES = 8 # Lists scored per query with --ivf
+
+
+def is_available():
+    return np is not None
+
+
+def record_text(record):
+    """The text embedded for a record, or None if it has no usable analysis yet."""
+    analysis = record.get("ai_analysis") or {}
+    if not analysis or analysis.get("error"):
+        return None
+    parts = [analysis.get("ocr_text") or "", analysis.get("visual_description") or "",
+             ", ".join(analysis.get("keywords") or [])]
+    text = "\n".join(part for part in parts if part.strip())
+    return text or None
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """Deterministic bag of hashed words and word pairs, signed and L2-normalized."""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = [term for _, term in analyze(text) if term not in STOP_WORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return normalize_rows(vectors)
+
+
+class ApiEmbedder:
+    """Embeddings from the OpenAI-compatible endpoint (Gemini's /embeddings)."""
+
+    def __init__(self, client, model=EMBEDDING_MODEL):
+        self.client = client
+        self.model = model
+        self.name = f"api:{model}"
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), API_BATCH_SIZE):
+            with METRICS.timer("embedding_request_seconds"):
+                response = self.client.embeddings.create(model=self.model, input=texts[start:start + API_BATCH_SIZE])
+            METRICS.record_usage(response.usage, prefix="embedding_")
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+def make_embedder(kind=EMBEDDER, client=None, model=EMBEDDING_MODEL, dim=EMBEDDING_DIM):
+    if kind == "api":
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.environ.get("GEMINI_API_KEY"), base_url=os.environ.get(
+                "GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/"))
+        return ApiEmbedder(client, model)
+    return HashingEmbedder(dim)
+
+
+class EmbeddingCache:
+    """Vectors keyed by (content hash, embedder name), stored as float32 blobs."""
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " content_hash TEXT NOT NULL,"
+            " embedder TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (content_hash, embedder))"
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def has(self, content_hash, embedder):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM embeddings WHERE content_hash = ? AND embedder = ?", (content_hash, embedder)
+            ).fetchone() is not None
+
+    def get_many(self, content_hashes, embedder):
+        """Returns {content_hash: float32 vector} for the hashes that are cached."""
+        found = {}
+        with self.lock:
+            for content_hash in set(content_hashes):
+                row = self.conn.execute(
+                    "SELECT vector FROM embeddings WHERE content_hash = ? AND embedder = ?", (content_hash, embedder)
+                ).fetchone()
+                if row:
+                    found[content_hash] = np.frombuffer(row[0], dtype=np.float32)
+        return found
+
+    def put_many(self, content_hashes, embedder, vectors):
+        with self.lock, self.conn:
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, embedder, vector, created_at) VALUES (?, ?, ?, ?)",
+                ((content_hash, embedder, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for content_hash, vector in zip(content_hashes, vectors)),
+            )
+
+
+class VectorIndex:
+    """The on-disk matrix, its row -> filename map and the optional IVF lists."""
+
+    def __init__(self, directory=EMBEDDINGS_DIR):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "index.json")
+        self.matrix_path = os.path.join(directory, "vectors.npy")
+        self.ivf_path = os.path.join(directory, "ivf.npz")
+        self.meta, self.matrix, self.ivf = None, None, None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r") as f:
+            self.meta = json.load(f)
+        self.matrix = np.load(self.matrix_path, mmap_mode="r") if self.meta["ids"] else None
+        if self.meta.get("ivf") and os.path.exists(self.ivf_path):
+            with np.load(self.ivf_path) as data:
+                self.ivf = {key: data[key] for key in ("centroids", "order", "offsets")}
+
+    def count(self):
+        return len(self.meta["ids"]) if self.meta else 0
+
+    def update(self, records, embedder, dtype=None, ivf=None):
+        """
+        Embeds new or changed records (cache misses only) and rewrites the matrix if
+        anything changed. `dtype` and `ivf` None keep the current settings. Returns (embedded, total).
+        """
+        dtype = dtype or (self.meta or {}).get("dtype") or EMBEDDING_DTYPE
+        os.makedirs(self.directory, exist_ok=True)
+        cache = EmbeddingCache(os.path.join(self.directory, "cache.db"))
+        try:
+            ids, hashes, missing = [], [], {}
+            for record in records:
+                text = record_text(record)
+                if not record.get("filename") or text is None:
+                    continue
+                content_hash = sha256_hex(text)
+                ids.append(record["filename"])
+                hashes.append(content_hash)
+                if content_hash not in missing and not cache.has(content_hash, embedder.name):
+                    missing[content_hash] = text
+
+            pending = list(missing.items())
+            for start in tqdm(range(0, len(pending), API_BATCH_SIZE), desc="Embedding", unit="batch",
+                              disable=len(pending) <= API_BATCH_SIZE):
+                batch = pending[start:start + API_BATCH_SIZE]
+                vectors = embedder.embed([text for _, text in batch])
+                cache.put_many([content_hash for content_hash, _ in batch], embedder.name, vectors)
+
+            ivf = bool(self.meta and self.meta.get("ivf")) if ivf is None else ivf
+            unchanged = (self.meta and self.meta["embedder"] == embedder.name and self.meta["dtype"] == dtype
+                         and self.meta["ids"] == ids and self.meta["hashes"] == hashes)
+            if unchanged and ivf == bool(self.ivf is not None):
+                return len(missing), len(ids)
+            if not unchanged:
+                self._write_matrix(cache, embedder.name, ids, hashes, dtype)
+        finally:
+            cache.close()
+
+        self.meta = {"embedder": embedder.name, "dtype": dtype, "ivf": ivf, "ids": ids, "hashes": hashes}
+        self.ivf = None
+        if ivf and ids:
+            self.build_ivf()
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+        return len(missing), len(ids)
+
+    def _write_matrix(self, cache, embedder_name, ids, hashes, dtype):
+        self.matrix = None # Release the old memmap before replacing the file
+        if not ids:
+            return
+        dim = len(next(iter(cache.get_many(hashes[:1], embedder_name).values())))
+        tmp_path = self.matrix_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(len(ids), dim))
+        for start in range(0, len(ids), WRITE_CHUNK):
+            chunk = hashes[start:start + WRITE_CHUNK]
+            vectors = cache.get_many(chunk, embedder_name)
+            matrix[start:start + len(chunk)] = np.stack([vectors[content_hash] for content_hash in chunk])
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, self.matrix_path)
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+
+    def build_ivf(self, n_lists=None, iterations=IVF_ITERATIONS, seed=0):
+        """Spherical k-means over the rows; each list holds the rows closest to its centroid."""
+        vectors = np.asarray(self.matrix, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), size=min(n_lists, len(vectors)), replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for list_idx in range(len(centroids)):
+                members = vectors[assignment == list_idx]
+                if len(members):
+                    centroids[list_idx] = members.sum(axis=0)
+            centroids = normalize_rows(centroids)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1)).astype(np.int64)
+        self.ivf = {"centroids": centroids.astype(np.float32), "order": order, "offsets": offsets}
+        tmp_path = self.ivf_path + ".tmp.npz"
+        np.savez(tmp_path, **self.ivf)
+        os.replace(tmp_path, self.ivf_path)
+
+    def search_vector(self, query, k=10, use_ivf=False, probes=IVF_PROBES):
+        """Top-k (row indices, cosine scores) for a normalized float32 query vector."""
+        if self.matrix is None:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        if use_ivf and self.ivf is not None:
+            centroid_scores = self.ivf["centroids"] @ query
+            lists = np.argpartition(-centroid_scores, min(probes, len(centroid_scores)) - 1)[:probes]
+            offsets, order = self.ivf["offsets"], self.ivf["order"]
+            rows = np.concatenate([order[offsets[i]:offsets[i + 1]] for i in lists])
+            rows.sort() # Sequential reads from the memmap
+        else:
+            rows = None
+        candidates = self.matrix if rows is None else self.matrix[rows]
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), SEARCH_CHUNK):
+            chunk = np.asarray(candidates[start:start + SEARCH_CHUNK], dtype=np.float32)
+            scores[start:start + len(chunk)] = chunk @ query
+        k = min(k, len(scores))
+        if k == 0:
+            return np.array([], dtype=np.int64), scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def search(self, text, embedder, k=10, use_ivf=False, probes=IVF_PROBES):
+        """Returns [(filename, score)] for the k records closest to `text`."""
+        query = embedder.embed([text])[0]
+        rows, scores = self.search_vector(query, k, use_ivf, probes)
+        return [(self.meta["ids"][row], float(score)) for row, score in zip(rows, scores)]
+
+
+def index_embedder(index, client=None):
+    """The embedder an existing index was built with, so queries and updates match its rows."""
+    name = index.meta["embedder"]
+    if name.startswith("api:"):
+        return make_embedder("api", client, model=name.partition(":")[2])
+    return make_embedder("hashing", dim=int(name.rpartition("-")[2]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the embedding index of analysed records.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("query", nargs="?", default="", help="Query text (query command).")
+    parser.add_argument("--dir", default=EMBEDDINGS_DIR, help="Index directory.")
+    parser.add_argument("--db", default=STORE_FILE, help="Metadata store (build).")
+    parser.add_argument("--embedder", choices=["hashing", "api"], default=EMBEDDER)
+    parser.add_argument("--dtype", choices=["float16", "float32"], help=f"Matrix storage (default {EMBEDDING_DTYPE}).")
+    parser.add_argument("--ivf", action="store_true", help="Build (build) or use (query) the IVF index.")
+    parser.add_argument("--probes", type=int, default=IVF_PROBES, help="IVF lists scored per query.")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if not is_available():
+        print("numpy is required: pip install numpy")
+    elif args.command == "build":
+        start = time.perf_counter()
+        with open_store(args.db, METADATA_FILE) as store:
+            index = VectorIndex(args.dir)
+            embedded, total = index.update(store.iter_records(), make_embedder(args.embedder), args.dtype,
+                                           ivf=True if args.ivf else None)
+        print(f"{total} records in {args.dir}/ ({embedded} newly embedded, {time.perf_counter() - start:.1f} s).")
+    else:
+        index = VectorIndex(args.dir)
+        if not index.count():
+            print(f"No embedding index in {args.dir}/. Run: python embeddings.py build")
+        else:
+            embedder = index_embedder(index)
+            start = time.perf_counter()
+            results = index.search(args.query, embedder, args.k, args.ivf, args.probes)
+            took = (time.perf_counter() - start) * 1000
+            for filename, score in results:
+                print(f"{score:6.3f}  {filename}")
+            print(f"{len(results)} results ({took:.1f} ms).")
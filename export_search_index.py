@@ -0,0 +1,187 @@
+"""
+Exports prebuilt, per-year search shards for the web page.
+
+Instead of downloading every record and building the Lunr index on page load
+(initializeLunrIndex in search_logic.js), the page fetches manifest.json and
+lazy-loads the years a search needs, falling back to the full JSON when the
+shards are missing (publish.py uploads them):
+
+    search_index/manifest.json          years, record counts and file sizes
+    search_index/index_<year>.json      serialized Lunr index, load with lunr.Index.load(...)
+    search_index/records_<year>.json    slim display records; the index ref is the position in this list
+    search_index/index_all.json         one index over every year, for queries without a year; its
+                                        refs are positions in all records_<year>.json files joined in
+                                        manifest order
+
+Lunr scores depend on the term statistics (idf, field lengths) of the index they
+come from, so scores from different year indexes are not comparable. Queries
+without a year use index_all.json so they are ranked across years correctly.
+
+Every JSON file is also written precompressed as .gz (and .br when the brotli
+package is installed), so a static host can serve it with Content-Encoding.
+The index uses the same fields and boosts as search_logic.js. Needs the lunr
+package (pip install lunr), which writes indexes lunr.js 2.3 can load.
+
+    python export_search_index.py [--output-dir search_index]
+"""
+import argparse
+import gzip
+import json
+import os
+from itertools import groupby
+
+try:
+    from lunr import lunr
+except ImportError:
+    lunr = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from derivatives import page_derivatives
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+OUTPUT_DIR = "search_index"
+UNKNOWN_YEAR = "unknown"
+MANIFEST_VERSION = 2 # 2: adds the index over all years ("all"); SHARD_MANIFEST_VERSION in search_logic.js
+
+# Same fields and boosts as initializeLunrIndex in search_logic.js
+INDEX_FIELDS = [
+    {"field_name": "filename", "boost": 5},
+    {"field_name": "ocr_text", "boost": 10},
+    {"field_name": "visual_description", "boost": 2},
+    {"field_name": "keywords_string", "boost": 15},
+]
+
+# Record fields the page needs to display and filter a result
+DISPLAY_FIELDS = ("filename", "year", "month", "day", "source_page", "display_page_url", "thumbnail_url", "image_url")
+
+
+def is_available():
+    return lunr is not None
+
+
+def index_document(ref, record):
+    """The document search_logic.js would add to its index for `record`."""
+    analysis = record.get("ai_analysis") or {}
+    return {
+        "id": ref,
+        "filename": record.get("filename") or "",
+        "ocr_text": analysis.get("ocr_text") or "",
+        "visual_description": analysis.get("visual_description") or "",
+        "keywords_string": " ".join(analysis.get("keywords") or []),
+    }
+
+
+def slim_record(record):
+    """Drops local paths, parsing details and empty values; keeps what the page displays (and its derivatives)."""
+    slim = {field: record[field] for field in DISPLAY_FIELDS if record.get(field)}
+    analysis = record.get("ai_analysis") or {}
+    if analysis.get("error"):
+        analysis = {} # Failed analyses are retried by populate_ai_data; nothing to show yet
+    analysis = {key: analysis[key] for key in ("ocr_text", "visual_description", "keywords") if analysis.get(key)}
+    if analysis:
+        slim["ai_analysis"] = analysis
+    if record.get("derivatives"):
+        slim["derivatives"] = page_derivatives(record["derivatives"])
+    return slim
+
+
+def build_index(records):
+    """Serialized Lunr index over `records`, referenced by list position."""
+    documents = [index_document(str(ref), record) for ref, record in enumerate(records)]
+    return lunr(ref="id", fields=INDEX_FIELDS, documents=documents).serialize()
+
+
+def write_compressed(path, payload):
+    """Writes `payload` (bytes) to `path` plus .gz/.br siblings. Returns their sizes by encoding."""
+    sizes = {}
+    variants = [("identity", path, payload), ("gzip", path + ".gz", gzip.compress(payload, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(("br", path + ".br", brotli.compress(payload, quality=11)))
+    for encoding, variant_path, data in variants:
+        tmp_path = variant_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, variant_path)
+        sizes[encoding] = len(data)
+    return sizes
+
+
+def dump_json(data):
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def export_search_index(records, output_dir=OUTPUT_DIR):
+    """
+    Writes one index and one display-record shard per year, the index over all years
+    and manifest.json. `records` must be in year order (the metadata store's order).
+    Returns the manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    shard_records = [] # Every shard's records in manifest order: the refs of index_all.json
+    for year, year_records in groupby(records, key=lambda record: str(record.get("year") or UNKNOWN_YEAR)):
+        year_records = [record for record in year_records if record.get("filename")]
+        if not year_records:
+            continue
+        shard_records.extend(year_records)
+        index_file, records_file = f"index_{year}.json", f"records_{year}.json"
+        shards.append({
+            "year": year,
+            "count": len(year_records),
+            "index": index_file,
+            "records": records_file,
+            "bytes": {
+                "index": write_compressed(os.path.join(output_dir, index_file), dump_json(build_index(year_records))),
+                "records": write_compressed(
+                    os.path.join(output_dir, records_file), dump_json([slim_record(r) for r in year_records])
+                ),
+            },
+        })
+        print(f"  {year}: {len(year_records)} records")
+
+    all_index_file = "index_all.json"
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "fields": INDEX_FIELDS,
+        "encodings": ["gzip", "br"] if brotli is not None else ["gzip"],
+        "total": len(shard_records),
+        "shards": shards,
+        "all": {
+            "index": all_index_file,
+            "bytes": write_compressed(os.path.join(output_dir, all_index_file), dump_json(build_index(shard_records))),
+        },
+    }
+    write_compressed(os.path.join(output_dir, "manifest.json"), json.dumps(manifest, indent=2).encode("utf-8"))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export per-year prebuilt Lunr index shards for the search page.")
+    parser.add_argument("--db", default=STORE_FILE, help="SQLite metadata store.")
+    parser.add_argument("--metadata", default=METADATA_FILE, help="JSON imported if the store is empty.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    if not is_available():
+        print("The lunr package is required: pip install lunr")
+        return
+    if brotli is None:
+        print("brotli not installed; writing gzip variants only (pip install brotli).")
+
+    with open_store(args.db, args.metadata) as store:
+        print(f"Exporting search shards from {args.db} to {args.output_dir}/ ...")
+        manifest = export_search_index(store.iter_records(), args.output_dir)
+
+    index_bytes = sum(shard["bytes"]["index"]["gzip"] for shard in manifest["shards"])
+    record_bytes = sum(shard["bytes"]["records"]["gzip"] for shard in manifest["shards"])
+    print(f"Exported {manifest['total']} records in {len(manifest['shards'])} year shards "
+          f"({index_bytes / 1e3:.0f} KB index + {record_bytes / 1e3:.0f} KB records, gzipped; "
+          f"all-years index {manifest['all']['bytes']['gzip'] / 1e3:.0f} KB).")
+
+
+if __name__ == "__main__":
+    main()
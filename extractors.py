@@ -0,0 +1,220 @@
+"""
+HTML extraction backends for the polaroid year pages.
+
+Every backend takes the raw page (bytes or str) and returns one
+(image_href, thumbnail_src, date_title) tuple per imageItemContainer, in page order.
+Missing values are empty strings. URL normalization is left to the caller.
+"""
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+CONTAINER_CLASS = "imageItemContainer"
+LINK_CLASS = "thumb"
+INFO_CLASS = "imageInfo"
+DATE_CLASS = "imageFrDimension"
+
+
+def _as_text(content):
+    if isinstance(content, bytes):
+        return content.decode("utf-8", errors="replace")
+    return content
+
+
+def _has_class(attrs, class_name):
+    for name, value in attrs:
+        if name == "class" and value and class_name in value.split():
+            return True
+    return False
+
+
+def extract_bs4(content):
+    """Reference backend: full BeautifulSoup tree with find/find_all per container."""
+    soup = BeautifulSoup(content, 'html.parser')
+    results = []
+    for container in soup.find_all("div", class_=CONTAINER_CLASS):
+        link_tag = container.find("a", class_=LINK_CLASS)
+        href = (link_tag.get("href") or "") if link_tag else ""
+        img_tag = link_tag.find("img") if link_tag else None
+        src = (img_tag.get("src") or "") if img_tag else ""
+        date_title = ""
+        info_div = container.find("div", class_=INFO_CLASS)
+        if info_div:
+            span = info_div.find("span", class_=DATE_CLASS)
+            if span:
+                date_title = span.get_text(strip=True)
+        results.append((href, src, date_title))
+    return results
+
+
+class _ContainerStreamParser(HTMLParser):
+    """Single-pass tag-event parser that only tracks the state needed for the three fields."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.results = []
+        self.div_depth = 0
+        self.container_depth = None
+        self._start_container(None)
+
+    def _start_container(self, depth):
+        self.container_depth = depth
+        self.href = self.src = None
+        self.date_parts = []
+        self.link_open = self.img_seen = False
+        self.info_depth = None
+        self.info_seen = self.span_seen = False
+        self.span_depth = 0
+
+    def _finish_container(self):
+        if self.container_depth is not None:
+            self.results.append((self.href or "", self.src or "", "".join(self.date_parts)))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div":
+            self.div_depth += 1
+            if _has_class(attrs, CONTAINER_CLASS):
+                self._finish_container()
+                self._start_container(self.div_depth)
+            elif self.container_depth is not None and not self.info_seen and _has_class(attrs, INFO_CLASS):
+                self.info_seen = True
+                self.info_depth = self.div_depth
+            return
+        if self.container_depth is None:
+            return
+        if tag == "a" and self.href is None and _has_class(attrs, LINK_CLASS):
+            self.href = dict(attrs).get("href") or ""
+            self.link_open = True
+        elif tag == "img" and self.link_open and not self.img_seen:
+            self.img_seen = True
+            self.src = dict(attrs).get("src") or ""
+        elif tag == "span":
+            if self.span_depth:
+                self.span_depth += 1
+            elif self.info_depth is not None and not self.span_seen and _has_class(attrs, DATE_CLASS):
+                self.span_seen = True
+                self.span_depth = 1
+
+    def handle_endtag(self, tag):
+        if tag == "div":
+            if self.info_depth == self.div_depth:
+                self.info_depth = None
+            if self.container_depth == self.div_depth:
+                self._finish_container()
+                self._start_container(None)
+            self.div_depth -= 1
+        elif tag == "a":
+            self.link_open = False
+        elif tag == "span" and self.span_depth:
+            self.span_depth -= 1
+
+    def handle_data(self, data):
+        if self.span_depth:
+            stripped = data.strip()
+            if stripped:
+                self.date_parts.append(stripped)
+
+    def close(self):
+        super().close()
+        self._finish_container()
+        self._start_container(None)
+
+
+def extract_stream(content):
+    """Stdlib streaming backend: no tree is built, only tag events are inspected."""
+    parser = _ContainerStreamParser()
+    parser.feed(_as_text(content))
+    parser.close()
+    return parser.results
+
+
+_CLASS_TEST = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+
+
+def extract_lxml(content):
+    """lxml backend: C parser plus XPath lookups."""
+    root = lxml.html.fromstring(content)
+    results = []
+    for container in root.xpath(f"//div[{_CLASS_TEST.format(CONTAINER_CLASS)}]"):
+        links = container.xpath(f"(.//a[{_CLASS_TEST.format(LINK_CLASS)}])[1]")
+        href = src = date_title = ""
+        if links:
+            href = links[0].get("href") or ""
+            imgs = links[0].xpath("(.//img)[1]")
+            if imgs:
+                src = imgs[0].get("src") or ""
+        infos = container.xpath(f"(.//div[{_CLASS_TEST.format(INFO_CLASS)}])[1]")
+        if infos:
+            spans = infos[0].xpath(f"(.//span[{_CLASS_TEST.format(DATE_CLASS)}])[1]")
+            if spans:
+                date_title = "".join(t.strip() for t in spans[0].itertext())
+        results.append((href, src, date_title))
+    return results
+
+
+def extract_selectolax(content):
+    """selectolax (lexbor) backend: C parser plus CSS selectors."""
+    tree = SelectolaxParser(content)
+    results = []
+    for container in tree.css(f"div.{CONTAINER_CLASS}"):
+        link = container.css_first(f"a.{LINK_CLASS}")
+        href = src = date_title = ""
+        if link is not None:
+            href = link.attributes.get("href") or ""
+            img = link.css_first("img")
+            if img is not None:
+                src = img.attributes.get("src") or ""
+        info = container.css_first(f"div.{INFO_CLASS}")
+        if info is not None:
+            span = info.css_first(f"span.{DATE_CLASS}")
+            if span is not None:
+                date_title = span.text(deep=True, separator="", strip=True)
+        results.append((href, src, date_title))
+    return results
+
+
+EXTRACTORS = {
+    "bs4": extract_bs4,
+    "stream": extract_stream,
+}
+if lxml is not None:
+    EXTRACTORS["lxml"] = extract_lxml
+if SelectolaxParser is not None:
+    EXTRACTORS["selectolax"] = extract_selectolax
+
+# Fastest first; "auto" picks the first one installed
+AUTO_ORDER = ["selectolax", "lxml", "stream", "bs4"]
+
+
+def resolve_backend(name="auto"):
+    """Returns the backend name to use for `name`, resolving "auto" to the fastest installed one."""
+    if name == "auto":
+        return next(backend for backend in AUTO_ORDER if backend in EXTRACTORS)
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown or unavailable extractor '{name}'. Available: {', '.join(EXTRACTORS)}")
+    return name
+
+
+def extract_containers(content, backend="auto"):
+    """
+    Extracts (image_href, thumbnail_src, date_title) tuples using `backend`.
+    Falls back to the BeautifulSoup backend if a fast backend fails on the page.
+    """
+    name = resolve_backend(backend)
+    if name == "bs4":
+        return extract_bs4(content)
+    try:
+        return EXTRACTORS[name](content)
+    except Exception as e:
+        print(f"  Extractor '{name}' failed ({e}); falling back to bs4.")
+        return extract_bs4(content)
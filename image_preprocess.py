@@ -0,0 +1,63 @@
+"""
+Optional downscale/recompress stage run before images are sent for analysis.
+
+The scraped polaroids are far larger than the model needs to read a sketch. This
+caps the longest side, re-encodes to JPEG or WebP and drops EXIF/ICC metadata.
+Outputs are cached on disk next to scraped_images, keyed by the settings, and
+rebuilt when the source file is newer. Needs Pillow (pip install Pillow).
+"""
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PREPROCESSED_DIR = "scraped_images_preprocessed"
+MAX_SIDE = 1536 # Pixels on the longest side
+OUTPUT_FORMAT = "JPEG" # "JPEG" or "WEBP"
+QUALITY = 85
+
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def is_available():
+    return Image is not None
+
+
+def preprocessed_path(image_path, cache_dir=PREPROCESSED_DIR, max_side=MAX_SIDE, fmt=OUTPUT_FORMAT, quality=QUALITY):
+    """Cache location for `image_path` under the given settings, e.g. X.png.1536px_q85.jpg."""
+    # The source extension stays in the name so X.jpg and X.png get separate copies
+    name = os.path.basename(image_path)
+    return os.path.join(cache_dir, f"{name}.{max_side}px_q{quality}{FORMAT_EXTENSIONS[fmt]}")
+
+
+def preprocess_image(image_path, cache_dir=PREPROCESSED_DIR, max_side=MAX_SIDE, fmt=OUTPUT_FORMAT, quality=QUALITY):
+    """
+    Returns (path, mime_type) of the downscaled, recompressed copy of `image_path`,
+    building it if the cached copy is missing or older than the source.
+    Returns None if Pillow is missing or the image cannot be processed.
+    """
+    if Image is None:
+        return None
+    fmt = fmt.upper()
+    out_path = preprocessed_path(image_path, cache_dir, max_side, fmt, quality)
+    try:
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(image_path):
+            return out_path, FORMAT_MIME_TYPES[fmt]
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with Image.open(image_path) as img:
+            img = ImageOps.exif_transpose(img) # Apply the orientation before the EXIF is dropped
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            tmp_path = out_path + ".tmp"
+            # No exif/icc_profile arguments, so the re-encoded file carries no metadata
+            img.save(tmp_path, format=fmt, quality=quality, optimize=True)
+        os.replace(tmp_path, out_path)
+        return out_path, FORMAT_MIME_TYPES[fmt]
+    except Exception as e:
+        print(f"Error preprocessing {image_path}: {e}")
+        return None
@@ -0,0 +1,425 @@
+"""
+SQLite-backed store for the image metadata records.
+
+Each record lives in its own row, so persisting an analysis result is a single
+row update instead of rewriting the whole image_metadata.json. The JSON file is
+produced on demand by `export_json`, in exactly the shape json.dump(..., indent=2)
+used to write. Records are kept sorted by date and sortable suffix (see
+`record_sort_key`), so the export is stable from run to run.
+
+The jobs table is the analysis ledger: one row per record with its state
+(pending, in_flight, done or failed), the reason for the last failure, the number
+of attempts, and the model and prompt hash of a finished analysis. Every
+transition is committed on its own, so after a crash `recover_jobs` puts
+whatever was in flight back in the queue.
+
+    python metadata_store.py export [--output image_metadata.json]
+    python metadata_store.py import [--input image_metadata.json]
+    python metadata_store.py jobs                # ledger state counts and failure reasons
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import METRICS
+
+STORE_FILE = "image_metadata.db"
+METADATA_FILE = "image_metadata.json"
+RERUN_REASON_PREFIX = "rerun:" # Reason of jobs queued again by a selector, see requeue_jobs
+
+# The job state a record's ai_analysis implies: none yet, an error dict, or an analysis
+ANALYSIS_STATE_SQL = (
+    "CASE WHEN json_type(data, '$.ai_analysis') IS NULL OR json_type(data, '$.ai_analysis') = 'null' THEN 'pending'"
+    " WHEN json_extract(data, '$.ai_analysis.error') IS NOT NULL THEN 'failed' ELSE 'done' END"
+)
+
+
+def record_sort_key(record):
+    """Stable export order: year, month, day, sortable suffix (from parse_filename), then filename."""
+    return "|".join(str(record.get(field) or "") for field in ("year", "month", "day", "sortable_suffix", "filename"))
+
+
+class MetadataStore:
+    """Records keyed by filename, kept in date order, in a WAL-mode SQLite database."""
+
+    def __init__(self, db_path=STORE_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " filename TEXT PRIMARY KEY,"
+            " position INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " sort_key TEXT,"
+            " sync_run INTEGER)"
+        )
+        self._migrate()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_position ON records (position)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_sort_key ON records (sort_key)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            " local_path TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            " local_path TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " filename TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " reason TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " model TEXT,"
+            " prompt_hash TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.conn.commit()
+
+    def _migrate(self):
+        """Adds the sort_key/sync_run columns to stores created before they existed."""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(records)")}
+        if "sort_key" in columns:
+            return
+        self.conn.execute("ALTER TABLE records ADD COLUMN sort_key TEXT")
+        self.conn.execute("ALTER TABLE records ADD COLUMN sync_run INTEGER")
+        rows = self.conn.execute("SELECT filename, data FROM records").fetchall()
+        self.conn.executemany(
+            "UPDATE records SET sort_key = ? WHERE filename = ?",
+            ((record_sort_key(json.loads(data)), filename) for filename, data in rows),
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def get(self, filename):
+        """Returns the record for `filename`, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM records WHERE filename = ?", (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_records(self):
+        """
+        Yields records in sorted order without loading them all at once. Reads on its own
+        connection, so no lock is held while the caller's loop runs: it may use the store,
+        writers carry on, and WAL gives the iteration a consistent snapshot.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute("SELECT data FROM records ORDER BY sort_key, position")
+            rows = cursor.fetchmany(500)
+            while rows:
+                for (data,) in rows:
+                    yield json.loads(data)
+                rows = cursor.fetchmany(500)
+        finally:
+            conn.close()
+
+    def all_records(self):
+        return list(self.iter_records())
+
+    def upsert(self, record, position=None):
+        """Inserts or replaces one record. New records go to the end unless `position` is given."""
+        with self.lock, self.conn:
+            if position is None:
+                existing = self.conn.execute(
+                    "SELECT position FROM records WHERE filename = ?", (record["filename"],)
+                ).fetchone()
+                if existing:
+                    position = existing[0]
+                else:
+                    position = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM records").fetchone()[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO records (filename, position, data, updated_at, sort_key) VALUES (?, ?, ?, ?, ?)",
+                (record["filename"], position, json.dumps(record), time.time(), record_sort_key(record)),
+            )
+
+    def upsert_many(self, records, sync_run=None):
+        """
+        Inserts or updates several records in one transaction, stamping them with
+        `sync_run` (see `next_sync_run`/`prune_unsynced`). Existing rows keep their position.
+        """
+        with METRICS.timer("store_batch_write_seconds"), self.lock, self.conn:
+            position = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM records").fetchone()[0]
+            now = time.time()
+            self.conn.executemany(
+                "INSERT INTO records (filename, position, data, updated_at, sort_key, sync_run) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(filename) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at,"
+                " sort_key = excluded.sort_key, sync_run = excluded.sync_run",
+                ((record["filename"], position + i, json.dumps(record), now, record_sort_key(record), sync_run)
+                 for i, record in enumerate(records)),
+            )
+
+    def next_sync_run(self):
+        """Returns a new sync run id, higher than any stamped so far."""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(sync_run), 0) + 1 FROM records").fetchone()[0]
+
+    def mark_synced(self, filenames, sync_run):
+        """Stamps existing records with `sync_run` without changing their data."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE records SET sync_run = ? WHERE filename = ?",
+                ((sync_run, filename) for filename in filenames),
+            )
+
+    def prune_unsynced(self, sync_run):
+        """Deletes records not stamped by `sync_run`. Returns the number removed."""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM records WHERE sync_run IS NULL OR sync_run != ?", (sync_run,)
+            )
+        return cursor.rowcount
+
+    def replace_all(self, records):
+        """Replaces the whole store with `records` in one transaction."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM records")
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records (filename, position, data, updated_at, sort_key) VALUES (?, ?, ?, ?, ?)",
+                ((record["filename"], position, json.dumps(record), now, record_sort_key(record))
+                 for position, record in enumerate(records) if record.get("filename")),
+            )
+
+    def set_field(self, filename, field, value):
+        """Sets one top-level field of a record as a single-row update. Returns False if the record is unknown."""
+        with METRICS.timer("store_write_seconds"), self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE records SET data = json_set(data, ?, json(?)), updated_at = ? WHERE filename = ?",
+                (f"$.{field}", json.dumps(value), time.time(), filename),
+            )
+        return cursor.rowcount > 0
+
+    def set_analysis(self, filename, analysis):
+        """Persists one analysis result as a single-row update. Returns False if the record is unknown."""
+        return self.set_field(filename, "ai_analysis", analysis)
+
+    def get_download(self, local_path):
+        """Returns the download record (url, size, sha256, etag, ...) for `local_path`, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM downloads WHERE local_path = ?", (local_path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record_download(self, local_path, info):
+        """Stores per-file download metadata written by the downloader."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO downloads (local_path, data) VALUES (?, ?)",
+                (local_path, json.dumps(info)),
+            )
+
+    def get_image_hash(self, local_path):
+        """Returns the perceptual hash record (size, mtime, dhash, phash) for `local_path`, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM image_hashes WHERE local_path = ?", (local_path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record_image_hash(self, local_path, info):
+        """Stores the perceptual hashes computed by dedup.py."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO image_hashes (local_path, data) VALUES (?, ?)",
+                (local_path, json.dumps(info)),
+            )
+
+    def sync_jobs(self):
+        """
+        Brings the job ledger in line with the records. New records get a job in the
+        state their ai_analysis implies; jobs of removed records are dropped. A done or
+        failed job whose analysis was cleared is pending again, and a pending job whose
+        record got an analysis some other way (e.g. copied from a near-duplicate) is done,
+        unless it was queued again on purpose by `requeue_jobs`.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE filename NOT IN (SELECT filename FROM records)")
+            self.conn.execute(
+                f"INSERT INTO jobs (filename, state, reason, updated_at)"
+                f" SELECT filename, {ANALYSIS_STATE_SQL}, json_extract(data, '$.ai_analysis.error'), ?"
+                f" FROM records WHERE filename NOT IN (SELECT filename FROM jobs)",
+                (now,),
+            )
+            self.conn.execute(
+                f"UPDATE jobs SET state = 'pending', reason = NULL, updated_at = ?"
+                f" WHERE state IN ('done', 'failed')"
+                f" AND filename IN (SELECT filename FROM records WHERE {ANALYSIS_STATE_SQL} = 'pending')",
+                (now,),
+            )
+            self.conn.execute(
+                f"UPDATE jobs SET state = 'done', reason = NULL, updated_at = ?"
+                f" WHERE state = 'pending' AND COALESCE(reason, '') NOT LIKE ?"
+                f" AND filename IN (SELECT filename FROM records WHERE {ANALYSIS_STATE_SQL} = 'done')",
+                (now, RERUN_REASON_PREFIX + "%"),
+            )
+
+    def recover_jobs(self):
+        """
+        Returns jobs left in flight by an interrupted run to pending, keeping the
+        reason of jobs queued again by a selector. Returns how many there were.
+        """
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = 'pending', updated_at = ?,"
+                " reason = CASE WHEN reason LIKE ? THEN reason ELSE 'interrupted' END WHERE state = 'in_flight'",
+                (time.time(), RERUN_REASON_PREFIX + "%"),
+            )
+        return cursor.rowcount
+
+    def requeue_jobs(self, failed=False, stale=None, years=()):
+        """
+        Queues finished jobs again. `failed` selects every failed job, `stale` a
+        (model, prompt_hash) pair to select analyses made with a different model or
+        prompt, `years` the jobs of records from those years. Analyses from before the
+        ledger existed have no model recorded and never count as stale.
+        Returns the number of jobs queued again.
+        """
+        selectors = []
+        if failed:
+            selectors.append(("failed", "state = 'failed'", ()))
+        if stale:
+            model, prompt_hash = stale
+            selectors.append(("stale", "state = 'done' AND model IS NOT NULL AND (model != ? OR prompt_hash != ?)",
+                              (model, prompt_hash)))
+        if years:
+            placeholders = ", ".join("?" for _ in years)
+            selectors.append(("year", "state IN ('done', 'failed') AND filename IN"
+                              f" (SELECT filename FROM records WHERE json_extract(data, '$.year') IN ({placeholders}))",
+                              tuple(str(year) for year in years)))
+        requeued = 0
+        with self.lock, self.conn:
+            for name, condition, params in selectors:
+                cursor = self.conn.execute(
+                    f"UPDATE jobs SET state = 'pending', reason = ?, updated_at = ? WHERE {condition}",
+                    (RERUN_REASON_PREFIX + name, time.time(), *params),
+                )
+                requeued += cursor.rowcount
+        return requeued
+
+    def pending_jobs(self):
+        """Filenames of every pending job."""
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT filename FROM jobs WHERE state = 'pending'")}
+
+    def start_jobs(self, filenames):
+        """Marks jobs in flight and counts an attempt for each."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE jobs SET state = 'in_flight', attempts = attempts + 1, updated_at = ? WHERE filename = ?",
+                ((time.time(), filename) for filename in filenames),
+            )
+
+    def finish_job(self, filename, model, prompt_hash):
+        """Marks a job done with the model and prompt hash its analysis was made with."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'done', reason = NULL, model = ?, prompt_hash = ?, updated_at = ? WHERE filename = ?",
+                (model, prompt_hash, time.time(), filename),
+            )
+
+    def job_version(self, filename):
+        """(model, prompt_hash) a done job's analysis was made with; (None, None) if unknown."""
+        with self.lock:
+            row = self.conn.execute("SELECT model, prompt_hash FROM jobs WHERE filename = ?", (filename,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def fail_job(self, filename, reason, retry=False):
+        """
+        Marks a job failed, or pending again with `retry` (e.g. still throttled when the
+        run gave up on it). A retried job queued by `requeue_jobs` keeps its rerun reason,
+        so `sync_jobs` does not mistake its earlier analysis for the result of the rerun.
+        """
+        with self.lock, self.conn:
+            if retry:
+                self.conn.execute(
+                    "UPDATE jobs SET state = 'pending', updated_at = ?,"
+                    " reason = CASE WHEN reason LIKE ? THEN reason ELSE ? END WHERE filename = ?",
+                    (time.time(), RERUN_REASON_PREFIX + "%", reason, filename),
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET state = 'failed', reason = ?, updated_at = ? WHERE filename = ?",
+                    (reason, time.time(), filename),
+                )
+
+    def job_summary(self):
+        """[(state, reason, count, max attempts)] over the whole ledger, largest groups first."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT state, reason, COUNT(*), MAX(attempts) FROM jobs GROUP BY state, reason ORDER BY COUNT(*) DESC"
+            ).fetchall()
+
+    def import_json(self, json_path=METADATA_FILE):
+        """Loads an existing image_metadata.json into the store. Returns the number of records."""
+        with open(json_path, 'r') as f:
+            records = [item for item in json.load(f) if "filename" in item]
+        self.replace_all(records)
+        return len(records)
+
+    def export_json(self, json_path=METADATA_FILE):
+        """
+        Writes all records to `json_path` atomically, one record at a time.
+        The output is byte-identical to json.dump(records, f, indent=2).
+        """
+        tmp_path = json_path + ".tmp"
+        with METRICS.timer("json_export_seconds"), open(tmp_path, 'w') as f:
+            first = True
+            for record in self.iter_records():
+                f.write("[\n  " if first else ",\n  ")
+                f.write(json.dumps(record, indent=2).replace("\n", "\n  "))
+                first = False
+            f.write("[]" if first else "\n]")
+        os.replace(tmp_path, json_path)
+
+
+def open_store(db_path=STORE_FILE, json_path=METADATA_FILE):
+    """Opens the store, importing `json_path` the first time if the store is empty."""
+    store = MetadataStore(db_path)
+    if store.count() == 0 and os.path.exists(json_path):
+        try:
+            imported = store.import_json(json_path)
+            print(f"Imported {imported} existing records from {json_path} into {db_path}.")
+        except json.JSONDecodeError:
+            print(f"Warning: Could not decode {json_path}. Starting with an empty store.")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the image metadata store, or show its job ledger.")
+    parser.add_argument("command", choices=["export", "import", "jobs"])
+    parser.add_argument("--db", default=STORE_FILE, help="SQLite store path.")
+    parser.add_argument("--output", default=METADATA_FILE, help="JSON file to write (export).")
+    parser.add_argument("--input", default=METADATA_FILE, help="JSON file to read (import).")
+    args = parser.parse_args()
+
+    with MetadataStore(args.db) as store:
+        if args.command == "export":
+            store.export_json(args.output)
+            print(f"Exported {store.count()} records to {args.output}.")
+        elif args.command == "jobs":
+            store.sync_jobs()
+            for state, reason, count, attempts in store.job_summary():
+                print(f"{state:10} {count:7}  {reason or '':28} (up to {attempts} attempts)")
+        else:
+            print(f"Imported {store.import_json(args.input)} records from {args.input}.")
@@ -0,0 +1,255 @@
+"""
+Run metrics for the scraper and the analysis pipeline.
+
+One process-wide registry, METRICS, collects:
+
+    histograms   per-stage latencies in seconds (download, encode, API call, rate-limit
+                 waits, store writes, ...) and per-call token counts, as count/sum/mean/
+                 max and p50/p95/p99
+    counters     bytes transferred, calls, errors, tokens used
+    info         the settings a run used (workers, request budget, mode, ...)
+
+Instrument code with `METRICS.timer("api_request_seconds")`, `METRICS.observe(...)`,
+`METRICS.add(...)` and `METRICS.record_usage(response.usage)`. At the end of a run
+`write_report` saves everything as metrics/<script>-<timestamp>.json; with
+`serve(port)` the same numbers are exposed as Prometheus text on
+http://127.0.0.1:<port>/metrics while the run is going.
+
+    python metrics.py show [metrics/populate_ai_data-....json]   # latest report if omitted
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_DIR = "metrics"
+RESERVOIR_SIZE = 10000 # Samples kept per histogram; percentiles are exact up to this many
+QUANTILES = (0.5, 0.95, 0.99)
+PROMETHEUS_PREFIX = "polaroids_"
+
+
+class Histogram:
+    """Exact count/sum/min/max plus a uniform reservoir sample for percentiles."""
+
+    def __init__(self, max_samples=RESERVOIR_SIZE):
+        self.max_samples = max_samples
+        self.samples = []
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.rng = random.Random(0)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.samples) < self.max_samples:
+            self.samples.append(value)
+        else:
+            slot = self.rng.randrange(self.count) # Algorithm R: every value is kept with equal probability
+            if slot < self.max_samples:
+                self.samples[slot] = value
+
+    def quantiles(self, quantiles=QUANTILES):
+        """{q: value} by linear interpolation between the sorted samples."""
+        ordered = sorted(self.samples)
+        result = {}
+        for q in quantiles:
+            if not ordered:
+                result[q] = 0.0
+                continue
+            position = q * (len(ordered) - 1)
+            low = int(position)
+            high = min(low + 1, len(ordered) - 1)
+            result[q] = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+        return result
+
+    def summary(self):
+        summary = {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min or 0.0,
+            "max": self.max or 0.0,
+        }
+        for q, value in self.quantiles().items():
+            summary[f"p{round(q * 100)}"] = value
+        return summary
+
+
+class Metrics:
+    """Thread-safe registry of histograms, counters and run info."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.started = time.monotonic()
+            self.histograms = {}
+            self.counters = {}
+            self.info = {}
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_info(self, **info):
+        with self.lock:
+            self.info.update(info)
+
+    @contextmanager
+    def timer(self, name):
+        """Observes the wall time of the `with` block into histogram `name`, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def record_usage(self, usage, prefix=""):
+        """
+        Adds one API call's token usage (the response's `usage`, object or dict) to the
+        totals and per-call histograms, named `prefix` + prompt_tokens etc.
+        """
+        if usage is None:
+            return
+        if not isinstance(usage, dict):
+            usage = {key: getattr(usage, key, None) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            tokens = usage.get(key)
+            if isinstance(tokens, int):
+                self.add(prefix + key, tokens)
+                self.observe(f"{prefix}{key}_per_call", tokens)
+
+    def report(self):
+        """The run so far as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "started_at": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "duration_seconds": time.monotonic() - self.started,
+                "info": dict(self.info),
+                "histograms": {name: self.histograms[name].summary() for name in sorted(self.histograms)},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write_report(self, name, directory=METRICS_DIR):
+        """Writes the report to <directory>/<name>-<timestamp>.json. Returns the path, or None on error."""
+        report = self.report()
+        stamp = datetime.datetime.fromtimestamp(self.started_at).strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, f"{name}-{stamp}.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(report, f, indent=2)
+            os.replace(path + ".tmp", path)
+        except IOError as e:
+            print(f"Error writing metrics report {path}: {e}")
+            return None
+        return path
+
+    def prometheus_text(self):
+        """The registry in the Prometheus text exposition format (histograms as summaries)."""
+        report = self.report()
+        lines = []
+        for name, summary in report["histograms"].items():
+            metric = PROMETHEUS_PREFIX + name
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                lines.append(f'{metric}{{quantile="{q}"}} {summary[f"p{round(q * 100)}"]:.6g}')
+            lines.append(f"{metric}_sum {summary['sum']:.6g}")
+            lines.append(f"{metric}_count {summary['count']}")
+        for name, value in report["counters"].items():
+            metric = f"{PROMETHEUS_PREFIX}{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}run_duration_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}run_duration_seconds {report['duration_seconds']:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves GET /metrics on a daemon thread for the rest of the process. Returns the server."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f"Metrics at http://{host}:{port}/metrics")
+        return httpd
+
+
+METRICS = Metrics()
+
+
+def format_report(report):
+    """Human-readable table of a report: slowest stages first, then counters."""
+    lines = [f"Run started {report['started_at']}, {report['duration_seconds']:.1f} s"]
+    if report["info"]:
+        lines.append("  " + ", ".join(f"{key}={value}" for key, value in report["info"].items()))
+    timings = {name: s for name, s in report["histograms"].items() if name.endswith("_seconds")}
+    if timings:
+        lines.append(f"{'stage':34} {'count':>8} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, s in sorted(timings.items(), key=lambda entry: -entry[1]["sum"]):
+            lines.append(f"{name:34} {s['count']:8} {s['sum']:9.2f} {s['p50'] * 1000:9.1f} "
+                         f"{s['p95'] * 1000:9.1f} {s['p99'] * 1000:9.1f} {s['max'] * 1000:9.1f}")
+    others = {name: s for name, s in report["histograms"].items() if name not in timings}
+    for name, s in others.items():
+        lines.append(f"{name:34} {s['count']:8} mean {s['mean']:.0f}, p50 {s['p50']:.0f}, "
+                     f"p95 {s['p95']:.0f}, p99 {s['p99']:.0f}, max {s['max']:.0f}")
+    for name, value in report["counters"].items():
+        lines.append(f"{name:34} {value}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a per-run metrics report.")
+    parser.add_argument("command", choices=["show"])
+    parser.add_argument("report", nargs="?", help="Report file; defaults to the newest in the metrics directory.")
+    parser.add_argument("--dir", default=METRICS_DIR)
+    args = parser.parse_args()
+
+    path = args.report
+    if not path:
+        reports = sorted(glob.glob(os.path.join(args.dir, "*.json")), key=os.path.getmtime)
+        if not reports:
+            print(f"No reports in {args.dir}/.")
+            return
+        path = reports[-1]
+    with open(path) as f:
+        print(f"{path}\n{format_report(json.load(f))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,30 @@
 import os
+import argparse
+import asyncio
 import json
 import base64
 import time
 import csv
+import email.utils
 import re
-import requests
-import shutil
-from openai import OpenAI
+import sqlite3
+from openai import APIConnectionError, AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
 import dotenv
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from analysis_cache import AnalysisCache, make_cache_key, sha256_hex
+from dedup import compute_hashes as compute_image_hashes, reuse_duplicate_analyses
+from derivatives import DERIVATIVES_DIR, generate_derivatives
+from downloader import Downloader
+from embeddings import VectorIndex, index_embedder, is_available as numpy_available
+from image_preprocess import is_available as pillow_available, preprocess_image
+from metadata_store import open_store
+from metrics import METRICS
+from ratelimit import TokenBucket
+from scheduler import AdaptiveScheduler, AimdLimit, SchedulerMetrics, backoff_delay
+from search_engine import SearchIndex
 
 dotenv.load_dotenv()
 
@@ -69,15 +84,43 @@ def parse_filename(filename_str):
 
 # Configuration
 METADATA_FILE = "image_metadata.json"
+STORE_FILE = "image_metadata.db" # SQLite store; METADATA_FILE is exported from it
 CSV_FILE = "polaroids_data.csv"
 SCRAPED_IMAGES_DIR = "scraped_images"
+VERIFY_DOWNLOADS = False # Re-hash existing images against the download manifest (repair run)
+DOWNLOAD_WORKERS = 20
+SYNC_WINDOW = 2 * DOWNLOAD_WORKERS # CSV rows read ahead and queued for download at any time
+SYNC_WRITE_BATCH = 200 # Synced records written to the store per transaction
 API_KEY = os.environ.get("GEMINI_API_KEY")
-BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
 MODEL_NAME = "gemini-2.5-flash"
-MAX_WORKERS = 10  # Number of parallel API calls. Adjust based on API limits and performance.
-SAVE_INTERVAL_ITEMS = 10 # Save after every N processed items in a parallel batch run
-API_RETRY_DELAY = 60 # Seconds to wait if a rate limit or availability error is hit
-PER_REQUEST_DELAY = 1 # Seconds to wait between individual requests within a worker to be polite to API
+MAX_OUTPUT_TOKENS = 65536 # MODEL_NAME's output limit; caps max_tokens of packed requests
+MAX_WORKERS = 10  # Starting number of parallel API calls; the scheduler adapts it between 1 and MAX_CONCURRENCY.
+MAX_CONCURRENCY = 32 # Upper bound for the adaptive concurrency limit
+REQUESTS_PER_MINUTE = 600 # Request budget shared by all workers
+MAX_ATTEMPTS = 6 # Tries per image within a run before leaving it for the next run
+API_RETRY_BASE_DELAY = 2 # Seconds; base of the exponential backoff for throttled requests
+API_RETRY_DELAY = 60 # Seconds; cap on the backoff for a rate limit or availability error
+ASYNC_IN_FLIGHT = 100 # Requests in flight (and images encoded ahead) in --mode async
+PACK_SIZE = 1 # Images per request in threads mode; > 1 sends PACKED_PROMPT with several images
+BATCH_DIR = "batch_jobs" # JSONL request files for --mode batch
+BATCH_STATE_FILE = "batch_jobs.json" # Submitted batch jobs not merged yet
+BATCH_MAX_ITEMS = 500 # Requests per batch file, keeps uploads well under the file size limit
+BATCH_POLL_INTERVAL = 30 # Seconds between batch status checks
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+TEMPERATURE = 0.2
+PREPROCESS_IMAGES = False # Downscale and recompress before upload (needs Pillow), see image_preprocess.py
+PREPROCESSED_DIR = "scraped_images_preprocessed"
+PREPROCESS_MAX_SIDE = 1536 # Pixels on the longest side
+PREPROCESS_FORMAT = "JPEG" # "JPEG" or "WEBP"
+PREPROCESS_QUALITY = 85
+DEDUP_IMAGES = False # Reuse analyses across near-duplicate images (needs Pillow), see dedup.py
+DEDUP_MAX_DISTANCE = 4 # Hamming radius in bits for two images to count as near-duplicates
+GENERATE_DERIVATIVES = False # Resized WebP/AVIF copies and placeholders (needs Pillow), see derivatives.py
+CACHE_FILE = "analysis_cache.db" # Content-addressed analysis cache, see analysis_cache.py
+SEARCH_INDEX_FILE = "search_index.db" # Updated after each run once built with `python search_engine.py build`
+EMBEDDINGS_DIR = "embeddings" # Updated after each run once built with `python embeddings.py build`
 
 # New combined prompt
 COMBINED_PROMPT = '''Analyze the attached image, which is a sketch. Provide the following information in a valid JSON object format:
@@ -94,53 +137,49 @@ Example JSON output format:
 
 If the image cannot be processed or is unclear, return a JSON object with empty strings for "ocr_text" and "visual_description", and an empty list for "keywords".'''
 
-# --- Helper Functions ---
-def download_image(url, local_path):
-    """Downloads an image from a URL to a local path if it doesn't exist."""
-    if os.path.exists(local_path):
-        return True
-    
-    try:
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        
-        response = requests.get(url, stream=True, timeout=20)
-        response.raise_for_status()
-        with open(local_path, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        return True
-    except Exception as e:
-        print(f"Error downloading {url}: {e}")
-        return False
+# Prompt variant for --pack-size > 1: several images per request, one result per filename
+PACKED_PROMPT = '''Analyze each of the attached images. Every image is a sketch and is preceded by a line "Image filename: <name>". For each image provide:
+1. "filename": The filename exactly as given before the image.
+2. "ocr_text": Extract all text, including handwritten and sketched text. If no text is present, this should be an empty string. The artist often signs as "Egon", "Egon Zippel", or "Egon NYC" write similar text as this signature.
+3. "visual_description": A concise visual description of the sketch, focusing on the main subjects, style, and any prominent visual elements. Do not give general descriptions like "sketch with a blue ink", "drawing", "painting", etc..
+4. "keywords": A list of 3-7 relevant keywords or short phrases that categorize or describe the main themes, objects, or concepts in the sketch. These should be strings in a list.
+
+Return a valid JSON object with a "results" array holding exactly one object per image, in the order given:
+{
+  "results": [
+    {
+      "filename": "2011-04-15.jpg",
+      "ocr_text": "Some extracted text here...",
+      "visual_description": "A sketch depicting a distorted face with an abstract background.",
+      "keywords": ["portrait", "abstract", "face", "monochrome sketch"]
+    }
+  ]
+}
+
+Describe each image on its own; do not mix details between images. If an image cannot be processed or is unclear, still include its object with empty strings for "ocr_text" and "visual_description", and an empty list for "keywords".'''
+
+# Recorded with every finished job; `--rerun stale` re-analyses items done with another model or prompt
+PROMPT_HASH = sha256_hex(COMBINED_PROMPT + PACKED_PROMPT)[:16]
 
-def sync_metadata_from_csv(csv_path, metadata_path, images_dir):
+# --- Helper Functions ---
+def sync_metadata_from_csv(csv_path, metadata_path, images_dir, store):
     """
-    Reads the CSV, downloads images in parallel, and synchronizes with existing metadata JSON.
-    Preserves existing AI analysis.
+    Streams the CSV through a bounded pool of downloads and upserts the records into
+    the metadata store in batches, then re-exports the metadata JSON (sorted, so an
+    unchanged catalogue exports byte-identically). Preserves existing AI analysis.
+    Returns the number of records in the store.
     """
-    # 1. Load existing metadata to preserve AI analysis
-    existing_data_map = {} # Key: filename -> item data
-    if os.path.exists(metadata_path):
-        try:
-            with open(metadata_path, 'r') as f:
-                existing_list = json.load(f)
-                for item in existing_list:
-                    if "filename" in item:
-                        existing_data_map[item["filename"]] = item
-            print(f"Loaded {len(existing_list)} existing records from {metadata_path}.")
-        except json.JSONDecodeError:
-            print(f"Warning: Could not decode {metadata_path}. Starting fresh.")
-    
-    # 2. Process CSV
+    existing_count = store.count()
+    if existing_count:
+        print(f"Found {existing_count} existing records in {store.db_path}.")
+
     if not os.path.exists(csv_path):
         print(f"Error: CSV file '{csv_path}' not found.")
-        return list(existing_data_map.values())
+        return existing_count
 
     print(f"Syncing data from {csv_path} and downloading images...")
-    
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
+    downloader = Downloader(manifest=store, verify=VERIFY_DOWNLOADS)
+    sync_run = store.next_sync_run()
 
     # Helper function for parallel processing
     def process_row_task(row):
@@ -157,12 +196,11 @@ def sync_metadata_from_csv(csv_path, metadata_path, images_dir):
             
         filename = f"{date_title_raw}{ext}"
         local_path = os.path.join(images_dir, filename)
+        item = store.get(filename) # Existing record, to preserve its analysis
         
         # Download if needed
-        if download_image(image_url, local_path):
-            # Check if we already have this item to preserve analysis
-            if filename in existing_data_map:
-                item = existing_data_map[filename]
+        if downloader.download(image_url, local_path):
+            if item:
                 item["local_path"] = local_path
                 item["thumbnail_url"] = row.get("thumbnail_url")
                 item["source_page"] = row.get("source_page")
@@ -190,43 +228,77 @@ def sync_metadata_from_csv(csv_path, metadata_path, images_dir):
                     })
                 else:
                     item["year"] = row.get("year")
-            return item
+            return item, True
         else:
             print(f"Skipping {filename} due to download failure.")
-            return None
+            # Keep an already known record (and its analysis) until the download succeeds
+            return (item, False) if item else None
 
-    # Run downloads in parallel
-    new_data_list = []
-    DOWNLOAD_WORKERS = 20
-    
-    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
-        futures = [executor.submit(process_row_task, row) for row in rows]
-        
-        for future in tqdm(as_completed(futures), total=len(rows), desc="Syncing CSV & Downloading"):
-            result = future.result()
-            if result:
-                new_data_list.append(result)
+    synced = kept = 0
+    updated, unchanged = [], []
+
+    def flush():
+        store.upsert_many(updated, sync_run)
+        store.mark_synced(unchanged, sync_run)
+        updated.clear()
+        unchanged.clear()
+
+    with open(csv_path, 'r', encoding='utf-8') as f, \
+            ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor, \
+            tqdm(desc="Syncing CSV & Downloading", unit="row") as progress:
+        reader = csv.DictReader(f)
+        pending = set()
+        rows_left = True
+        while rows_left or pending:
+            # Top the window up from the CSV; rows are only read as slots free up
+            while rows_left and len(pending) < SYNC_WINDOW:
+                row = next(reader, None)
+                if row is None:
+                    rows_left = False
+                else:
+                    pending.add(executor.submit(process_row_task, row))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                progress.update(1)
+                result = future.result()
+                if not result:
+                    continue
+                item, downloaded = result
+                if downloaded:
+                    updated.append(item)
+                    synced += 1
+                else:
+                    unchanged.append(item["filename"])
+                    kept += 1
+            if len(updated) + len(unchanged) >= SYNC_WRITE_BATCH:
+                flush()
             
-    # Save updated metadata
+    # Drop records that are no longer in the CSV and save the updated metadata
     try:
-        with open(metadata_path, 'w') as f:
-            json.dump(new_data_list, f, indent=2)
-        print(f"Synced metadata saved to {metadata_path}. Total items: {len(new_data_list)}")
-    except IOError as e:
+        flush()
+        removed = store.prune_unsynced(sync_run)
+        store.export_json(metadata_path)
+        print(f"Synced metadata saved to {metadata_path}. Total items: {synced + kept}"
+              + (f" ({kept} kept from earlier runs after failed downloads)" if kept else "")
+              + (f", {removed} stale records removed" if removed else "") + ".")
+    except (IOError, sqlite3.Error) as e:
         print(f"Error saving synced metadata: {e}")
 
-    return new_data_list
+    return store.count()
 
-def encode_image_to_base64(image_path):
-    """Encodes an image file to a base64 string."""
+def read_image_bytes(image_path):
+    """Reads an image file's raw bytes."""
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return image_file.read()
     except FileNotFoundError:
         # This error will be handled by the calling function which prints context
         return None
     except Exception as e:
-        print(f"Error encoding image {image_path}: {e}")
+        print(f"Error reading image {image_path}: {e}")
         return None
 
 def get_image_mime_type(image_path):
@@ -236,171 +308,859 @@ def get_image_mime_type(image_path):
         return "image/jpeg"
     elif ext == ".png":
         return "image/png"
+    elif ext == ".webp":
+        return "image/webp"
     else:
         print(f"Warning: Unknown extension {ext} for {image_path}. Defaulting to image/jpeg.")
         return "image/jpeg"
 
+def get_retry_after(error):
+    """Returns the Retry-After delay in seconds carried by an API error, if any."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_throttled_result(analysis_result):
+    """Scheduler hook: (throttled, retry_after) for a process_image_item result."""
+    if isinstance(analysis_result, dict) and analysis_result.get("error") == "api_retry_needed":
+        return True, analysis_result.get("retry_after")
+    return False, None
+
+def build_analysis_request(base64_image_data, mime_type):
+    """Keyword arguments for a single-image chat.completions.create call."""
+    return dict(
+        model=MODEL_NAME,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": COMBINED_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{base64_image_data}"},
+                    },
+                ],
+            }
+        ],
+        response_format={"type": "json_object"}, 
+        temperature=TEMPERATURE, 
+        max_tokens=4096
+    )
+
+def strip_code_fences(raw_content):
+    """Removes a ```json ... ``` (or bare ```) wrapper around a model reply."""
+    if raw_content.startswith("```json") and raw_content.endswith("```"):
+        return raw_content[len("```json"):-(len("```"))].strip()
+    elif raw_content.startswith("```") and raw_content.endswith("```"):
+        return raw_content[len("```"):-(len("```"))].strip()
+    return raw_content
+
+def parse_analysis_response(response, image_path_for_log="image"):
+    """Validates a chat completion and returns the parsed analysis or an error dict."""
+    if response.choices and response.choices[0].message and response.choices[0].message.content:
+        raw_content = response.choices[0].message.content.strip()
+        json_str = strip_code_fences(raw_content)
+        
+        try:
+            parsed_json = json.loads(json_str)
+            if all(key in parsed_json for key in ["ocr_text", "visual_description", "keywords"]):
+                return parsed_json
+            else:
+                tqdm.write(f"Warning: Parsed JSON for {image_path_for_log} is missing required keys. Content: {json_str}")
+                if response.choices[0].finish_reason == 'length':
+                    tqdm.write(f"  Potentially truncated due to max_tokens. Finish reason: {response.choices[0].finish_reason}")
+                return {"error": "missing_keys", "raw_content": raw_content} 
+        except json.JSONDecodeError as je:
+            tqdm.write(f"JSON Decode Error for {image_path_for_log}: {je}. Raw content: '{raw_content}'")
+            if response.choices and response.choices[0].finish_reason == 'length':
+                 tqdm.write(f"  Potentially truncated due to max_tokens. Finish reason: {response.choices[0].finish_reason}")
+            return {"error": "json_decode_error", "raw_content": raw_content} 
+    elif response.choices and response.choices[0].finish_reason == 'length':
+        tqdm.write(f"Warning: No content returned for {image_path_for_log}, but finish_reason was 'length'. Potentially an issue with prompt or model response capacity.")
+        return {"error": "no_content_finish_length"}
+    else:
+        tqdm.write(f"Warning: Received an unexpected response structure for {image_path_for_log}. Full response: {response}")
+        return {"error": "unexpected_structure"}
+
+def classify_api_error(e, image_path_for_log="image"):
+    """
+    Turns an API exception into a retryable or final error dict. The clients run with
+    max_retries=0, so throttles, server errors, timeouts and dropped connections are
+    all left to the scheduler's in-run retries.
+    """
+    tqdm.write(f"API Error for {image_path_for_log}: {e}")
+    status_code = getattr(e, "status_code", None)
+    if isinstance(e, APIConnectionError) or status_code == 429 or (status_code or 0) >= 500 or "rate limit" in str(e).lower() or "unavailable" in str(e).lower() or "quota" in str(e).lower() or "503" in str(e).lower():
+        METRICS.add("api_throttled")
+        # Signal the scheduler to retry this specific image; it owns the waiting
+        return {"error": "api_retry_needed", "details": str(e), "retry_after": get_retry_after(e)}
+    METRICS.add("api_errors")
+    return {"error": "general_api_error", "details": str(e)}
+
 def get_gemini_analysis(client, base64_image_data, mime_type, image_path_for_log="image"):
     """Sends a request to the Gemini API for combined analysis and returns parsed JSON."""
     if not base64_image_data:
         return None
     try:
-        time.sleep(PER_REQUEST_DELAY) # Polite delay before each request
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": COMBINED_PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:{mime_type};base64,{base64_image_data}"},
-                        },
-                    ],
-                }
-            ],
-            response_format={"type": "json_object"}, 
-            temperature=0.2, 
-            max_tokens=4096
-        )
-        
-        if response.choices and response.choices[0].message and response.choices[0].message.content:
-            raw_content = response.choices[0].message.content.strip()
-            if raw_content.startswith("```json") and raw_content.endswith("```"):
-                json_str = raw_content[len("```json"):-(len("```"))].strip()
-            elif raw_content.startswith("```") and raw_content.endswith("```"):
-                 json_str = raw_content[len("```"):-(len("```"))].strip()
-            else:
-                json_str = raw_content
-            
-            try:
-                parsed_json = json.loads(json_str)
-                if all(key in parsed_json for key in ["ocr_text", "visual_description", "keywords"]):
-                    return parsed_json
-                else:
-                    tqdm.write(f"Warning: Parsed JSON for {image_path_for_log} is missing required keys. Content: {json_str}")
-                    if response.choices[0].finish_reason == 'length':
-                        tqdm.write(f"  Potentially truncated due to max_tokens. Finish reason: {response.choices[0].finish_reason}")
-                    return {"error": "missing_keys", "raw_content": raw_content} 
-            except json.JSONDecodeError as je:
-                tqdm.write(f"JSON Decode Error for {image_path_for_log}: {je}. Raw content: '{raw_content}'")
-                if response.choices and response.choices[0].finish_reason == 'length':
-                     tqdm.write(f"  Potentially truncated due to max_tokens. Finish reason: {response.choices[0].finish_reason}")
-                return {"error": "json_decode_error", "raw_content": raw_content} 
-        elif response.choices and response.choices[0].finish_reason == 'length':
-            tqdm.write(f"Warning: No content returned for {image_path_for_log}, but finish_reason was 'length'. Potentially an issue with prompt or model response capacity.")
-            return {"error": "no_content_finish_length"}
-        else:
-            tqdm.write(f"Warning: Received an unexpected response structure for {image_path_for_log}. Full response: {response}")
-            return {"error": "unexpected_structure"}
-            
+        METRICS.add("api_calls")
+        with METRICS.timer("api_request_seconds"):
+            response = client.chat.completions.create(**build_analysis_request(base64_image_data, mime_type))
+        METRICS.record_usage(response.usage)
+        return parse_analysis_response(response, image_path_for_log)
     except Exception as e:
-        tqdm.write(f"API Error for {image_path_for_log}: {e}")
-        if "rate limit" in str(e).lower() or "unavailable" in str(e).lower() or "quota" in str(e).lower() or "503" in str(e).lower():
-            tqdm.write(f"Rate limit/Quota/Availability error for {image_path_for_log}. Waiting for {API_RETRY_DELAY}s...")
-            time.sleep(API_RETRY_DELAY) 
-            # Signal to retry this specific image by returning a specific error object or None
-            return {"error": "api_retry_needed", "details": str(e)} 
-        return {"error": "general_api_error", "details": str(e)}
+        return classify_api_error(e, image_path_for_log)
 
+async def get_gemini_analysis_async(async_client, base64_image_data, mime_type, image_path_for_log="image"):
+    """AsyncOpenAI counterpart of get_gemini_analysis."""
+    if not base64_image_data:
+        return None
+    try:
+        METRICS.add("api_calls")
+        with METRICS.timer("api_request_seconds"):
+            response = await async_client.chat.completions.create(**build_analysis_request(base64_image_data, mime_type))
+        METRICS.record_usage(response.usage)
+        return parse_analysis_response(response, image_path_for_log)
+    except Exception as e:
+        return classify_api_error(e, image_path_for_log)
 
-def process_image_item(item_tuple):
-    item_index, item_data, client_instance = item_tuple # client_instance passed to reuse
+
+def prepare_image_payload(item_index, item_data, cache, prompt=COMBINED_PROMPT):
+    """
+    Reads an item's image, checks the analysis cache (for results produced with `prompt`)
+    and base64-encodes it.
+    Returns (final_result, None) when no API call is needed, else
+    (None, (base64_image, mime_type, image_path, cache_key)).
+    """
     image_path = item_data.get("local_path")
 
     if not image_path:
         tqdm.write(f"Skipping item at original index {item_index} due to missing 'local_path'. Filename: {item_data.get('filename', 'Unknown')}")
-        return item_index, None # Return index and None for analysis if path is missing
+        return None, None # None for analysis if path is missing
 
-    base64_image = encode_image_to_base64(image_path)
-    if not base64_image:
+    upload_path, mime_type = image_path, None
+    if PREPROCESS_IMAGES and os.path.exists(image_path):
+        with METRICS.timer("preprocess_seconds"):
+            preprocessed = preprocess_image(image_path, PREPROCESSED_DIR, PREPROCESS_MAX_SIDE,
+                                            PREPROCESS_FORMAT, PREPROCESS_QUALITY)
+        if preprocessed:
+            upload_path, mime_type = preprocessed
+
+    with METRICS.timer("image_read_seconds"):
+        image_bytes = read_image_bytes(upload_path)
+    if not image_bytes:
         tqdm.write(f"Skipping AI analysis for {os.path.basename(image_path)} (Original index {item_index}) due to encoding error.")
         # Mark as encoding error, so it's not retried indefinitely if the file is truly problematic
-        return item_index, {"error": "encoding_failed", "timestamp": time.time()}
-    
-    mime_type = get_image_mime_type(image_path)
+        return {"error": "encoding_failed", "timestamp": time.time()}, None
+
+    # Identical bytes with the same model, prompt and temperature were already paid for.
+    # The key covers the bytes actually sent, so preprocessed and original uploads never mix.
+    cache_key = make_cache_key(image_bytes, MODEL_NAME, prompt, TEMPERATURE) if cache else None
+    if cache_key:
+        with METRICS.timer("cache_lookup_seconds"):
+            cached_analysis = cache.get(cache_key)
+        if cached_analysis is not None:
+            return cached_analysis, None
+
+    with METRICS.timer("encode_seconds"):
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    METRICS.add("upload_bytes", len(base64_image))
+    return None, (base64_image, mime_type or get_image_mime_type(upload_path), image_path, cache_key)
+
+def store_in_cache(cache, cache_key, analysis_result):
+    """Caches successful analyses only; errors are retried on later runs."""
+    if cache_key and isinstance(analysis_result, dict) and not analysis_result.get("error"):
+        cache.put(cache_key, analysis_result)
+
+def process_image_item(item_tuple):
+    item_index, item_data, client_instance, cache = item_tuple # client_instance passed to reuse
+    early_result, payload = prepare_image_payload(item_index, item_data, cache)
+    if payload is None:
+        return item_index, early_result
+
+    base64_image, mime_type, image_path, cache_key = payload
     analysis_result = get_gemini_analysis(client_instance, base64_image, mime_type, image_path)
-    
+    store_in_cache(cache, cache_key, analysis_result)
     return item_index, analysis_result
 
 
+def build_packed_request(images):
+    """Keyword arguments for one request analysing several images; `images` is [(filename, base64, mime)]."""
+    content = [{"type": "text", "text": PACKED_PROMPT}]
+    for filename, base64_image_data, mime_type in images:
+        content.append({"type": "text", "text": f"Image filename: {filename}"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image_data}"}})
+    return dict(
+        model=MODEL_NAME,
+        messages=[{"role": "user", "content": content}],
+        response_format={"type": "json_object"},
+        temperature=TEMPERATURE,
+        max_tokens=min(4096 * len(images), MAX_OUTPUT_TOKENS)
+    )
+
+def is_valid_analysis(entry):
+    """True if `entry` has the three analysis fields with usable types."""
+    return (isinstance(entry, dict)
+            and isinstance(entry.get("ocr_text"), str)
+            and isinstance(entry.get("visual_description"), str)
+            and isinstance(entry.get("keywords"), list))
+
+def split_packed_content(raw_content, filenames):
+    """
+    Maps each requested filename to its validated analysis from a packed reply.
+    Accepts {"results": [...]}, a bare list, or an object keyed by filename.
+    Filenames without a usable entry are left out so the caller can retry them singly.
+    """
+    try:
+        parsed = json.loads(strip_code_fences(raw_content.strip()))
+    except json.JSONDecodeError:
+        return {}
+
+    if isinstance(parsed, dict) and isinstance(parsed.get("results"), list):
+        entries = parsed["results"]
+    elif isinstance(parsed, list):
+        entries = parsed
+    elif isinstance(parsed, dict):
+        entries = [dict(value, filename=key) for key, value in parsed.items() if isinstance(value, dict)]
+    else:
+        return {}
+
+    wanted = {filename.lower(): filename for filename in filenames}
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        filename = wanted.get(os.path.basename(str(entry.get("filename", ""))).lower())
+        if filename and filename not in results and is_valid_analysis(entry):
+            results[filename] = {key: entry[key] for key in ("ocr_text", "visual_description", "keywords")}
+
+    # Replies that dropped the filenames but kept the order and count are matched by position
+    if not results and len(entries) == len(filenames) and all(is_valid_analysis(e) for e in entries):
+        results = {filename: {key: entry[key] for key in ("ocr_text", "visual_description", "keywords")}
+                   for filename, entry in zip(filenames, entries)}
+    return results
+
+def get_packed_gemini_analysis(client, images):
+    """
+    Analyses several images in one request. Returns ({filename: analysis}, error) where
+    error is None or the error dict for the whole request (e.g. api_retry_needed).
+    """
+    filenames = [filename for filename, _, _ in images]
+    try:
+        METRICS.add("api_calls")
+        with METRICS.timer("api_packed_request_seconds"):
+            response = client.chat.completions.create(**build_packed_request(images))
+    except Exception as e:
+        return {}, classify_api_error(e, f"pack of {len(images)} ({filenames[0]}...)")
+    METRICS.record_usage(response.usage)
+
+    if not (response.choices and response.choices[0].message and response.choices[0].message.content):
+        return {}, None
+    results = split_packed_content(response.choices[0].message.content, filenames)
+    if len(results) < len(filenames):
+        finish_reason = response.choices[0].finish_reason
+        tqdm.write(f"Warning: Packed reply covered {len(results)}/{len(filenames)} images (finish reason: {finish_reason}). "
+                   f"Falling back to single-image calls for the rest.")
+    return results, None
+
+def process_image_pack(pack_tuple):
+    """
+    Worker task for --pack-size > 1: one request for every uncached image in the pack,
+    then single-image calls for anything the packed reply did not cover.
+    The scheduler's token pays for the first request; every further single-image
+    call takes its own token from `rate`, so fallbacks stay within the request budget.
+    Returns [(original_idx, analysis_result)] for every item in the pack.
+    """
+    pack, client_instance, cache, rate = pack_tuple
+    results = {}
+    pending = {} # filename -> (original_idx, payload)
+    for original_idx, item_data in pack:
+        early_result, payload = prepare_image_payload(original_idx, item_data, cache, PACKED_PROMPT)
+        if payload is None:
+            results[original_idx] = early_result
+        else:
+            pending[item_data["filename"]] = (original_idx, payload)
+
+    requests_made = 0
+    if len(pending) > 1:
+        images = [(filename, payload[0], payload[1]) for filename, (_, payload) in pending.items()]
+        requests_made += 1
+        packed_results, pack_error = get_packed_gemini_analysis(client_instance, images)
+        if pack_error and pack_error.get("error") == "api_retry_needed":
+            # The packed request was throttled; the scheduler retries it. Items already
+            # answered (cache hits, unreadable files) keep their results.
+            for original_idx, _ in pending.values():
+                results[original_idx] = pack_error
+            return [(original_idx, results[original_idx]) for original_idx, _ in pack]
+        for filename, analysis_result in packed_results.items():
+            original_idx, payload = pending.pop(filename)
+            store_in_cache(cache, payload[3], analysis_result)
+            results[original_idx] = analysis_result
+
+    for filename, (original_idx, payload) in pending.items():
+        base64_image, mime_type, image_path, packed_key = payload
+        single_key = (packed_key[0], packed_key[1], sha256_hex(COMBINED_PROMPT), packed_key[3]) if packed_key else None
+        cached_analysis = cache.get(single_key) if single_key else None
+        if cached_analysis is not None:
+            results[original_idx] = cached_analysis
+            continue
+        if requests_made:
+            rate.acquire()
+        requests_made += 1
+        analysis_result = get_gemini_analysis(client_instance, base64_image, mime_type, image_path)
+        store_in_cache(cache, single_key, analysis_result)
+        results[original_idx] = analysis_result
+
+    return [(original_idx, results[original_idx]) for original_idx, _ in pack]
+
+def is_throttled_pack(pack_results):
+    """Scheduler hook: a task is throttled if any of its items still needs a retry."""
+    throttled, retry_after = False, None
+    for _, analysis_result in pack_results:
+        item_throttled, item_retry_after = is_throttled_result(analysis_result)
+        if item_throttled:
+            throttled = True
+            retry_after = max(retry_after or 0, item_retry_after or 0) or None
+    return throttled, retry_after
+
+
+def handle_analysis_result(all_data, original_idx, analysis_result, store):
+    """
+    Records one final analysis result in memory, in the store and in the job ledger.
+    Returns True if an update was made.
+    """
+    filename = all_data[original_idx].get("filename")
+    if not analysis_result:
+        store.fail_job(filename, "no_local_path")
+        return False
+
+    # A result that is still throttled after MAX_ATTEMPTS in-run retries
+    if isinstance(analysis_result, dict) and analysis_result.get("error") == "api_retry_needed":
+        tqdm.write(f"Giving up on image {all_data[original_idx].get('filename', 'Unknown')} (idx {original_idx}) for this run after {MAX_ATTEMPTS} attempts: {analysis_result.get('details')}")
+        # Not processed: the job stays pending and is picked up by the next run
+        store.fail_job(filename, "api_retry_needed", retry=True)
+        return False
+
+    failed = isinstance(analysis_result, dict) and analysis_result.get("error")
+    previous = all_data[original_idx].get("ai_analysis")
+    if failed and isinstance(previous, dict) and not previous.get("error"):
+        # A requeued item keeps its earlier good analysis; only the ledger records the failure
+        store.fail_job(filename, analysis_result["error"])
+        tqdm.write(f"  Rerun of {filename} failed ({analysis_result['error']}); keeping its previous analysis.")
+        return False
+
+    all_data[original_idx]["ai_analysis"] = analysis_result
+    store.set_analysis(filename, analysis_result) # Single-row upsert
+    if failed:
+        store.fail_job(filename, analysis_result["error"])
+    else:
+        store.finish_job(filename, MODEL_NAME, PROMPT_HASH)
+    if not failed:
+        ocr_snippet = analysis_result.get('ocr_text', 'N/A')[:30].replace("\n", " ")
+        keywords_str = ", ".join(analysis_result.get('keywords', []))
+        tqdm.write(f"  Processed {all_data[original_idx].get('filename', 'idx '+str(original_idx))}. OCR: '{ocr_snippet}...', KW: [{keywords_str[:30]}...]")
+    else:
+        tqdm.write(f"  Failed analysis for {all_data[original_idx].get('filename', 'idx '+str(original_idx))}. Error: {analysis_result.get('error')}")
+    return True
+
+def show_live_metrics(progress, live):
+    progress.set_postfix(limit=live["concurrency_limit"], rpm=f"{live['throughput_per_min']:.0f}",
+                         throttled=f"{live['throttle_rate']:.0%}", queued=live["queued"])
+
+
+def run_threaded_analysis(items_to_process_with_indices, all_data, client, cache, store, pack_size=1):
+    """
+    Analyses items on worker threads under the adaptive scheduler, one image per request
+    or `pack_size` images per request. Returns (updates, metrics).
+    """
+    processed_count_in_run = 0
+    scheduler = AdaptiveScheduler(
+        is_throttled_pack,
+        initial_concurrency=MAX_WORKERS,
+        max_concurrency=MAX_CONCURRENCY,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        max_attempts=MAX_ATTEMPTS,
+        retry_base_delay=API_RETRY_BASE_DELAY,
+        retry_max_delay=API_RETRY_DELAY,
+    )
+
+    # Every task returns [(original_idx, analysis_result)], a single pair unless packing
+    if pack_size > 1:
+        work_fn = process_image_pack
+        task_filenames = lambda task: [item_data["filename"] for _, item_data in task[0]]
+        # Pass client instance to each worker task, and the request budget for single-image fallbacks
+        tasks = [(items_to_process_with_indices[start:start + pack_size], client, cache, scheduler.rate)
+                 for start in range(0, len(items_to_process_with_indices), pack_size)]
+    else:
+        work_fn = lambda task: [process_image_item(task)]
+        task_filenames = lambda task: [task[1]["filename"]]
+        tasks = [(original_idx, item_data, client, cache) for original_idx, item_data in items_to_process_with_indices]
+
+    def run_task(task):
+        store.start_jobs(task_filenames(task)) # Every try, in-run retries included, counts as an attempt
+        return work_fn(task)
+
+    with tqdm(total=len(items_to_process_with_indices), desc="Processing images") as progress:
+        for _, task_results in scheduler.run(tasks, run_task):
+            for original_idx, analysis_result in task_results:
+                progress.update(1)
+                if handle_analysis_result(all_data, original_idx, analysis_result, store):
+                    processed_count_in_run += 1
+            show_live_metrics(progress, scheduler.snapshot())
+
+    return processed_count_in_run, scheduler.snapshot()
+
+
+async def run_async_analysis(items_to_process_with_indices, all_data, cache, store, in_flight=ASYNC_IN_FLIGHT):
+    """
+    Analyses items on one event loop with AsyncOpenAI. A producer reads and encodes
+    images lazily into a queue bounded by `in_flight`, so memory stays flat however
+    large the backlog is. The AIMD limit, request budget and in-run retries follow
+    the threaded scheduler. Returns (updates, metrics).
+    """
+    client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+    limit = AimdLimit(in_flight, maximum=in_flight)
+    rate = TokenBucket(REQUESTS_PER_MINUTE / 60.0, burst=max(1.0, REQUESTS_PER_MINUTE / 60.0))
+    metrics = SchedulerMetrics()
+    queue = asyncio.Queue(maxsize=in_flight)
+    slots = asyncio.Condition()
+    state = {"active": 0, "paused_until": 0.0, "processed": 0}
+    progress = tqdm(total=len(items_to_process_with_indices), desc="Processing images (async)")
+
+    async def producer():
+        for original_idx, item_data in items_to_process_with_indices:
+            prepared = await asyncio.to_thread(prepare_image_payload, original_idx, item_data, cache)
+            await queue.put((original_idx, prepared))
+        for _ in range(in_flight):
+            await queue.put(None)
+
+    async def call_with_retries(filename, payload):
+        base64_image, mime_type, image_path, cache_key = payload
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            async with slots:
+                await slots.wait_for(lambda: state["active"] < limit.current())
+                state["active"] += 1
+            try:
+                store.start_jobs([filename])
+                pause = state["paused_until"] - time.monotonic()
+                if pause > 0:
+                    METRICS.observe("retry_after_pause_seconds", pause)
+                    await asyncio.sleep(pause)
+                with METRICS.timer("rate_limit_wait_seconds"):
+                    while (rate_wait := rate.try_acquire()) > 0:
+                        await asyncio.sleep(rate_wait)
+                analysis_result = await get_gemini_analysis_async(client, base64_image, mime_type, image_path)
+            finally:
+                async with slots:
+                    state["active"] -= 1
+                    slots.notify_all()
+
+            throttled, retry_after = is_throttled_result(analysis_result)
+            if not throttled:
+                limit.on_success()
+                metrics.completed += 1
+                store_in_cache(cache, cache_key, analysis_result)
+                return analysis_result
+
+            metrics.throttled += 1
+            limit.on_throttle()
+            if retry_after:
+                state["paused_until"] = max(state["paused_until"], time.monotonic() + retry_after)
+            if attempt == MAX_ATTEMPTS:
+                metrics.gave_up += 1
+                return analysis_result
+            metrics.retried += 1
+            delay = backoff_delay(attempt, API_RETRY_BASE_DELAY, API_RETRY_DELAY, retry_after)
+            METRICS.observe("retry_backoff_seconds", delay)
+            await asyncio.sleep(delay)
+
+    async def consumer():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            original_idx, (early_result, payload) = entry
+            filename = all_data[original_idx]["filename"]
+            analysis_result = early_result if payload is None else await call_with_retries(filename, payload)
+            if handle_analysis_result(all_data, original_idx, analysis_result, store):
+                state["processed"] += 1
+            progress.update(1)
+            show_live_metrics(progress, metrics.snapshot(limit.current(), state["active"], queue.qsize()))
+
+    try:
+        await asyncio.gather(producer(), *(consumer() for _ in range(in_flight)))
+    finally:
+        progress.close()
+        await client.close()
+    return state["processed"], metrics.snapshot(limit.current())
+
+
+def load_batch_state(state_path=BATCH_STATE_FILE):
+    """Loads the list of submitted, not yet merged batch jobs."""
+    if not os.path.exists(state_path):
+        return []
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f).get("jobs", [])
+    except (IOError, ValueError) as e:
+        print(f"Warning: Could not read {state_path} ({e}). Ignoring earlier batch jobs.")
+        return []
+
+def save_batch_state(jobs, state_path=BATCH_STATE_FILE):
+    """Atomically writes the outstanding batch jobs."""
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"jobs": jobs}, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+def write_batch_request_file(items_with_indices, all_data, request_path, cache, store):
+    """
+    Streams one chat-completions request per item into a JSONL batch file, keyed by filename.
+    Items answered without an API call (cache hits, unreadable files) are recorded directly.
+    Returns (filenames written, {filename: cache key of the bytes sent}, updates recorded).
+    """
+    filenames = []
+    cache_keys = {}
+    processed = 0
+    with open(request_path, 'w') as f:
+        for original_idx, item_data in items_with_indices:
+            early_result, payload = prepare_image_payload(original_idx, item_data, cache)
+            if payload is None:
+                if handle_analysis_result(all_data, original_idx, early_result, store):
+                    processed += 1
+                continue
+            base64_image, mime_type, _, cache_key = payload
+            f.write(json.dumps({
+                "custom_id": item_data["filename"],
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": build_analysis_request(base64_image, mime_type),
+            }) + "\n")
+            filenames.append(item_data["filename"])
+            if cache_key:
+                cache_keys[item_data["filename"]] = cache_key
+    return filenames, cache_keys, processed
+
+def submit_batch_job(client, request_path, filenames, cache_keys):
+    """Uploads a request file and creates the batch job for it."""
+    with open(request_path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"Submitted batch {batch.id} with {len(filenames)} requests ({request_path}).")
+    return {
+        "batch_id": batch.id,
+        "input_file_id": input_file.id,
+        "request_file": request_path,
+        "filenames": filenames,
+        "cache_keys": cache_keys, # Keys of the bytes actually sent; the files may change before the merge
+        "submitted_at": time.time(),
+    }
+
+def wait_for_batch(client, batch_id, poll_interval=BATCH_POLL_INTERVAL):
+    """Polls a batch job until it reaches a terminal status and returns it."""
+    last_status = None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        status = (batch.status, counts.completed if counts else None, counts.failed if counts else None)
+        if status != last_status:
+            progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+            print(f"  Batch {batch_id}: {batch.status}{progress}")
+            last_status = status
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def parse_batch_output_line(line):
+    """Turns one batch output line into (filename, analysis_result) via the normal validation."""
+    entry = json.loads(line)
+    filename = entry.get("custom_id")
+    response = entry.get("response") or {}
+    if entry.get("error") or response.get("status_code") != 200:
+        details = entry.get("error") or response.get("body")
+        if response.get("status_code") in (429, 503):
+            return filename, {"error": "api_retry_needed", "details": str(details), "retry_after": None}
+        return filename, {"error": "general_api_error", "details": str(details)}
+    try:
+        completion = ChatCompletion.model_validate(response.get("body"))
+    except Exception as e:
+        return filename, {"error": "unexpected_structure", "details": str(e)}
+    METRICS.record_usage(completion.usage)
+    return filename, parse_analysis_response(completion, filename)
+
+def merge_batch_results(client, batch, job, all_data, cache, store):
+    """Downloads a finished batch's output and records every result. Returns the number of updates."""
+    index_by_filename = {item.get("filename"): idx for idx, item in enumerate(all_data)}
+    processed = 0
+    seen = set()
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            filename, analysis_result = parse_batch_output_line(line)
+            original_idx = index_by_filename.get(filename)
+            if original_idx is None or filename in seen:
+                continue
+            seen.add(filename)
+            if cache:
+                store_in_cache(cache, job.get("cache_keys", {}).get(filename), analysis_result)
+            if handle_analysis_result(all_data, original_idx, analysis_result, store):
+                processed += 1
+
+    missing = len(job["filenames"]) - len(seen)
+    if missing:
+        print(f"  Batch {batch.id} ({batch.status}) returned no result for {missing} item(s); they stay pending.")
+    return processed
+
+def run_batch_analysis(items_to_process_with_indices, all_data, client, cache, store):
+    """
+    Bulk mode: writes pending items to JSONL batch files, submits them, polls until done
+    and merges the results. Submitted jobs are tracked in BATCH_STATE_FILE, so an
+    interrupted run resumes polling instead of submitting the same items again.
+    Returns the number of updates made.
+    """
+    jobs = load_batch_state(BATCH_STATE_FILE)
+    already_submitted = {filename for job in jobs for filename in job["filenames"]}
+    if jobs:
+        print(f"Resuming {len(jobs)} submitted batch job(s) from {BATCH_STATE_FILE}.")
+
+    processed = 0
+    pending = [(idx, item) for idx, item in items_to_process_with_indices if item["filename"] not in already_submitted]
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    for chunk_start in range(0, len(pending), BATCH_MAX_ITEMS):
+        chunk = pending[chunk_start:chunk_start + BATCH_MAX_ITEMS]
+        request_path = os.path.join(BATCH_DIR, f"batch_requests_{int(time.time())}_{chunk_start // BATCH_MAX_ITEMS}.jsonl")
+        filenames, cache_keys, answered = write_batch_request_file(chunk, all_data, request_path, cache, store)
+        processed += answered
+        if not filenames:
+            os.remove(request_path)
+            continue
+        with METRICS.timer("batch_submit_seconds"):
+            jobs.append(submit_batch_job(client, request_path, filenames, cache_keys))
+        store.start_jobs(filenames)
+        save_batch_state(jobs, BATCH_STATE_FILE)
+
+    while jobs:
+        job = jobs[0]
+        with METRICS.timer("batch_wait_seconds"):
+            batch = wait_for_batch(client, job["batch_id"], BATCH_POLL_INTERVAL)
+        processed += merge_batch_results(client, batch, job, all_data, cache, store)
+        jobs.pop(0)
+        save_batch_state(jobs, BATCH_STATE_FILE)
+        if os.path.exists(job["request_file"]):
+            os.remove(job["request_file"])
+    return processed
+
+
+def update_search_index(store):
+    """Re-indexes new and changed records if the local search index has been built."""
+    if not os.path.exists(SEARCH_INDEX_FILE):
+        return
+    try:
+        with SearchIndex(SEARCH_INDEX_FILE) as search_index:
+            indexed, removed = search_index.sync(store.iter_records())
+        print(f"Search index: {indexed} records re-indexed, {removed} removed.")
+    except sqlite3.Error as e:
+        print(f"Error updating search index {SEARCH_INDEX_FILE}: {e}")
+
+
+def update_embeddings(store):
+    """Embeds new and changed analyses if the vector index has been built (needs numpy)."""
+    if not os.path.isdir(EMBEDDINGS_DIR) or not numpy_available():
+        return
+    index = VectorIndex(EMBEDDINGS_DIR)
+    if not index.meta:
+        return
+    try:
+        embedder = index_embedder(index, OpenAI(api_key=API_KEY, base_url=BASE_URL))
+        embedded, total = index.update(store.iter_records(), embedder)
+        print(f"Embeddings: {embedded} new texts embedded, {total} records indexed.")
+    except Exception as e:
+        print(f"Error updating embeddings in {EMBEDDINGS_DIR}: {e}")
+
+
 # --- Main Processing ---
-def main():
+def main(mode="threads", in_flight=ASYNC_IN_FLIGHT, pack_size=PACK_SIZE, rerun=(), rerun_years=()):
+    """
+    Syncs the CSV into the store, then analyses every pending job in the ledger.
+    `rerun` ("failed", "stale") and `rerun_years` queue finished jobs again first.
+    """
     if not API_KEY:
         print("Error: GEMINI_API_KEY environment variable not set.")
         return
 
-    # Sync and load data
-    all_data = sync_metadata_from_csv(CSV_FILE, METADATA_FILE, SCRAPED_IMAGES_DIR)
+    if PREPROCESS_IMAGES and not pillow_available():
+        print("Warning: Image preprocessing needs Pillow (pip install Pillow). Uploading original images.")
+    if GENERATE_DERIVATIVES and not pillow_available():
+        print("Warning: Derivative generation needs Pillow (pip install Pillow). Skipping it.")
+    dedup = DEDUP_IMAGES and pillow_available()
+    if DEDUP_IMAGES and not dedup:
+        print("Warning: Duplicate detection needs Pillow (pip install Pillow). Analysing every image.")
 
-    if not all_data:
+    METRICS.set_info(mode=mode, model=MODEL_NAME, max_workers=MAX_WORKERS, max_concurrency=MAX_CONCURRENCY,
+                     requests_per_minute=REQUESTS_PER_MINUTE, download_workers=DOWNLOAD_WORKERS,
+                     in_flight=in_flight, pack_size=pack_size, preprocess=PREPROCESS_IMAGES)
+
+    # Sync and load data
+    store = open_store(STORE_FILE, METADATA_FILE)
+    with METRICS.timer("phase_sync_seconds"):
+        synced = sync_metadata_from_csv(CSV_FILE, METADATA_FILE, SCRAPED_IMAGES_DIR, store)
+    if not synced:
         print("No data loaded. Exiting.")
+        store.close()
         return
 
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL) # Create one client instance
+    all_data = store.all_records()
+    cache = AnalysisCache(CACHE_FILE)
+
+    if GENERATE_DERIVATIVES and pillow_available():
+        with METRICS.timer("phase_derivatives_seconds"):
+            generated, up_to_date, failed = generate_derivatives(all_data, store, DERIVATIVES_DIR)
+        print(f"Derivatives: {generated} generated, {up_to_date} up to date, {failed} failed.")
+        if generated:
+            store.export_json(METADATA_FILE)
     
     print(f"Loaded {len(all_data)} image records from {METADATA_FILE}.")
+
+    # The job ledger decides what to analyse; in-flight jobs of a crashed run are queued again
+    interrupted = store.recover_jobs()
+    if interrupted:
+        print(f"Resuming: {interrupted} items were in flight when the last run stopped.")
+    store.sync_jobs()
+    requeued = store.requeue_jobs(failed="failed" in rerun, stale=(MODEL_NAME, PROMPT_HASH) if "stale" in rerun else None,
+                                  years=rerun_years)
+    if requeued:
+        print(f"Queued {requeued} finished items again ({', '.join([*rerun, *map(str, rerun_years)])}).")
+
+    # Near-duplicates of analysed images reuse that analysis; of an unanalysed cluster only one image is sent
+    image_hashes, deferred = None, set()
+    if dedup:
+        with METRICS.timer("phase_dedup_seconds"):
+            image_hashes = compute_image_hashes(all_data, store)
+            reused, deferred = reuse_duplicate_analyses(all_data, image_hashes, store, DEDUP_MAX_DISTANCE)
+        print(f"Dedup: {reused} near-duplicates reused an existing analysis, "
+              f"{len(deferred)} wait for their cluster's first image.")
+        if reused:
+            store.sync_jobs()
+            store.export_json(METADATA_FILE)
     
     # Create a list of tuples: (original_index, item_data)
+    pending_jobs = store.pending_jobs()
     items_to_process_with_indices = [
-        (idx, item) for idx, item in enumerate(all_data) if item.get("ai_analysis") is None
+        (idx, item) for idx, item in enumerate(all_data)
+        if item.get("filename") in pending_jobs and item.get("filename") not in deferred
     ]
     
     total_needing_analysis = len(items_to_process_with_indices)
     if total_needing_analysis == 0:
-        print("No images require AI analysis. All items seem to be processed.")
+        failed = sum(count for state, _, count, _ in store.job_summary() if state == "failed")
+        print("No images require AI analysis. All items seem to be processed."
+              + (f" {failed} failed; --rerun failed queues them again." if failed else ""))
+        update_search_index(store)
+        update_embeddings(store)
+        cache.close()
+        store.close()
         return
         
     print(f"{total_needing_analysis} images need AI analysis.")
 
-    processed_count_in_run = 0
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Pass client instance to each worker task
-        futures = [executor.submit(process_image_item, (original_idx, item_data, client)) 
-                   for original_idx, item_data in items_to_process_with_indices]
-        
-        for future in tqdm(as_completed(futures), total=total_needing_analysis, desc="Processing images"):
-            original_idx, analysis_result = future.result()
-            
-            if analysis_result:
-                # Check if the result is an error dictionary that signals a retry for this specific item
-                if isinstance(analysis_result, dict) and analysis_result.get("error") == "api_retry_needed":
-                    tqdm.write(f"Retrying image {all_data[original_idx].get('filename', 'Unknown')} (idx {original_idx}) later due to API error: {analysis_result.get('details')}")
-                    # Do not mark as processed, it will be picked up in a future run if ai_analysis remains None
-                else:
-                    all_data[original_idx]["ai_analysis"] = analysis_result
-                    processed_count_in_run += 1
-                    if not (isinstance(analysis_result, dict) and analysis_result.get("error")):
-                        ocr_snippet = analysis_result.get('ocr_text', 'N/A')[:30].replace("\n", " ")
-                        keywords_str = ", ".join(analysis_result.get('keywords', []))
-                        tqdm.write(f"  Processed {all_data[original_idx].get('filename', 'idx '+str(original_idx))}. OCR: '{ocr_snippet}...', KW: [{keywords_str[:30]}...]")
-                    else:
-                        tqdm.write(f"  Failed analysis for {all_data[original_idx].get('filename', 'idx '+str(original_idx))}. Error: {analysis_result.get('error')}")
-
-            # Save progress periodically
-            if processed_count_in_run > 0 and processed_count_in_run % SAVE_INTERVAL_ITEMS == 0:
-                try:
-                    with open(METADATA_FILE, 'w') as f_out:
-                        json.dump(all_data, f_out, indent=2)
-                    tqdm.write(f"  --- Progress saved to {METADATA_FILE} ({processed_count_in_run} updates made in this run) ---")
-                except IOError as e:
-                    tqdm.write(f"  Error saving intermediate progress to {METADATA_FILE}: {e}")
-    
-    # Final save for any remaining changes
+    run_stats = None
+    with METRICS.timer("phase_analysis_seconds"):
+        if mode == "batch":
+            client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+            processed_count_in_run = run_batch_analysis(items_to_process_with_indices, all_data, client, cache, store)
+        elif mode == "async":
+            processed_count_in_run, run_stats = asyncio.run(
+                run_async_analysis(items_to_process_with_indices, all_data, cache, store, in_flight)
+            )
+        else:
+            # Create one client instance; SDK-level retries are off so throttles and transient errors reach the scheduler
+            client = OpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+            processed_count_in_run, run_stats = run_threaded_analysis(
+                items_to_process_with_indices, all_data, client, cache, store, pack_size
+            )
+    METRICS.add("images_analysed", processed_count_in_run)
+
+    if deferred:
+        reused, _ = reuse_duplicate_analyses(all_data, image_hashes, store, DEDUP_MAX_DISTANCE)
+        store.sync_jobs()
+        print(f"Dedup: {reused} deferred near-duplicates reused this run's analyses.")
+
+    # Every result is already persisted in the store; export the JSON shape once at the end
     try:
-        with open(METADATA_FILE, 'w') as f_out:
-            json.dump(all_data, f_out, indent=2)
+        store.export_json(METADATA_FILE)
         print(f"--- Final metadata saved to {METADATA_FILE} ---")
     except IOError as e:
         print(f"Error saving final metadata to {METADATA_FILE}: {e}")
+    with METRICS.timer("phase_index_seconds"):
+        update_search_index(store)
+        update_embeddings(store)
+    job_summary = store.job_summary()
+    store.close()
+
+    cache_stats = cache.stats()
+    cache.close()
 
     end_time = time.time()
     print(f"Finished AI analysis data population attempt.")
     print(f"Total updates successfully made in this run: {processed_count_in_run}")
+    print("Job ledger: " + ", ".join(f"{count} {state}" + (f" ({reason})" if reason else "")
+                                     for state, reason, count, _ in job_summary[:6]))
+    print(f"Analysis cache: {cache_stats['session_hits']} hits / {cache_stats['session_misses']} misses this run "
+          f"({cache_stats['entries']} entries, lifetime hit rate {cache_stats['hit_rate']:.1%}).")
+    if run_stats:
+        print(f"Scheduler: {run_stats['throughput_per_min']:.0f} requests/min, {run_stats['throttled']} throttled "
+              f"({run_stats['throttle_rate']:.1%}), {run_stats['retried']} retried in-run, {run_stats['gave_up']} left for next run, "
+              f"final concurrency limit {run_stats['concurrency_limit']}.")
+        METRICS.set_info(final_concurrency_limit=run_stats["concurrency_limit"])
     print(f"Total time taken: {end_time - start_time:.2f} seconds for this run.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sync scraped polaroids and populate Gemini analysis.")
+    parser.add_argument("--mode", choices=["threads", "async", "batch"], default="threads",
+                        help="threads: adaptive thread pool; async: AsyncOpenAI with a bounded in-flight window; "
+                             "batch: Batch API for bulk backfills.")
+    parser.add_argument("--in-flight", type=int, default=ASYNC_IN_FLIGHT,
+                        help="Maximum concurrent requests in async mode.")
+    parser.add_argument("--preprocess", action="store_true", default=PREPROCESS_IMAGES,
+                        help=f"Downscale to {PREPROCESS_MAX_SIDE}px and recompress images before upload (needs Pillow).")
+    parser.add_argument("--pack-size", type=int, default=PACK_SIZE,
+                        help="Images per request in threads mode; items a packed reply misses are retried singly.")
+    parser.add_argument("--dedup", action="store_true", default=DEDUP_IMAGES,
+                        help="Reuse analyses for near-duplicate images (perceptual hashes, needs Pillow).")
+    parser.add_argument("--derivatives", action="store_true", default=GENERATE_DERIVATIVES,
+                        help="Generate resized WebP/AVIF derivatives and LQIP/BlurHash placeholders (needs Pillow).")
+    parser.add_argument("--verify-downloads", action="store_true", default=VERIFY_DOWNLOADS,
+                        help="Re-hash existing images and re-download any that are missing, truncated or corrupt.")
+    parser.add_argument("--rerun", action="append", choices=["failed", "stale"], default=[],
+                        help="Queue failed items, or items analysed with another model or prompt, again. Repeatable.")
+    parser.add_argument("--rerun-year", action="append", default=[], metavar="YEAR",
+                        help="Queue every finished item of this year again. Repeatable.")
+    parser.add_argument("--metrics-port", type=int, help="Expose Prometheus metrics on this local port during the run.")
+    args = parser.parse_args()
+    PREPROCESS_IMAGES = args.preprocess
+    VERIFY_DOWNLOADS = args.verify_downloads
+    DEDUP_IMAGES = args.dedup
+    GENERATE_DERIVATIVES = args.derivatives
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    try:
+        main(mode=args.mode, in_flight=args.in_flight, pack_size=args.pack_size, rerun=args.rerun,
+             rerun_years=args.rerun_year)
+    finally:
+        # Per-run report: stage latencies, bytes and tokens (python metrics.py show)
+        report_path = METRICS.write_report("populate_ai_data")
+        if report_path:
+            print(f"Metrics report saved to {report_path}.")
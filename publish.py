@@ -0,0 +1,266 @@
+"""
+Publishes the locally generated web assets to the R2 bucket the search page reads from.
+
+    derivatives   every file under derivatives/ (derivatives.py), uploaded under the
+                  same relative key, so DERIVATIVES_BASE_URL + record path resolves.
+                  File names carry a hash of their content, so keys already in
+                  the bucket are skipped and uploads are cached as immutable.
+    metadata      copies each local record's "derivatives" (the fields the page uses)
+                  into the bucket's image_metadata.json, which the worker trims into
+                  image_metadata_search.json on its next export.
+    search_index  the per-year Lunr shards and manifest.json (export_search_index.py)
+                  the page loads before falling back to image_metadata_search.json.
+                  On R2 each file is stored gzipped with Content-Encoding: gzip.
+
+R2 is reached through its S3-compatible API (pip install boto3) with the
+R2_ACCOUNT_ID, R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY environment variables.
+With WORKER_URL set, the worker's /export endpoint is called afterwards so the
+search JSON is refreshed right away. --to-dir writes the same layout into a local
+directory instead, e.g. to preview the page with a static file server.
+
+Run it while the worker's daily cron is not running: both write image_metadata.json.
+
+    python publish.py [derivatives] [metadata] [search_index] [--to-dir site/]
+"""
+import argparse
+import json
+import mimetypes
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import dotenv
+import requests
+from tqdm import tqdm
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from derivatives import DERIVATIVES_DIR, page_derivatives
+from export_search_index import OUTPUT_DIR as SEARCH_INDEX_DIR
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+dotenv.load_dotenv()
+
+R2_ACCOUNT_ID = os.environ.get("R2_ACCOUNT_ID")
+R2_ACCESS_KEY_ID = os.environ.get("R2_ACCESS_KEY_ID")
+R2_SECRET_ACCESS_KEY = os.environ.get("R2_SECRET_ACCESS_KEY")
+R2_BUCKET = os.environ.get("R2_BUCKET", "egon-image-metadata") # bucket_name in worker/wrangler.toml
+WORKER_URL = os.environ.get("WORKER_URL") # e.g. https://egon-polaroid-pipeline.<account>.workers.dev
+REMOTE_METADATA_KEY = "image_metadata.json"
+PUBLISH_WORKERS = 8
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable" # Derivative names include a content hash
+SEARCH_INDEX_CACHE_CONTROL = "public, max-age=300" # Shard names are reused by every export
+TARGETS = ("derivatives", "metadata", "search_index")
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+class R2Bucket:
+    """The few object operations publishing needs, over R2's S3 API."""
+
+    CONTENT_ENCODING = "gzip" # Precompressed files are stored under their plain name with this encoding
+
+    def __init__(self, bucket=R2_BUCKET):
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+            aws_access_key_id=R2_ACCESS_KEY_ID,
+            aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+            region_name="auto",
+        )
+
+    def keys(self, prefix):
+        """The key of every object under `prefix`."""
+        keys = set()
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.update(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+    def get(self, key):
+        """The object's bytes, or None if it does not exist."""
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, body, content_type, cache_control=None, content_encoding=None):
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        if content_encoding:
+            extra["ContentEncoding"] = content_encoding
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType=content_type, **extra)
+
+    def put_file(self, key, path, content_type, cache_control=None, content_encoding=None):
+        with open(path, "rb") as f:
+            self.put(key, f, content_type, cache_control, content_encoding)
+
+
+class DirectoryBucket:
+    """Same interface as R2Bucket, writing into a local directory."""
+
+    CONTENT_ENCODING = None # Files are copied as they are, .gz/.br siblings included
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def keys(self, prefix):
+        keys = set()
+        for dirpath, _, filenames in os.walk(self._path(prefix)):
+            for name in filenames:
+                keys.add(os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/"))
+        return keys
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body, content_type, cache_control=None, content_encoding=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+    def put_file(self, key, path, content_type, cache_control=None, content_encoding=None):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        shutil.copyfile(path, target + ".tmp")
+        os.replace(target + ".tmp", target)
+
+
+def local_files(directory):
+    """[(key, path)] for every file under `directory`, keyed by its path relative to the working directory."""
+    files = []
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            if not name.endswith(".tmp"):
+                path = os.path.join(dirpath, name)
+                files.append((os.path.relpath(path).replace(os.sep, "/"), path))
+    return sorted(files)
+
+
+def publish_derivatives(bucket, directory=DERIVATIVES_DIR, workers=PUBLISH_WORKERS):
+    """
+    Uploads derivative files the bucket does not have yet. A name identifies its content
+    (derivative_path), so an existing key never needs uploading again. Returns (uploaded, skipped).
+    """
+    files = local_files(directory)
+    if not files:
+        return 0, 0
+    remote = bucket.keys(files[0][0].split("/")[0] + "/")
+    todo = [(key, path) for key, path in files if key not in remote]
+
+    def upload(entry):
+        key, path = entry
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        bucket.put_file(key, path, content_type, IMMUTABLE_CACHE_CONTROL)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in tqdm(executor.map(upload, todo), total=len(todo), desc="Uploading derivatives"):
+            pass
+    return len(todo), len(files) - len(todo)
+
+
+def publish_metadata(bucket, store):
+    """
+    Copies the page's derivative fields of every local record into the bucket's
+    image_metadata.json. Returns the number of remote records changed, or None if
+    the bucket has no metadata yet.
+    """
+    body = bucket.get(REMOTE_METADATA_KEY)
+    if body is None:
+        return None
+    remote_records = json.loads(body)
+    local = {record["filename"]: page_derivatives(record["derivatives"])
+             for record in store.iter_records() if record.get("derivatives")}
+    changed = 0
+    for record in remote_records:
+        derivatives = local.get(record.get("filename"))
+        if derivatives and record.get("derivatives") != derivatives:
+            record["derivatives"] = derivatives
+            changed += 1
+    if changed:
+        bucket.put(REMOTE_METADATA_KEY, json.dumps(remote_records, indent=2).encode("utf-8"), "application/json")
+    return changed
+
+
+def publish_search_index(bucket, directory=SEARCH_INDEX_DIR):
+    """Uploads the search shards, manifest.json last so it never lists a missing shard. Returns the file count."""
+    files = local_files(directory)
+    if bucket.CONTENT_ENCODING:
+        files = [(key, path) for key, path in files if key.endswith(".json") and os.path.exists(path + ".gz")]
+    files.sort(key=lambda entry: entry[0].endswith("/manifest.json"))
+    for key, path in tqdm(files, desc="Uploading search shards"):
+        if bucket.CONTENT_ENCODING:
+            bucket.put_file(key, path + ".gz", "application/json", SEARCH_INDEX_CACHE_CONTROL, bucket.CONTENT_ENCODING)
+        else:
+            content_type = "application/json" if key.endswith(".json") else "application/octet-stream"
+            bucket.put_file(key, path, content_type, SEARCH_INDEX_CACHE_CONTROL)
+    return len(files)
+
+
+def trigger_export(worker_url=WORKER_URL):
+    """Asks the worker to rebuild image_metadata_search.json from the bucket's metadata."""
+    response = requests.post(worker_url.rstrip("/") + "/export", timeout=120)
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish derivatives and metadata updates to the R2 bucket.")
+    parser.add_argument("targets", nargs="*", help=f"What to publish: {', '.join(TARGETS)} (default: everything).")
+    parser.add_argument("--db", default=STORE_FILE, help="Metadata store.")
+    parser.add_argument("--derivatives-dir", default=DERIVATIVES_DIR)
+    parser.add_argument("--search-index-dir", default=SEARCH_INDEX_DIR)
+    parser.add_argument("--to-dir", help="Write into this local directory instead of R2.")
+    parser.add_argument("--workers", type=int, default=PUBLISH_WORKERS, help="Parallel uploads.")
+    args = parser.parse_args()
+    targets = args.targets or TARGETS
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown target(s): {', '.join(sorted(unknown))}")
+
+    if args.to_dir:
+        bucket = DirectoryBucket(args.to_dir)
+    elif boto3 is None:
+        print("Publishing to R2 needs boto3: pip install boto3 (or use --to-dir).")
+        return
+    elif not (R2_ACCOUNT_ID and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY):
+        print("Error: set R2_ACCOUNT_ID, R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY (or use --to-dir).")
+        return
+    else:
+        bucket = R2Bucket()
+
+    if "derivatives" in targets:
+        uploaded, skipped = publish_derivatives(bucket, args.derivatives_dir, args.workers)
+        print(f"Derivatives: {uploaded} uploaded, {skipped} already published.")
+    if "search_index" in targets:
+        if os.path.exists(os.path.join(args.search_index_dir, "manifest.json")):
+            print(f"Search index: {publish_search_index(bucket, args.search_index_dir)} files published.")
+        else:
+            print(f"No {args.search_index_dir}/manifest.json; run export_search_index.py first.")
+    if "metadata" in targets:
+        with open_store(args.db, METADATA_FILE) as store:
+            changed = publish_metadata(bucket, store)
+        if changed is None:
+            print(f"No {REMOTE_METADATA_KEY} in the bucket yet; run the worker first.")
+        else:
+            print(f"Metadata: derivatives updated on {changed} records.")
+            if changed and WORKER_URL and not args.to_dir:
+                print(f"Worker export: {trigger_export()}")
+            elif changed and not args.to_dir:
+                print("Set WORKER_URL (or wait for the worker's next run) to refresh image_metadata_search.json.")
+
+
+if __name__ == "__main__":
+    main()
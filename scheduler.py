@@ -0,0 +1,174 @@
+"""
+Adaptive, rate-limit-aware scheduler for API calls.
+
+Concurrency follows AIMD: every successful call nudges the limit up by about one
+slot per window, a throttled call halves it. Calls are also paced by a
+requests-per-minute token bucket. Throttled items go back on an in-run retry queue
+with exponential backoff and full jitter (or the server's Retry-After, if longer),
+and a Retry-After pauses all new calls, since quota is shared by every worker.
+"""
+import heapq
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import METRICS
+from ratelimit import TokenBucket
+
+DECREASE_COOLDOWN = 2.0 # Seconds; throttles from the same burst only shrink the limit once
+
+
+class AimdLimit:
+    """Additive-increase / multiplicative-decrease concurrency limit."""
+
+    def __init__(self, initial, minimum=1, maximum=64, decrease_factor=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.value = float(min(max(initial, minimum), maximum))
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def current(self):
+        return int(self.value)
+
+    def on_success(self):
+        with self.lock:
+            self.value = min(self.maximum, self.value + 1.0 / max(self.value, 1.0))
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < DECREASE_COOLDOWN:
+                return
+            self.last_decrease = now
+            self.value = max(float(self.minimum), self.value * self.decrease_factor)
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0, retry_after=None):
+    """Full-jitter exponential backoff for retry `attempt` (1-based), never shorter than Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class SchedulerMetrics:
+    """Running counters for the scheduler; `snapshot` gives live throughput and 429 rate."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed = 0
+        self.throttled = 0
+        self.retried = 0
+        self.gave_up = 0
+
+    def snapshot(self, limit, in_flight=0, queued=0):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        calls = self.completed + self.throttled
+        return {
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "retried": self.retried,
+            "gave_up": self.gave_up,
+            "throughput_per_min": self.completed * 60.0 / elapsed,
+            "throttle_rate": self.throttled / calls if calls else 0.0,
+            "concurrency_limit": limit,
+            "in_flight": in_flight,
+            "queued": queued,
+        }
+
+
+class AdaptiveScheduler:
+    """
+    Runs `work_fn(item)` for every item on a thread pool, within the AIMD limit and
+    the requests-per-minute budget. `throttle_check(result)` returns
+    (throttled, retry_after_seconds_or_None); throttled results are retried in the
+    same run up to `max_attempts` times.
+    """
+
+    def __init__(self, throttle_check, initial_concurrency=10, max_concurrency=32, requests_per_minute=600,
+                 max_attempts=6, retry_base_delay=2.0, retry_max_delay=60.0):
+        self.throttle_check = throttle_check
+        self.limit = AimdLimit(initial_concurrency, maximum=max_concurrency)
+        self.rate = TokenBucket(requests_per_minute / 60.0, burst=max(1.0, requests_per_minute / 60.0))
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.metrics = SchedulerMetrics()
+        self.paused_until = 0.0
+        self.in_flight_count = 0
+        self.queued_count = 0
+
+    def snapshot(self):
+        return self.metrics.snapshot(self.limit.current(), self.in_flight_count, self.queued_count)
+
+    def run(self, items, work_fn):
+        """Yields (item, result) once per item, as final results arrive (completion order)."""
+        ready = deque((item, 1) for item in items)
+        delayed = [] # (ready_at, seq, item, attempt)
+        in_flight = {}
+        seq = 0
+        rate_blocked_since = None # When the request budget last held back a ready item
+
+        with ThreadPoolExecutor(max_workers=self.limit.maximum) as executor:
+            while ready or delayed or in_flight:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    _, _, item, attempt = heapq.heappop(delayed)
+                    ready.append((item, attempt))
+
+                next_wake = delayed[0][0] - now if delayed else None
+                if now < self.paused_until:
+                    next_wake = min(next_wake or float("inf"), self.paused_until - now)
+                else:
+                    while ready and len(in_flight) < self.limit.current():
+                        rate_wait = self.rate.try_acquire()
+                        if rate_wait > 0:
+                            next_wake = min(next_wake or float("inf"), rate_wait)
+                            rate_blocked_since = rate_blocked_since or now
+                            break
+                        if rate_blocked_since is not None:
+                            METRICS.observe("rate_limit_wait_seconds", now - rate_blocked_since)
+                            rate_blocked_since = None
+                        item, attempt = ready.popleft()
+                        in_flight[executor.submit(work_fn, item)] = (item, attempt)
+
+                self.in_flight_count = len(in_flight)
+                self.queued_count = len(ready) + len(delayed)
+
+                if not in_flight:
+                    time.sleep(next_wake if next_wake is not None else 0.01)
+                    continue
+
+                done, _ = wait(in_flight, timeout=next_wake, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, attempt = in_flight.pop(future)
+                    result = future.result()
+                    throttled, retry_after = self.throttle_check(result)
+
+                    if not throttled:
+                        self.limit.on_success()
+                        self.metrics.completed += 1
+                        yield item, result
+                        continue
+
+                    self.metrics.throttled += 1
+                    self.limit.on_throttle()
+                    if retry_after:
+                        METRICS.observe("retry_after_pause_seconds", retry_after)
+                        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                    if attempt >= self.max_attempts:
+                        self.metrics.gave_up += 1
+                        yield item, result
+                        continue
+
+                    self.metrics.retried += 1
+                    delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay, retry_after)
+                    METRICS.observe("retry_backoff_seconds", delay)
+                    heapq.heappush(delayed, (time.monotonic() + delay, seq, item, attempt + 1))
+                    seq += 1
+
+        self.in_flight_count = self.queued_count = 0
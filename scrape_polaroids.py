@@ -1,116 +1,265 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+import argparse
 import csv
-import time
+import hashlib
+import json
+import os
 import datetime
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from extractors import EXTRACTORS, extract_containers
+from metrics import METRICS
+from ratelimit import HostRateLimiter
+
+# Configuration
+BASE_URL = "https://egonzippel.com/polaroids"
+SITE_ROOT = "https://egonzippel.com"
+START_YEAR = 1989
+CURRENT_YEAR = 2026 # Based on prompt date
+OUTPUT_FILE = "polaroids_data.csv"
+STATE_FILE = "scrape_state.json" # Per-year ETag/Last-Modified/content hash for incremental runs
+CSV_HEADERS = ["year", "date_title_raw", "image_url", "thumbnail_url", "source_page"]
+REQUEST_TIMEOUT = 10
+SCRAPE_WORKERS = 4 # Concurrent year-page fetches sharing one keep-alive connection pool
+REQUESTS_PER_SECOND = 2.0 # Politeness budget per host, replaces the old fixed sleep(1)
+RATE_BURST = 2 # Requests allowed back-to-back before the rate limit kicks in
+EXTRACTOR = "auto" # HTML extraction backend (see extractors.py); "auto" picks the fastest installed
+
+
+def make_session(pool_size=SCRAPE_WORKERS):
+    """Creates a requests Session whose connection pool fits `pool_size` concurrent workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def normalize_url(url):
+    """Turns protocol-relative and root-relative URLs into absolute https URLs."""
+    if url.startswith("//"):
+        return "https:" + url
+    if url.startswith("/"):
+        return SITE_ROOT + url
+    return url
+
+
+def parse_year_page(content, url, year, extractor=None):
+    """Extracts one row per imageItemContainer from a year page's HTML."""
+    # <div class="imageItemContainer"><a href="..." class="thumb"><img src="..."></a>
+    # <div class="imageInfo"><span class="imageFrDimension">...</span>
+    containers = extract_containers(content, extractor or EXTRACTOR)
+
+    items = []
+    for img_index, (href, src, date_title) in enumerate(containers):
+        # Handle relative URLs if necessary, though site seems to use protocol-relative //
+        items.append({
+            "year": year,
+            "date_title_raw": date_title,
+            "image_url": normalize_url(href) if href else "",
+            "thumbnail_url": normalize_url(src) if src else "",
+            "source_page": f"{url}/1/{img_index}"
+        })
+    return items
+
+
+def fetch_year(session, limiter, year, page_state=None):
+    """
+    Fetches and parses one year page. If `page_state` holds validators from a previous run,
+    sends a conditional request and skips parsing when the page has not changed.
+    Returns (year, status, items, new_page_state) where status is one of
+    "changed", "not_modified", "unchanged" or "error".
+    """
+    url = f"{BASE_URL}/{year}"
+    headers = {}
+    if page_state:
+        if page_state.get("etag"):
+            headers["If-None-Match"] = page_state["etag"]
+        if page_state.get("last_modified"):
+            headers["If-Modified-Since"] = page_state["last_modified"]
 
-def scrape_polaroids():
-    base_url = "https://egonzippel.com/polaroids"
-    current_year = 2026 # Based on prompt date
-    start_year = 1989
-    
-    # Range is inclusive of current_year
-    years = range(start_year, current_year + 1)
-    
-    all_data = []
-    
-    # Headers for CSV
-    headers = ["year", "date_title_raw", "image_url", "thumbnail_url", "source_page"]
-    
-    print(f"Starting scrape for years {start_year} to {current_year}...")
-    
-    for year in years:
-        url = f"{base_url}/{year}"
-        print(f"Scraping {url}...")
-        
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx, 5xx) 
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Find all image containers
-            # <div class="imageItemContainer">
-            containers = soup.find_all("div", class_="imageItemContainer")
-            
-            if not containers:
-                print(f"  No image containers found for year {year}. (Could be empty or layout changed)")
-                continue
-                
-            print(f"  Found {len(containers)} images for {year}.")
-            
-            for img_index, container in enumerate(containers):
-                try:
-                    # Extract Link and Image URL
-                    # <a href="..." ... class="thumb" ...>
-                    link_tag = container.find("a", class_="thumb")
-                    
-                    full_image_url = ""
-                    thumbnail_url = ""
-                    
-                    if link_tag and link_tag.get("href"):
-                        # Handle relative URLs if necessary, though site seems to use protocol-relative //
-                        href = link_tag.get("href")
-                        if href.startswith("//"):
-                            full_image_url = "https:" + href
-                        elif href.startswith("/"):
-                            full_image_url = "https://egonzippel.com" + href
-                        else:
-                            full_image_url = href
-                    
-                    # Extract Thumbnail URL from inner img
-                    img_tag = link_tag.find("img") if link_tag else None
-                    if img_tag and img_tag.get("src"):
-                        src = img_tag.get("src")
-                        if src.startswith("//"):
-                            thumbnail_url = "https:" + src
-                        elif src.startswith("/"):
-                            thumbnail_url = "https://egonzippel.com" + src
-                        else:
-                            thumbnail_url = src
-
-                    # Extract Date/Title
-                    # <div class="imageInfo"><span class="imageFrDimension">...</span>
-                    info_div = container.find("div", class_="imageInfo")
-                    date_title = ""
-                    if info_div:
-                        span = info_div.find("span", class_="imageFrDimension")
-                        if span:
-                            date_title = span.get_text(strip=True)
-                    
-                    # Store data
-                    all_data.append({
-                        "year": year,
-                        "date_title_raw": date_title,
-                        "image_url": full_image_url,
-                        "thumbnail_url": thumbnail_url,
-                        "source_page": f"{url}/1/{img_index}"
-                    })
-                    
-                except Exception as e:
-                    print(f"  Error processing an item in {year}: {e}")
-                    continue
-
-            # Be polite to the server
-            time.sleep(1) 
-            
-        except requests.exceptions.RequestException as e:
-            print(f"  Network error scraping {year}: {e}")
-        except Exception as e:
-            print(f"  Unexpected error scraping {year}: {e}")
-            
-    # Save to CSV
-    output_file = "polaroids_data.csv"
     try:
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
+        with METRICS.timer("scrape_rate_limit_wait_seconds"):
+            limiter.acquire(url) # Be polite to the server
+        with METRICS.timer("scrape_fetch_seconds"):
+            response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        METRICS.add("scrape_bytes", len(response.content))
+        METRICS.add(f"scrape_http_{response.status_code}")
+
+        if response.status_code == 304 and page_state:
+            print(f"  {year} not modified.")
+            return year, "not_modified", None, page_state
+
+        response.raise_for_status() # Raise HTTPError for bad responses (4xx, 5xx)
+
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        new_page_state = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": content_hash,
+        }
+        if page_state and page_state.get("sha256") == content_hash:
+            print(f"  {year} unchanged (same content hash).")
+            new_page_state["item_count"] = page_state.get("item_count")
+            return year, "unchanged", None, new_page_state
+
+        with METRICS.timer("scrape_parse_seconds"):
+            items = parse_year_page(response.content, url, year)
+        if not items:
+            print(f"  No image containers found for year {year}. (Could be empty or layout changed)")
+        else:
+            print(f"  Found {len(items)} images for {year}.")
+        new_page_state["item_count"] = len(items)
+        return year, "changed", items, new_page_state
+
+    except requests.exceptions.RequestException as e:
+        print(f"  Network error scraping {year}: {e}")
+    except Exception as e:
+        print(f"  Unexpected error scraping {year}: {e}")
+    return year, "error", None, page_state
+
+
+def write_csv(rows, output_file=OUTPUT_FILE):
+    """Writes scraped rows to the CSV file atomically. Returns True on success."""
+    tmp_file = output_file + ".tmp"
+    try:
+        with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
             writer.writeheader()
-            writer.writerows(all_data)
-        print(f"\nScraping complete. Collected {len(all_data)} items.")
-        print(f"Data saved to {output_file}")
+            writer.writerows(rows)
+        os.replace(tmp_file, output_file)
+        return True
     except IOError as e:
         print(f"Error writing to file {output_file}: {e}")
+        return False
+
+
+def read_csv_by_year(csv_path=OUTPUT_FILE):
+    """Loads an existing scrape CSV as {year: [rows]}, preserving row order within each year."""
+    rows_by_year = {}
+    if not os.path.exists(csv_path):
+        return rows_by_year
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                year = int(row.get("year"))
+            except (TypeError, ValueError):
+                continue
+            rows_by_year.setdefault(year, []).append(row)
+    return rows_by_year
+
+
+def load_scrape_state(state_path=STATE_FILE):
+    """Loads per-year validators ({year: {etag, last_modified, sha256, item_count}})."""
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r') as f:
+            return {int(year): entry for year, entry in json.load(f).items()}
+    except (IOError, ValueError) as e:
+        print(f"Warning: Could not read {state_path} ({e}). Doing a full rescrape.")
+        return {}
+
+
+def save_scrape_state(state, state_path=STATE_FILE):
+    """Atomically writes the per-year validators."""
+    tmp_path = state_path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({str(year): state[year] for year in sorted(state)}, f, indent=2)
+        os.replace(tmp_path, state_path)
+    except IOError as e:
+        print(f"Error writing scrape state {state_path}: {e}")
+
+
+def scrape_polaroids(workers=SCRAPE_WORKERS, requests_per_second=REQUESTS_PER_SECOND, burst=RATE_BURST,
+                     incremental=False):
+    """
+    Scrapes every year page concurrently and writes them to the CSV in year order.
+    Total time is bounded by the per-host rate limit rather than serial round trips.
+
+    With `incremental`, year pages are fetched conditionally using the validators in
+    STATE_FILE and only the years whose content changed are merged into the existing CSV.
+    """
+    # Range is inclusive of CURRENT_YEAR
+    years = range(START_YEAR, CURRENT_YEAR + 1)
+
+    mode = "incremental" if incremental else "full"
+    print(f"Starting {mode} scrape for years {START_YEAR} to {CURRENT_YEAR} "
+          f"({workers} workers, {requests_per_second} req/s)...")
+
+    existing_rows = read_csv_by_year(OUTPUT_FILE) if incremental else {}
+    state = load_scrape_state(STATE_FILE) if incremental else {}
+
+    def validators_for(year):
+        # Only trust the validators if the CSV still holds the rows they describe
+        entry = state.get(year)
+        if entry and entry.get("item_count") == len(existing_rows.get(year, [])):
+            return entry
+        return None
+
+    session = make_session(workers)
+    limiter = HostRateLimiter(requests_per_second, burst)
+    rows_by_year = dict(existing_rows)
+    changed_years = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_year, session, limiter, year, validators_for(year)) for year in years]
+        for future in as_completed(futures):
+            year, status, items, page_state = future.result()
+            METRICS.add(f"scrape_pages_{status}")
+            if status == "changed":
+                if items or not existing_rows.get(year):
+                    rows_by_year[year] = items
+                    changed_years.append(year)
+                    state[year] = page_state
+                else:
+                    print(f"  Keeping {len(existing_rows[year])} existing rows for {year}; the new page had none.")
+            elif status in ("not_modified", "unchanged"):
+                state[year] = page_state
+    session.close()
+
+    if incremental and not changed_years and os.path.exists(OUTPUT_FILE):
+        save_scrape_state(state, STATE_FILE)
+        print(f"\nNo year pages changed. {OUTPUT_FILE} left as is.")
+        return [row for year in sorted(rows_by_year) for row in rows_by_year[year]]
+
+    # Keep the output identical to a serial scrape: years ascending, page order within a year
+    all_data = [row for year in sorted(rows_by_year) for row in rows_by_year[year]]
+
+    with METRICS.timer("scrape_write_csv_seconds"):
+        written = write_csv(all_data, OUTPUT_FILE)
+    if written:
+        if incremental:
+            save_scrape_state(state, STATE_FILE)
+            print(f"\nMerged {len(changed_years)} changed year(s): {sorted(changed_years)}.")
+        print(f"\nScraping complete. Collected {len(all_data)} items.")
+        print(f"Data saved to {OUTPUT_FILE}")
+    return all_data
+
 
 if __name__ == "__main__":
-    scrape_polaroids()
+    parser = argparse.ArgumentParser(description="Scrape egonzippel.com polaroid year pages into a CSV.")
+    parser.add_argument("--workers", type=int, default=SCRAPE_WORKERS, help="Concurrent page fetches.")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Requests per second per host.")
+    parser.add_argument("--burst", type=int, default=RATE_BURST, help="Back-to-back requests allowed per host.")
+    parser.add_argument("--extractor", default=EXTRACTOR, choices=["auto", *EXTRACTORS],
+                        help="HTML extraction backend.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Conditionally refetch year pages and merge only changed years into {OUTPUT_FILE}.")
+    parser.add_argument("--metrics-port", type=int, help="Expose Prometheus metrics on this local port during the run.")
+    args = parser.parse_args()
+    EXTRACTOR = args.extractor
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    METRICS.set_info(workers=args.workers, requests_per_second=args.rate, burst=args.burst,
+                     extractor=args.extractor, incremental=args.incremental)
+    try:
+        scrape_polaroids(workers=args.workers, requests_per_second=args.rate, burst=args.burst,
+                         incremental=args.incremental)
+    finally:
+        report_path = METRICS.write_report("scrape_polaroids")
+        if report_path:
+            print(f"Metrics report saved to {report_path} (python metrics.py show).")
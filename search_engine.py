@@ -0,0 +1,500 @@
+"""
+On-disk inverted index and field-weighted BM25 search over the image metadata.
+
+The index lives in a SQLite file: one posting per (term, record) with per-field term
+frequencies and token positions, plus per-record field lengths and a slim display
+record. Queries use the same syntax as the web page (search_logic.js): quoted
+phrases, `term~` for fuzzy matching (edit distance 1, automatic for terms of 8+
+characters), a four-digit year and month names as filters. Field weights match
+the page's Lunr boosts.
+
+The index is updated incrementally: `sync` only re-indexes records whose content
+changed and drops records that are gone. populate_ai_data calls it after every
+run once the index has been built.
+
+    python search_engine.py build [--rebuild]
+    python search_engine.py query '"waiting for" train 2011'
+    python search_engine.py serve [--port 8765]     # GET /search?q=...&year=&month=&limit=
+"""
+import argparse
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from analysis_cache import sha256_hex
+from export_search_index import slim_record
+from metadata_store import METADATA_FILE, STORE_FILE, open_store
+
+SEARCH_INDEX_FILE = "search_index.db"
+FIELDS = ("filename", "ocr_text", "visual_description", "keywords")
+FIELD_BOOSTS = (5, 10, 2, 15) # Same as the Lunr boosts in search_logic.js
+BM25_K1 = 1.2
+BM25_B = 0.75
+FUZZY_WEIGHT = 0.5 # Score multiplier for a fuzzy (non-exact) term match
+AUTO_FUZZY_LENGTH = 8 # Query terms this long get fuzzy matching without `~`, like the page
+DEFAULT_LIMIT = 50
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or "
+    "our she so that the their them then there these they this to was we were will with you your".split()
+)
+MONTH_NAMES = ("january", "february", "march", "april", "may", "june",
+               "july", "august", "september", "october", "november", "december")
+TOKEN_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+QUERY_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def normalize_token(token):
+    """Light English stemming: possessives and regular plurals."""
+    if token.endswith("'s"):
+        token = token[:-2]
+    token = token.replace("'", "")
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def analyze(text):
+    """Yields (position, term) for every token of `text`, stop words included (phrases need them)."""
+    for position, match in enumerate(TOKEN_RE.finditer((text or "").lower())):
+        term = normalize_token(match.group())
+        if term:
+            yield position, term
+
+
+def record_fields(record):
+    """The four indexed texts of a record, in FIELDS order."""
+    analysis = record.get("ai_analysis") or {}
+    if analysis.get("error"):
+        analysis = {}
+    filename = (record.get("filename") or "").rsplit(".", 1)[0]
+    return (filename, analysis.get("ocr_text") or "", analysis.get("visual_description") or "",
+            " ".join(analysis.get("keywords") or []))
+
+
+def record_digest(record):
+    return sha256_hex(json.dumps(slim_record(record), sort_keys=True))
+
+
+def within_one_edit(a, b):
+    """True if `a` and `b` differ by at most one insertion, deletion or substitution."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:] or (len(a) == len(b) and a[i + 1:] == b[i + 1:])
+
+
+def deletions(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def parse_query(query):
+    """
+    Splits a page-style query into (terms, phrases, year, month). Terms are (term, fuzzy)
+    pairs without stop words; phrases are lists of (offset, term) pairs.
+    """
+    terms, phrases, year, month = [], [], None, None
+    month_abbreviations = [name[:3] for name in MONTH_NAMES]
+    for phrase, word in QUERY_RE.findall(query):
+        if phrase:
+            tokens = list(analyze(phrase))
+            if tokens:
+                start = tokens[0][0]
+                phrases.append([(position - start, term) for position, term in tokens])
+            continue
+        lower = word.lower()
+        if re.fullmatch(r"\d{4}", word):
+            year = word
+            continue
+        if lower in MONTH_NAMES or lower in month_abbreviations:
+            month = f"{month_abbreviations.index(lower[:3]) + 1:02d}"
+            continue
+        fuzzy = word.endswith("~") or len(word) >= AUTO_FUZZY_LENGTH
+        for _, term in analyze(word.rstrip("~")):
+            if term not in STOP_WORDS:
+                terms.append((term, fuzzy and len(term) > 1))
+    return terms, phrases, year, month
+
+
+class SearchIndex:
+    """
+    Inverted index in a WAL-mode SQLite file; safe to query from several threads.
+
+    Each term maps to one posting list row: packed record ids and their BM25F term
+    weights (idf is applied at query time). Token positions are kept per (term, record)
+    for phrase checks. Field length averages are fixed when the index is first built
+    (`rebuild` refreshes them), so an incremental update only rewrites the posting
+    lists of the terms it touches.
+    """
+
+    def __init__(self, db_path=SEARCH_INDEX_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id INTEGER PRIMARY KEY,"
+            " filename TEXT UNIQUE NOT NULL,"
+            " year TEXT, month TEXT, day TEXT,"
+            " lengths TEXT NOT NULL,"
+            " terms TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " record TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT PRIMARY KEY,"
+            " doc_ids BLOB NOT NULL,"
+            " weights BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS positions ("
+            " term TEXT NOT NULL,"
+            " doc_id INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (term, doc_id)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self._load_stats()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load_stats(self):
+        """Keeps record filters in memory; the postings stay on disk."""
+        self.docs = {
+            doc_id: (year, month)
+            for doc_id, year, month in self.conn.execute("SELECT doc_id, year, month FROM docs")
+        }
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'avg_lengths'").fetchone()
+        self.avg_lengths = json.loads(row[0]) if row else None
+        self.fuzzy_map = None # deletion variant -> terms, built on the first fuzzy query
+
+    def count(self):
+        return len(self.docs)
+
+    # --- Indexing ---
+
+    def _term_weight(self, freqs, lengths):
+        """BM25F: boosted, length-normalized term frequency summed over fields, then saturated."""
+        tf = sum(boost * freq / (1 - BM25_B + BM25_B * length / avg)
+                 for boost, freq, length, avg in zip(FIELD_BOOSTS, freqs, lengths, self.avg_lengths) if freq)
+        return tf * (BM25_K1 + 1) / (BM25_K1 + tf)
+
+    def _write_doc(self, record, digest, doc_id, removed):
+        """Stores one record and its positions. Returns (doc_id, {term: positions per field}, lengths)."""
+        term_positions = defaultdict(lambda: [[] for _ in FIELDS])
+        lengths = []
+        for field_idx, text in enumerate(record_fields(record)):
+            tokens = list(analyze(text))
+            lengths.append(len(tokens))
+            for position, term in tokens:
+                term_positions[term][field_idx].append(position)
+
+        if doc_id is not None:
+            old_terms = json.loads(self.conn.execute("SELECT terms FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0])
+            self.conn.executemany("DELETE FROM positions WHERE term = ? AND doc_id = ?", ((t, doc_id) for t in old_terms))
+            for term in old_terms:
+                removed[term].add(doc_id)
+        cursor = self.conn.execute(
+            "INSERT OR REPLACE INTO docs (doc_id, filename, year, month, day, lengths, terms, digest, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc_id, record["filename"], record.get("year"), record.get("month"), record.get("day"),
+             json.dumps(lengths), json.dumps(sorted(term_positions)), digest, json.dumps(slim_record(record))),
+        )
+        doc_id = cursor.lastrowid if doc_id is None else doc_id
+        self.conn.executemany(
+            "INSERT INTO positions (term, doc_id, data) VALUES (?, ?, ?)",
+            ((term, doc_id, json.dumps(positions, separators=(",", ":"))) for term, positions in term_positions.items()),
+        )
+        return doc_id, term_positions, lengths
+
+    def _merge_postings(self, changed, removed):
+        """Rewrites the posting list of every term whose records were added, changed or removed."""
+        additions = defaultdict(dict)
+        for doc_id, term_positions, lengths in changed:
+            for term, positions in term_positions.items():
+                additions[term][doc_id] = self._term_weight([len(p) for p in positions], lengths)
+        for term in set(additions) | set(removed):
+            doc_ids, weights = self._posting_list(term)
+            entries = dict(zip(doc_ids, weights))
+            for doc_id in removed.get(term, ()):
+                entries.pop(doc_id, None)
+            entries.update(additions.get(term, {}))
+            if entries:
+                ordered = sorted(entries)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO postings (term, doc_ids, weights) VALUES (?, ?, ?)",
+                    (term, array("i", ordered).tobytes(), array("f", [entries[d] for d in ordered]).tobytes()),
+                )
+            else:
+                self.conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+
+    def sync(self, records):
+        """
+        Brings the index in line with `records` (any iterable, e.g. MetadataStore.iter_records()):
+        new or changed records are (re)indexed, unchanged ones skipped, missing ones removed.
+        Returns (indexed, removed).
+        """
+        changed, removed = [], defaultdict(set)
+        with self.lock, self.conn:
+            known = {filename: (doc_id, digest) for doc_id, filename, digest
+                     in self.conn.execute("SELECT doc_id, filename, digest FROM docs")}
+            seen = set()
+            for record in records:
+                filename = record.get("filename")
+                if not filename or filename in seen:
+                    continue
+                seen.add(filename)
+                digest = record_digest(record)
+                doc_id, old_digest = known.get(filename, (None, None))
+                if digest != old_digest:
+                    changed.append(self._write_doc(record, digest, doc_id, removed))
+
+            stale = [doc_id for filename, (doc_id, _) in known.items() if filename not in seen]
+            for doc_id in stale:
+                old_terms = json.loads(self.conn.execute("SELECT terms FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0])
+                self.conn.executemany("DELETE FROM positions WHERE term = ? AND doc_id = ?", ((t, doc_id) for t in old_terms))
+                self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+                for term in old_terms:
+                    removed[term].add(doc_id)
+
+            if self.avg_lengths is None and changed:
+                # First build: fix the field length averages the weights are computed with
+                totals = [0] * len(FIELDS)
+                for (lengths,) in self.conn.execute("SELECT lengths FROM docs"):
+                    totals = [total + length for total, length in zip(totals, json.loads(lengths))]
+                count = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+                self.avg_lengths = [max(total / count, 1.0) for total in totals]
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('avg_lengths', ?)",
+                                  (json.dumps(self.avg_lengths),))
+            if changed or removed:
+                self._merge_postings(changed, removed)
+                self._load_stats()
+        return len(changed), len(stale)
+
+    def rebuild(self, records):
+        """Drops the index and builds it again from `records`, refreshing the length averages."""
+        with self.lock, self.conn:
+            for table in ("meta", "docs", "postings", "positions"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._load_stats()
+        return self.sync(records)
+
+    # --- Querying ---
+
+    def _posting_list(self, term):
+        """(record ids, weights) for `term`, as arrays decoded straight from the stored blobs."""
+        row = self.conn.execute("SELECT doc_ids, weights FROM postings WHERE term = ?", (term,)).fetchone()
+        doc_ids, weights = array("i"), array("f")
+        if row:
+            doc_ids.frombytes(row[0])
+            weights.frombytes(row[1])
+        return doc_ids, weights
+
+    def _expand_fuzzy(self, term):
+        if self.fuzzy_map is None:
+            self.fuzzy_map = defaultdict(set)
+            for (vocab_term,) in self.conn.execute("SELECT term FROM postings"):
+                self.fuzzy_map[vocab_term].add(vocab_term)
+                for variant in deletions(vocab_term):
+                    self.fuzzy_map[variant].add(vocab_term)
+        candidates = set(self.fuzzy_map.get(term, ()))
+        for variant in deletions(term):
+            candidates |= self.fuzzy_map.get(variant, set())
+        return {candidate for candidate in candidates if within_one_edit(term, candidate)}
+
+    def _score_term(self, term, scores, weight=1.0, allowed=None):
+        doc_ids, weights = self._posting_list(term)
+        if not doc_ids:
+            return
+        idf = math.log(1 + (len(self.docs) - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5)) * weight
+        if allowed is None:
+            for doc_id, term_weight in zip(doc_ids, weights):
+                scores[doc_id] += idf * term_weight
+        else:
+            for doc_id, term_weight in zip(doc_ids, weights):
+                if doc_id in allowed:
+                    scores[doc_id] += idf * term_weight
+
+    def _phrase_docs(self, phrase, allowed=None):
+        """Records containing the phrase's terms at consecutive positions within one field."""
+        terms = {term for _, term in phrase}
+        candidates = None
+        for doc_ids in sorted((self._posting_list(term)[0] for term in terms), key=len):
+            candidates = set(doc_ids) if candidates is None else candidates.intersection(doc_ids)
+            if not candidates:
+                return set()
+        if allowed is not None:
+            candidates &= allowed
+
+        matches = set()
+        for doc_id in candidates:
+            per_term = {
+                term: json.loads(self.conn.execute(
+                    "SELECT data FROM positions WHERE term = ? AND doc_id = ?", (term, doc_id)
+                ).fetchone()[0])
+                for term in terms
+            }
+            for field_idx in range(len(FIELDS)):
+                starts = {p - phrase[0][0] for p in per_term[phrase[0][1]][field_idx]}
+                for offset, term in phrase[1:]:
+                    starts &= {p - offset for p in per_term[term][field_idx]}
+                if starts:
+                    matches.add(doc_id)
+                    break
+        return matches
+
+    def search(self, query, year=None, month=None, limit=DEFAULT_LIMIT):
+        """
+        Runs a page-style query. Returns (total, results) where results are the best
+        `limit` slim records with a "score", best first.
+        """
+        terms, phrases, query_year, query_month = parse_query(query)
+        year, month = year or query_year, month or query_month
+        with self.lock:
+            allowed = None
+            if year or month:
+                allowed = {doc_id for doc_id, (doc_year, doc_month) in self.docs.items()
+                           if (not year or doc_year == year) and (not month or doc_month == month)}
+            for phrase in phrases:
+                allowed = self._phrase_docs(phrase, allowed)
+
+            scores = defaultdict(float)
+            for term, fuzzy in terms:
+                self._score_term(term, scores, allowed=allowed)
+                if fuzzy:
+                    for variant in self._expand_fuzzy(term) - {term}:
+                        self._score_term(variant, scores, FUZZY_WEIGHT, allowed)
+            for phrase in phrases:
+                for term in {term for _, term in phrase} - STOP_WORDS:
+                    self._score_term(term, scores, allowed=allowed)
+
+            if not terms and not phrases:
+                scores = dict.fromkeys(allowed or (), 0.0) # Date-only query: every record in range
+            elif phrases:
+                for doc_id in allowed:
+                    scores.setdefault(doc_id, 0.0) # Phrases of stop words only still match
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+            results = []
+            for doc_id, score in best:
+                record = json.loads(self.conn.execute("SELECT record FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0])
+                record["score"] = round(score, 4)
+                results.append(record)
+        return len(scores), results
+
+
+def build_index(index_path=SEARCH_INDEX_FILE, db_path=STORE_FILE, json_path=METADATA_FILE, rebuild=False):
+    """Creates or incrementally updates the index from the metadata store."""
+    with open_store(db_path, json_path) as store, SearchIndex(index_path) as index:
+        records = store.iter_records()
+        indexed, removed = index.rebuild(records) if rebuild else index.sync(records)
+        return indexed, removed, index.count()
+
+
+def serve(index, host="127.0.0.1", port=8765):
+    """Serves GET /search?q=...&year=&month=&limit= as JSON until interrupted."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") != "/search":
+                self._send(404, {"error": f"No route for {url.path}"})
+                return
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                limit = int(params.get("limit", DEFAULT_LIMIT))
+            except ValueError:
+                self._send(400, {"error": "limit must be an integer"})
+                return
+            start = time.perf_counter()
+            total, results = index.search(params.get("q", ""), params.get("year"), params.get("month"), limit)
+            self._send(200, {
+                "query": params.get("q", ""),
+                "total": total,
+                "took_ms": round((time.perf_counter() - start) * 1000, 2),
+                "results": results,
+            })
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    print(f"Search endpoint listening on http://{host}:{port}/search?q=... ({index.count()} records)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, query or serve the local search index.")
+    parser.add_argument("command", choices=["build", "query", "serve"])
+    parser.add_argument("query", nargs="?", default="", help="Query text (query command).")
+    parser.add_argument("--index", default=SEARCH_INDEX_FILE, help="Search index path.")
+    parser.add_argument("--db", default=STORE_FILE, help="Metadata store to index (build).")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild from scratch instead of updating (build).")
+    parser.add_argument("--year", help="Only records from this year.")
+    parser.add_argument("--month", help="Only records from this month (01-12).")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        indexed, removed, total = build_index(args.index, args.db, rebuild=args.rebuild)
+        print(f"Indexed {indexed} new or changed records, removed {removed}; {total} records in {args.index} "
+              f"({time.perf_counter() - start:.1f} s).")
+    elif args.command == "query":
+        with SearchIndex(args.index) as index:
+            start = time.perf_counter()
+            total, results = index.search(args.query, args.year, args.month, args.limit)
+            took = (time.perf_counter() - start) * 1000
+            for record in results:
+                ocr = (record.get("ai_analysis") or {}).get("ocr_text", "")
+                print(f"{record['score']:8.2f}  {record['filename']:<22} {ocr[:70]}")
+            print(f"{total} matching records ({took:.1f} ms).")
+    else:
+        with SearchIndex(args.index) as index:
+            serve(index, args.host, args.port)
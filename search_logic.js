@@ -6,9 +6,20 @@ document.addEventListener('DOMContentLoaded', () => {
     const resultsCount = document.getElementById('resultsCount');
 
     const DATA_URL = 'https://pub-2bf02060093645f29ead1fe093065db8.r2.dev/image_metadata_search.json';
+    // Resized WebP/AVIF copies written by derivatives.py are uploaded next to the data file
+    const DERIVATIVES_BASE_URL = 'https://pub-2bf02060093645f29ead1fe093065db8.r2.dev/';
+
+    // Prebuilt per-year Lunr shards from export_search_index.py; without them the page
+    // falls back to DATA_URL and builds the whole index in the browser
+    const SEARCH_INDEX_URL = 'https://pub-2bf02060093645f29ead1fe093065db8.r2.dev/search_index/';
+    const SHARD_MANIFEST_VERSION = 2;
 
     let allImageData = [];
     let lunrIndex;
+    let shardManifest = null; // Set while searching the prebuilt shards
+    const shardCache = new Map(); // Shard file name -> Promise of its records or its loaded Lunr index
+    let totalImages = 0;
+    let searchGeneration = 0; // Drops results of a search overtaken by a newer one while shards load
 
     function initializeLunrIndex(data) {
         lunrIndex = lunr(function () {
@@ -32,30 +43,184 @@ document.addEventListener('DOMContentLoaded', () => {
         console.log("Lunr.js index created.");
     }
 
-    async function loadData() {
+    async function fetchJSON(url) {
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+    }
+
+    function markSearchReady() {
+        performance.mark('search-ready');
+        statusMessage.textContent = `Data loaded. ${totalImages} images available. Ready to search.`;
+        if (totalImages > 0) {
+            // Don't display any results initially, just show the count message
+            resultsCount.textContent = `Enter search terms to find images among ${totalImages} items.`;
+        }
+    }
+
+    async function loadShardManifest() {
+        if (typeof lunr.Index.load !== 'function') {
+            throw new Error('lunr.Index.load is not available');
+        }
+        const manifest = await fetchJSON(`${SEARCH_INDEX_URL}manifest.json`);
+        if (manifest.version !== SHARD_MANIFEST_VERSION || !Array.isArray(manifest.shards) || !manifest.all) {
+            throw new Error(`Unsupported shard manifest version ${manifest.version}`);
+        }
+        return manifest;
+    }
+
+    function loadShardFile(file, parse = data => data) {
+        // One download per file however many searches need it; a failed load can be retried
+        if (!shardCache.has(file)) {
+            const loading = fetchJSON(SEARCH_INDEX_URL + file).then(parse);
+            loading.catch(() => shardCache.delete(file));
+            shardCache.set(file, loading);
+        }
+        return shardCache.get(file);
+    }
+
+    function loadIndex(file) {
+        return loadShardFile(file, serializedIndex => lunr.Index.load(serializedIndex));
+    }
+
+    async function loadShard(shard) {
+        const [index, records] = await Promise.all([loadIndex(shard.index), loadShardFile(shard.records)]);
+        return { records, index };
+    }
+
+    async function loadAllYears() {
+        // Scores from different year indexes are not comparable (each has its own term
+        // statistics), so a query without a year runs on the index over all years
+        const [index, ...parts] = await Promise.all([
+            loadIndex(shardManifest.all.index),
+            ...shardManifest.shards.map(shard => loadShardFile(shard.records)),
+        ]);
+        return { records: [].concat(...parts), index };
+    }
+
+    async function loadFullData() {
         statusMessage.textContent = 'Loading image data...';
+        allImageData = await fetchJSON(DATA_URL);
+        initializeLunrIndex(allImageData);
+        totalImages = allImageData.length;
+        console.log("Image data loaded:", allImageData.length);
+    }
+
+    async function loadData() {
+        statusMessage.textContent = 'Loading search index...';
         try {
-            const response = await fetch(DATA_URL);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            // Only the manifest is needed up front; year shards load when a search needs them
+            shardManifest = await loadShardManifest();
+            totalImages = shardManifest.total;
+            console.log(`Search shard manifest loaded: ${shardManifest.shards.length} years, ${totalImages} images.`);
+            markSearchReady();
+            return;
+        } catch (error) {
+            console.warn("Prebuilt search shards unavailable, loading the full data file:", error);
+            shardManifest = null;
+        }
+
+        try {
+            await loadFullData();
+            markSearchReady();
+        } catch (error) {
+            showDataError(error);
+        }
+    }
+
+    function showDataError(error) {
+        console.error("Failed to load image_metadata.json:", error);
+        statusMessage.textContent = `Error loading image data: ${error.message}.`;
+        searchResultsContainer.innerHTML = '<p style="color: red;">Could not load image data. Search is unavailable.</p>';
+    }
+
+    async function switchToFullData(error) {
+        console.warn("Loading a search shard failed, switching to the full data file:", error);
+        shardManifest = null;
+        shardCache.clear();
+        await loadFullData();
+    }
+
+    async function searchSources(queryYear) {
+        // The { records, index } pairs a search runs over: the year shards it needs, or all data
+        if (shardManifest) {
+            const shards = queryYear
+                ? shardManifest.shards.filter(shard => shard.year === queryYear)
+                : shardManifest.shards;
+            const files = queryYear
+                ? shards.flatMap(shard => [shard.index, shard.records])
+                : [shardManifest.all.index, ...shards.map(shard => shard.records)];
+            const missing = files.filter(file => !shardCache.has(file)).length;
+            if (missing) {
+                statusMessage.textContent = `Loading ${missing} file(s) of the search index...`;
             }
-            allImageData = await response.json();
-            // Add an 'id' to each item for easier mapping from Lunr results if not using array index directly
-            // allImageData.forEach((item, idx) => item.id = idx); 
-            // The current lunr setup uses array index as ref, so this isn't strictly needed here
-
-            initializeLunrIndex(allImageData);
-            statusMessage.textContent = `Data loaded. ${allImageData.length} images available. Ready to search.`;
-            console.log("Image data loaded:", allImageData.length);
-            if (allImageData.length > 0) {
-                // Don't display any results initially, just show the count message
-                resultsCount.textContent = `Enter search terms to find images among ${allImageData.length} items.`;
+            try {
+                return queryYear ? await Promise.all(shards.map(loadShard)) : [await loadAllYears()];
+            } catch (error) {
+                await switchToFullData(error);
+            }
+        }
+        return [{ records: allImageData, index: lunrIndex }];
+    }
+
+    async function browseSubset(sortOrder, count) {
+        // The first (or newest) `count` records, loading only as many year shards as that takes
+        if (!shardManifest) {
+            return sortOrder === 'desc' ? allImageData.slice(-count) : allImageData.slice(0, count);
+        }
+        const shards = sortOrder === 'desc' ? [...shardManifest.shards].reverse() : shardManifest.shards;
+        let subset = [];
+        try {
+            for (const shard of shards) {
+                const records = await loadShardFile(shard.records);
+                subset = sortOrder === 'desc' ? records.concat(subset) : subset.concat(records);
+                if (subset.length >= count) {
+                    break;
+                }
             }
         } catch (error) {
-            console.error("Failed to load image_metadata.json:", error);
-            statusMessage.textContent = `Error loading image data: ${error.message}.`;
-            searchResultsContainer.innerHTML = '<p style="color: red;">Could not load image data. Search is unavailable.</p>';
+            await switchToFullData(error);
+            return browseSubset(sortOrder, count);
         }
+        return sortOrder === 'desc' ? subset.slice(-count) : subset.slice(0, count);
+    }
+
+    function derivativeUrl(path) {
+        // Encode each segment: spaces and commas would split the srcset candidate, '#', '?' and '%' break the URL
+        return DERIVATIVES_BASE_URL + path.split('/').map(encodeURIComponent).join('/');
+    }
+
+    function derivativeSrcset(derivatives, format) {
+        return derivatives.files
+            .filter(file => file.format === format)
+            .map(file => `${derivativeUrl(file.path)} ${file.width}w`)
+            .join(', ');
+    }
+
+    function createPicture(item, img) {
+        // Serve the smallest AVIF/WebP derivative that fits, with the LQIP shown until it loads
+        const derivatives = item.derivatives;
+        const picture = document.createElement('picture');
+        ['avif', 'webp'].forEach(format => {
+            const srcset = derivativeSrcset(derivatives, format);
+            if (srcset) {
+                const source = document.createElement('source');
+                source.type = `image/${format}`;
+                source.srcset = srcset;
+                source.sizes = '(max-width: 600px) 50vw, 320px';
+                picture.appendChild(source);
+            }
+        });
+        img.width = derivatives.width;
+        img.height = derivatives.height;
+        if (derivatives.lqip) {
+            img.style.backgroundImage = `url(${derivatives.lqip})`;
+            img.style.backgroundSize = 'cover';
+        }
+        picture.appendChild(img);
+        return picture;
     }
 
     function createImageElement(item) {
@@ -95,7 +260,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 img.style.boxShadow = 'none';
             });
 
-            link.appendChild(img);
+            link.appendChild(item.derivatives ? createPicture(item, img) : img);
         } else {
             const placeholder = document.createElement('div');
             placeholder.style.cssText = `
@@ -166,7 +331,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (isInitialDisplay) {
             const rangeText = sortOrder === 'desc' ? 'newest' : 'first';
-            resultsCount.textContent = `Displaying ${rangeText} ${sortedResults.length} of ${allImageData.length} images. Refine with search.`;
+            resultsCount.textContent = `Displaying ${rangeText} ${sortedResults.length} of ${totalImages} images. Refine with search.`;
         } else {
             resultsCount.textContent = `${sortedResults.length} image(s) found.`;
         }
@@ -176,7 +341,7 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         if (sortedResults.length === 0 && isInitialDisplay) {
-            resultsCount.textContent = `Enter search terms to find images among ${allImageData.length} items.`;
+            resultsCount.textContent = `Enter search terms to find images among ${totalImages} items.`;
             return;
         }
 
@@ -258,14 +423,79 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function performSearch() {
+    function searchSource({ records, index }, quotedPhrases, textQueryTermsForLunr, queryYear, queryMonth) {
+        // [{ ref, score }] for one index and the records its refs point into
+        const lunrQueryString = textQueryTermsForLunr.join(' ');
+        let searchResults = [];
+
+        // If we have quoted phrases, do a manual exact phrase search first
+        if (quotedPhrases.length > 0) {
+            // Manual phrase search through all items
+            records.forEach((item, idx) => {
+                let matchScore = 0;
+                let matchedPhrases = 0;
+
+                quotedPhrases.forEach(phrase => {
+                    const searchPhrase = phrase.toLowerCase();
+                    const ocrText = (item.ai_analysis?.ocr_text || '').toLowerCase();
+                    const visualDesc = (item.ai_analysis?.visual_description || '').toLowerCase();
+                    const keywords = (item.ai_analysis?.keywords || []).join(' ').toLowerCase();
+
+                    // Check if phrase exists in any field
+                    if (ocrText.includes(searchPhrase)) {
+                        matchScore += 10; // Higher weight for OCR text matches
+                        matchedPhrases++;
+                    }
+                    if (visualDesc.includes(searchPhrase)) {
+                        matchScore += 2;
+                        matchedPhrases++;
+                    }
+                    if (keywords.includes(searchPhrase)) {
+                        matchScore += 5;
+                        matchedPhrases++;
+                    }
+                });
+
+                // Only include if all phrases matched
+                if (matchedPhrases === quotedPhrases.length && matchScore > 0) {
+                    searchResults.push({ ref: idx.toString(), score: matchScore });
+                }
+            });
+
+            // If we also have non-phrase terms, combine with Lunr results
+            if (textQueryTermsForLunr.length > quotedPhrases.length) {
+                const lunrResults = index.search(textQueryTermsForLunr.filter(term => !term.startsWith('"')).join(' '));
+
+                // Merge results, keeping the highest score for each item
+                const resultMap = new Map();
+                searchResults.forEach(r => resultMap.set(r.ref, r.score));
+                lunrResults.forEach(r => {
+                    if (resultMap.has(r.ref)) {
+                        resultMap.set(r.ref, resultMap.get(r.ref) + r.score);
+                    }
+                });
+
+                searchResults = Array.from(resultMap.entries()).map(([ref, score]) => ({ ref, score }));
+            }
+        } else if (lunrQueryString) {
+            // No quoted phrases, use regular Lunr search
+            searchResults = index.search(lunrQueryString);
+        } else if (queryYear || queryMonth) {
+            // If only date terms, consider all documents for date filtering
+            searchResults = records.map((_, idx) => ({ ref: idx.toString(), score: 0 }));
+        }
+
+        return searchResults;
+    }
+
+    async function performSearch() {
         const query = searchInput.value.trim(); // No toLowerCase here, Lunr handles it
 
-        if (!lunrIndex) {
+        if (!shardManifest && !lunrIndex) {
             statusMessage.textContent = "Search index not ready. Please wait for data to load.";
             return;
         }
-        if (allImageData.length === 0) {
+        if (totalImages === 0) {
             statusMessage.textContent = "Image data not loaded. Cannot search.";
             return;
         }
@@ -273,16 +503,19 @@ document.addEventListener('DOMContentLoaded', () => {
         const sortOrder = document.getElementById('sortOrder').value;
 
         if (!query) {
-            // Display subset based on sort order (default 50 items)
+            // Display subset based on sort order (default 50 items): the most recent
+            // items when sorting newest first, else the first ones
+            const generation = ++searchGeneration;
             let subset;
-            if (sortOrder === 'desc') {
-                // If sorting newest first, start with the most recent items (end of the array)
-                subset = allImageData.slice(-50);
-            } else {
-                // If sorting oldest first, start with the first items
-                subset = allImageData.slice(0, 50);
+            try {
+                subset = await browseSubset(sortOrder, 50);
+            } catch (error) {
+                showDataError(error);
+                return;
+            }
+            if (generation === searchGeneration) {
+                displayResults(subset, true);
             }
-            displayResults(subset, true);
             return;
         }
 
@@ -341,73 +574,28 @@ document.addEventListener('DOMContentLoaded', () => {
             textQueryTermsForLunr.push(`"${phrase}"`);
         });
 
-        let lunrQueryString = textQueryTermsForLunr.join(' ');
+        const generation = ++searchGeneration;
+        let sources;
+        try {
+            sources = await searchSources(queryYear);
+        } catch (error) {
+            showDataError(error);
+            return;
+        }
+        if (generation !== searchGeneration) {
+            return; // A newer search started while shards were loading
+        }
         let searchResults = [];
-
-        // If we have quoted phrases, do a manual exact phrase search first
-        if (quotedPhrases.length > 0) {
-            // Manual phrase search through all items
-            allImageData.forEach((item, idx) => {
-                let matchScore = 0;
-                let matchedPhrases = 0;
-
-                quotedPhrases.forEach(phrase => {
-                    const searchPhrase = phrase.toLowerCase();
-                    const ocrText = (item.ai_analysis?.ocr_text || '').toLowerCase();
-                    const visualDesc = (item.ai_analysis?.visual_description || '').toLowerCase();
-                    const keywords = (item.ai_analysis?.keywords || []).join(' ').toLowerCase();
-
-                    // Check if phrase exists in any field
-                    if (ocrText.includes(searchPhrase)) {
-                        matchScore += 10; // Higher weight for OCR text matches
-                        matchedPhrases++;
-                    }
-                    if (visualDesc.includes(searchPhrase)) {
-                        matchScore += 2;
-                        matchedPhrases++;
-                    }
-                    if (keywords.includes(searchPhrase)) {
-                        matchScore += 5;
-                        matchedPhrases++;
-                    }
-                });
-
-                // Only include if all phrases matched
-                if (matchedPhrases === quotedPhrases.length && matchScore > 0) {
-                    searchResults.push({ ref: idx.toString(), score: matchScore });
-                }
+        sources.forEach(source => {
+            searchSource(source, quotedPhrases, textQueryTermsForLunr, queryYear, queryMonth).forEach(result => {
+                searchResults.push({ item: source.records[parseInt(result.ref)], score: result.score });
             });
-
-            // If we also have non-phrase terms, combine with Lunr results
-            if (textQueryTermsForLunr.length > quotedPhrases.length) {
-                const lunrResults = lunrIndex.search(textQueryTermsForLunr.filter(term => !term.startsWith('"')).join(' '));
-
-                // Merge results, keeping the highest score for each item
-                const resultMap = new Map();
-                searchResults.forEach(r => resultMap.set(r.ref, r.score));
-                lunrResults.forEach(r => {
-                    if (resultMap.has(r.ref)) {
-                        resultMap.set(r.ref, resultMap.get(r.ref) + r.score);
-                    }
-                });
-
-                searchResults = Array.from(resultMap.entries()).map(([ref, score]) => ({ ref, score }));
-            }
-        } else if (lunrQueryString) {
-            // No quoted phrases, use regular Lunr search
-            searchResults = lunrIndex.search(lunrQueryString);
-        } else if (queryYear || queryMonth) {
-            // If only date terms, consider all documents for date filtering
-            searchResults = allImageData.map((_, idx) => ({ ref: idx.toString(), score: 0 }));
-        }
+        });
 
         // Sort by score
         searchResults.sort((a, b) => b.score - a.score);
 
-        let filteredResults = searchResults.map(result => {
-            const item = allImageData[parseInt(result.ref)];
-            return { ...item, score: result.score };
-        });
+        let filteredResults = searchResults.map(result => ({ ...result.item, score: result.score }));
 
         // Apply date filtering
         if (queryYear) {
@@ -419,6 +607,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         statusMessage.textContent = '';
         displayResults(filteredResults);
+        performance.mark('search-done');
     }
 
     searchButton.addEventListener('click', performSearch);
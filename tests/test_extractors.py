@@ -0,0 +1,39 @@
+"""Every installed extraction backend in extractors.py agrees with the BeautifulSoup reference."""
+import os
+
+import pytest
+
+from extractors import AUTO_ORDER, EXTRACTORS, extract_bs4
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURES = ("polaroids_2011.html", "polaroids_2024.html")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def test_reference_handles_edge_cases():
+    # polaroids_2011.html holds the odd containers: nested markup, missing links, images and dates
+    items = extract_bs4(load_fixture("polaroids_2011.html"))
+    assert len(items) == 8
+    assert items[1] == ("/images/polaroids/2011/2011-01-04B.jpg", "/images/polaroids/2011/thumbs/2011-01-04B.jpg",
+                        "2011-01-04B")
+    assert items[2][2] == "2011-02-14copy"
+    assert items[3][2] == "2011-03-01.O & friends"
+    assert items[4] == ("//egonzippel.com/images/polaroids/2011/2011-04-15.jpg", "", "2011-04-15")
+    assert items[5][2] == ""
+    assert items[6] == ("", "", "2011-06-10GA")
+    assert items[7][2] == "2011-07-21"
+
+
+@pytest.mark.parametrize("fixture", FIXTURES)
+@pytest.mark.parametrize("backend", AUTO_ORDER)
+def test_backend_matches_bs4(backend, fixture):
+    if backend not in EXTRACTORS:
+        pytest.skip(f"{backend} is not installed")
+    content = load_fixture(fixture)
+    expected = extract_bs4(content)
+    assert EXTRACTORS[backend](content) == expected
+    assert EXTRACTORS[backend](content.decode("utf-8")) == expected
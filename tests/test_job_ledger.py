@@ -0,0 +1,74 @@
+"""Job ledger transitions in metadata_store.MetadataStore."""
+import pytest
+
+from dedup import reuse_duplicate_analyses
+from metadata_store import MetadataStore
+
+ANALYSIS = {"ocr_text": "", "visual_description": "A polaroid.", "keywords": ["polaroid"]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(str(tmp_path / "image_metadata.db"))
+    store.upsert({"filename": "2011-03-04.jpg", "year": "2011", "ai_analysis": dict(ANALYSIS)})
+    store.upsert({"filename": "2012-05-06.jpg", "year": "2012", "ai_analysis": dict(ANALYSIS)})
+    store.sync_jobs()
+    yield store
+    store.close()
+
+
+def job_states(store):
+    return {state: count for state, _, count, _ in store.job_summary()}
+
+
+def test_requeued_job_still_throttled_survives_restart(store):
+    assert store.requeue_jobs(years=["2011"]) == 1
+    store.start_jobs(["2011-03-04.jpg"])
+    store.fail_job("2011-03-04.jpg", "api_retry_needed", retry=True)
+
+    # Next run: the record still holds its old analysis, the rerun must not count as done
+    store.recover_jobs()
+    store.sync_jobs()
+    assert store.pending_jobs() == {"2011-03-04.jpg"}
+
+
+def test_requeued_job_interrupted_in_flight_survives_restart(store):
+    store.requeue_jobs(years=["2012"])
+    store.start_jobs(["2012-05-06.jpg"])
+
+    assert store.recover_jobs() == 1
+    store.sync_jobs()
+    assert store.pending_jobs() == {"2012-05-06.jpg"}
+
+
+def test_throttled_new_job_stays_pending(store):
+    store.upsert({"filename": "2013-01-01.jpg", "year": "2013"})
+    store.sync_jobs()
+    store.start_jobs(["2013-01-01.jpg"])
+    store.fail_job("2013-01-01.jpg", "api_retry_needed", retry=True)
+
+    store.recover_jobs()
+    store.sync_jobs()
+    assert store.pending_jobs() == {"2013-01-01.jpg"}
+    assert job_states(store) == {"done": 2, "pending": 1}
+
+
+def test_finished_rerun_is_done(store):
+    store.requeue_jobs(years=["2011"])
+    store.start_jobs(["2011-03-04.jpg"])
+    store.finish_job("2011-03-04.jpg", "model", "hash")
+
+    store.sync_jobs()
+    assert store.pending_jobs() == set()
+
+
+def test_reused_duplicate_analysis_is_stale_with_its_source(store):
+    store.finish_job("2011-03-04.jpg", "old-model", "hash")
+    store.upsert({"filename": "2011-03-05.jpg", "year": "2011"})
+    store.sync_jobs()
+    hashes = {"2011-03-04.jpg": {"dhash": 0b1011}, "2011-03-05.jpg": {"dhash": 0b1010}}
+
+    assert reuse_duplicate_analyses(store.all_records(), hashes, store) == (1, set())
+    store.sync_jobs()
+    assert store.job_version("2011-03-05.jpg") == ("old-model", "hash")
+    assert store.requeue_jobs(stale=("new-model", "hash")) == 2
@@ -0,0 +1,42 @@
+"""Record iteration in metadata_store.MetadataStore."""
+import threading
+
+import pytest
+
+from metadata_store import MetadataStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(str(tmp_path / "image_metadata.db"))
+    for day in range(1, 4):
+        store.upsert({"filename": f"2011-01-0{day}.jpg", "year": "2011", "month": "01", "day": f"0{day}"})
+    yield store
+    store.close()
+
+
+def test_store_is_usable_while_iterating(store):
+    seen = []
+
+    def iterate():
+        for record in store.iter_records():
+            store.set_field(record["filename"], "checked", True)
+            seen.append(store.get(record["filename"]))
+
+    reader = threading.Thread(target=iterate, daemon=True)
+    reader.start()
+    reader.join(timeout=5)
+    assert not reader.is_alive(), "store calls deadlocked inside iter_records"
+    assert [record["filename"] for record in seen] == ["2011-01-01.jpg", "2011-01-02.jpg", "2011-01-03.jpg"]
+    assert all(record["checked"] for record in seen)
+
+
+def test_abandoned_iteration_does_not_block_writers(store):
+    records = store.iter_records()
+    next(records)
+    writer = threading.Thread(target=store.upsert, args=({"filename": "2011-02-01.jpg", "year": "2011"},),
+                              daemon=True)
+    writer.start()
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+    assert store.count() == 4
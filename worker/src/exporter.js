@@ -14,6 +14,7 @@ const SEARCH_FIELDS = [
   'thumbnail_url',
   'source_page',
   'ai_analysis',
+  'derivatives', // Resized WebP/AVIF copies, added to the metadata by publish.py
 ];
 
 /**
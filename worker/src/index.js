@@ -83,6 +83,21 @@ export default {
       });
     }
 
+    if (url.pathname === '/export' && request.method === 'POST') {
+      // Rebuild the search JSON from the stored metadata without scraping (publish.py calls this)
+      const obj = await env.METADATA_BUCKET.get('image_metadata.json');
+      if (!obj) {
+        return new Response(JSON.stringify({ status: 'error', error: 'image_metadata.json not found' }), {
+          status: 404,
+          headers: { 'Content-Type': 'application/json' },
+        });
+      }
+      const result = await exportSearchJSON(JSON.parse(await obj.text()), env);
+      return new Response(JSON.stringify({ status: 'ok', ...result }, null, 2), {
+        headers: { 'Content-Type': 'application/json' },
+      });
+    }
+
     const limit = parseInt(url.searchParams.get('limit')) || undefined;
     const result = await runPipeline(env, { limit });
     return new Response(JSON.stringify(result, null, 2), {